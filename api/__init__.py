@@ -8,10 +8,18 @@ from .campus_life import *
 from .recruit import *
 from .library import *
 from .important_info import *
+from .admin import *
+from .batch import *
+from .utils.Compression import compress_response
+from .utils.Deadline import apply_deadline
 
-__all__ = ['api_urls', 'authorized', 'LoginApplyType', 'TokenPayload', 'AuthorizedUser']
+__all__ = ['api_urls', 'authorized', 'AuthorizationPolicy', 'LoginApplyType', 'TokenMode', 'TokenPayload',
+           'AuthorizedUser']
 
 api_urls = Blueprint.group(notification_blueprint, authorization_blueprint, edu_admin_center_blueprint,
                            course_score_query_blueprint, campus_life_blueprint, recruit_blueprint, library_blueprint,
-                           important_info_blueprint,
+                           important_info_blueprint, admin_blueprint, batch_blueprint,
                            version=1)
+
+api_urls.middleware(apply_deadline, 'request')
+api_urls.middleware(compress_response, 'response')
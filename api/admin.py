@@ -0,0 +1,93 @@
+import os
+from typing import List, Dict, Any
+
+from pydantic import BaseModel, Field, ConfigDict
+from sanic import Request, Blueprint, Sanic
+from sanic.log import logger
+
+from .authorization import authorized, LoginApplyType
+from .utils.ApiInterface import api_request, api_response
+
+from utils.Metrics import MetricsRegistry
+
+__all__ = ['admin_blueprint']
+
+admin_blueprint = Blueprint('Admin', url_prefix='/admin')
+
+
+class _RoutePolicy(BaseModel):
+    name: str = Field(title='路由名称')
+    path: str = Field(title='路由路径')
+    methods: List[str] = Field(title='请求方法')
+    public: bool = Field(title='是否无需token即可访问')
+    apply_types: List[LoginApplyType] = Field(title='可访问该路由的请求类型')
+    need_user: bool = Field(title='是否需要token中携带用户信息')
+
+
+class _PolicyReportResponse(BaseModel):
+    routes: List[_RoutePolicy] = Field(title='各路由权限策略')
+
+    model_config = ConfigDict(title="权限策略报告回传值")
+
+
+def build_policy_report(app: Sanic) -> List[_RoutePolicy]:
+    """
+    根据路由注册时编译的权限策略，列出各请求类型可访问的api_urls路由
+    """
+    from api import api_urls
+
+    blueprint_names = {blueprint.name for blueprint in api_urls.blueprints}
+    report = []
+    for route in app.router.routes:
+        name_parts = route.name.split('.')
+        if len(name_parts) < 3 or name_parts[1] not in blueprint_names:
+            continue
+        policy = getattr(route.handler, 'authorization_policy', None)
+        report.append(_RoutePolicy(
+            name=route.name, path='/' + route.path, methods=sorted(route.methods), public=policy is None,
+            apply_types=[apply_type for apply_type in LoginApplyType
+                         if policy is None or apply_type.value in policy.allowed],
+            need_user=policy.need_user if policy is not None else False
+        ))
+    return sorted(report, key=lambda x: x.path)
+
+
+@admin_blueprint.listener('after_server_start')
+async def _log_policy_report(app: Sanic):
+    for route in build_policy_report(app):
+        logger.info(f"{','.join(route.methods)} {route.path} -> "
+                    f"{'public' if route.public else ','.join(route.apply_types)}"
+                    f"{' (need user)' if route.need_user else ''}")
+
+
+@admin_blueprint.get(uri='policies')
+@api_request()
+@api_response(_PolicyReportResponse)
+@authorized(include=[LoginApplyType.Admin])
+async def fetch_policy_report(request: Request):
+    """
+    获取各路由权限策略
+
+    **仅支持Admin调用**
+    """
+    return _PolicyReportResponse(routes=build_policy_report(request.app))
+
+
+class _MetricsResponse(BaseModel):
+    worker_pid: int = Field(title='处理该请求的worker进程号', description='指标按worker独立统计')
+    metrics: Dict[str, Dict[str, Any]] = Field(title='各组件运行指标')
+
+    model_config = ConfigDict(title="运行指标回传值")
+
+
+@admin_blueprint.get(uri='metrics')
+@api_request()
+@api_response(_MetricsResponse)
+@authorized(include=[LoginApplyType.Admin])
+async def fetch_metrics(request: Request):
+    """
+    获取网关运行指标
+
+    **仅支持Admin调用**
+    """
+    return _MetricsResponse(worker_pid=os.getpid(), metrics=MetricsRegistry().collect())
@@ -1,20 +1,30 @@
+import asyncio
+import hashlib
 import inspect
+import secrets
 from datetime import datetime, timedelta
 from enum import StrEnum
 from functools import wraps
 from typing import Optional, Type, Any
 
 from pydantic import BaseModel, ValidationError, Field, ConfigDict
-from sanic import Request, Blueprint
+from sanic import Request, Blueprint, Sanic
+from sanic.log import logger
 from jose import jwt
 from sanic_ext.exceptions import InitError
 
 from api.utils.ApiInterface import api_request, api_response
 
+from utils.Cache import LRUCache
+from utils.CredentialVault import CredentialVault
 from utils.Exceptions import _321CQUException
+from utils.KeyRing import KeyRing
+from utils.Metrics import MetricsRegistry
+from utils.RevocationStore import RevocationStore
 from utils.Settings import ConfigManager
 
-__all__ = ['authorization_blueprint', 'authorized', 'LoginApplyType', 'TokenPayload', 'AuthorizedUser']
+__all__ = ['authorization_blueprint', 'authorized', 'AuthorizationPolicy', 'LoginApplyType', 'TokenMode', 'TokenPayload',
+           'AuthorizedUser']
 
 authorization_blueprint = Blueprint('Authorization', url_prefix='authorization')
 
@@ -27,23 +37,33 @@ class LoginApplyType(StrEnum):
     IOS_APP = 'IOS_APP'
     Announcement_Website = 'Announcement_Website'
     Recruit = 'Recruit'
+    Admin = 'Admin'
 
     def check_api_key(self, api_key: str) -> bool:
         return api_key == ConfigManager().get_config('ApiKey', self.value())
 
     @property
     def need_explicit_allow(self) -> bool:
-        if self == LoginApplyType.Recruit:
+        if self in (LoginApplyType.Recruit, LoginApplyType.Admin):
             return True
         else:
             return False
 
 
+class TokenMode(StrEnum):
+    """
+    token类型
+    """
+    JWT = 'JWT'  # 凭据保存在token荷载中
+    OPAQUE = 'OPAQUE'  # 凭据保存在服务端，token仅为会话id
+
+
 class TokenPayload(BaseModel):
     timestamp: int
     applyType: LoginApplyType
     username: Optional[str] = None
     password: Optional[str] = None
+    jti: Optional[str] = None
 
     model_config = ConfigDict(title="token荷载", use_enum_values=True)
 
@@ -60,6 +80,8 @@ class _LoginRequest(BaseModel):
     applyType: LoginApplyType = Field(title='请求类型')
     username: Optional[str] = Field(default=None, title='用户账户')
     password: Optional[str] = Field(default=None, title='用户密码')
+    tokenMode: TokenMode = Field(default=TokenMode.JWT, title='token类型',
+                                 description='为`OPAQUE`时凭据保存在服务端，回传的token为较短的会话id')
 
     model_config = ConfigDict(title="登陆请求值", use_enum_values=True)
 
@@ -73,6 +95,41 @@ class _LoginResponse(BaseModel):
     model_config = ConfigDict(title="登陆回传值")
 
 
+_ACCESS_TOKEN = 'access'
+_REFRESH_TOKEN = 'refresh'
+
+
+def _is_opaque_token(token: str) -> bool:
+    """
+    区分不透明token与jwt，两者格式均不符的token直接拒绝，避免无效token触发凭据库查询
+    """
+    if CredentialVault.is_session_id(token):
+        return True
+    if token.count('.') == 2:
+        return False
+    raise _321CQUException(error_info='Unauthorized', status_code=401)
+
+
+async def _issue_token(payload: TokenPayload, token_mode: TokenMode, kind: str) -> str:
+    """
+    签发token
+
+    :param payload: token荷载
+    :param token_mode: token类型
+    :param kind: 不透明token的用途，为`_ACCESS_TOKEN`或`_REFRESH_TOKEN`
+    """
+    if token_mode == TokenMode.OPAQUE:
+        return await CredentialVault().store({**payload.model_dump(), 'kind': kind}, payload.timestamp)
+    return KeyRing().sign(payload.model_dump(exclude_none=True))
+
+
+async def _load_opaque_token(token: str, kind: str) -> TokenPayload:
+    record = await CredentialVault().get(token)
+    if record is None or record.get('kind') != kind:
+        raise _321CQUException(error_info='Unauthorized', status_code=401)
+    return TokenPayload.parse_obj(record)
+
+
 @authorization_blueprint.post('login')
 @api_request(json=_LoginRequest)
 @api_response(_LoginResponse)
@@ -82,18 +139,20 @@ async def login(request: Request, body: _LoginRequest):
 
     小程序与APP调用时应将将统一身份认证账号密码作为参数上传以支持需要统一身份认证的相关API调用
     """
-    if body.apiKey != ConfigManager().get_config('ApiKey', body.applyType):
+    if body.apiKey != ConfigManager().get_config_with_default('ApiKey', body.applyType):
         raise _321CQUException(error_info='Unauthorized', status_code=401)
 
     now = datetime.now()
     token_expire_time = int((now + timedelta(minutes=15)).timestamp())
     refresh_token_expire_time = int((now + timedelta(weeks=1)).timestamp())
-    secret = ConfigManager().get_config('ApiKey', 'jwt_secret')
-    token = jwt.encode(TokenPayload(timestamp=token_expire_time, applyType=body.applyType,
-                                    username=body.username, password=body.password).model_dump(), secret)
-    refresh_token = jwt.encode(TokenPayload(timestamp=refresh_token_expire_time,
-                                            applyType=body.applyType,
-                                            username=body.username, password=body.password).model_dump(), secret)
+    token = await _issue_token(TokenPayload(timestamp=token_expire_time, applyType=body.applyType,
+                                            username=body.username, password=body.password),
+                               body.tokenMode, _ACCESS_TOKEN)
+    refresh_token = await _issue_token(TokenPayload(timestamp=refresh_token_expire_time,
+                                                    applyType=body.applyType,
+                                                    username=body.username, password=body.password,
+                                                    jti=secrets.token_urlsafe(16)),
+                                       body.tokenMode, _REFRESH_TOKEN)
 
     return _LoginResponse(token=token, refreshToken=refresh_token,
                           tokenExpireTime=token_expire_time,
@@ -109,6 +168,8 @@ class _RefreshTokenRequest(BaseModel):
 class _RefreshTokenResponse(BaseModel):
     token: str = Field(title='请求token')
     tokenExpireTime: int = Field(title='请求token过期时间戳')
+    refreshToken: str = Field(title='新的刷新token', description='原刷新token使用后即失效，需保存该值用于下次刷新')
+    refreshTokenExpireTime: int = Field(title='新的刷新token过期时间戳')
 
     model_config = ConfigDict(title="刷新token回传值")
 
@@ -118,13 +179,106 @@ def _decode_token(token: str) -> dict:
         raise _321CQUException(error_info='Unauthorized', status_code=401)
 
     try:
-        res = jwt.decode(token, ConfigManager().get_config('ApiKey', 'jwt_secret'))
+        res = KeyRing().decode(token)
     except jwt.JWTError as e:
         raise _321CQUException(error_info='Unauthorized', status_code=401, extra={'error': e})
 
     return res
 
 
+# 已验证token缓存，键为token摘要，条目在token自身的过期时间失效
+_verified_token_cache = LRUCache(int(ConfigManager().get_config_with_default('CacheSetting', 'token_cache_size', 4096)))
+MetricsRegistry().register('verified_token_cache', _verified_token_cache.stats)
+
+
+async def _verify_token(token: Optional[str]) -> TokenPayload:
+    """
+    校验token并返回荷载，同一token仅在首次出现时进行签名校验（或凭据库查询）与模型构建
+    """
+    if token is None:
+        raise _321CQUException(error_info='Unauthorized', status_code=401)
+
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    payload = _verified_token_cache.get(key)
+    if payload is None:
+        if _is_opaque_token(token):
+            payload = await _load_opaque_token(token, _ACCESS_TOKEN)
+        else:
+            payload = TokenPayload.parse_obj(_decode_token(token))
+        _verified_token_cache.set(key, payload, payload.timestamp)
+    return payload
+
+
+def invalidate_verified_token_cache() -> None:
+    """
+    清空已验证token缓存，签名密钥轮换后需要调用
+    """
+    _verified_token_cache.clear()
+
+
+async def _watch_key_ring():
+    """
+    定期检查配置文件，密钥变化时无需重启即可生效；重新加载失败（配置文件编辑到一半等）时保留原有密钥，下次检查时重试
+    """
+    interval = float(ConfigManager().get_config_with_default('JwtKeySetting', 'reload_interval', 60))
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            KeyRing().reload_if_modified()
+        except Exception as e:
+            logger.warning(f"Reload jwt key ring failed: {e!r}")
+
+
+async def _sync_revocation_store():
+    """
+    定期同步其他worker写入的吊销记录
+    """
+    interval = float(ConfigManager().get_config_with_default('RevocationSetting', 'sync_interval', 30))
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await RevocationStore().sync()
+        except Exception as e:
+            logger.warning(f"Sync revocation store failed: {e!r}")
+
+
+@authorization_blueprint.listener('before_server_start')
+async def _setup_token_backends(app: Sanic):
+    KeyRing().add_rotation_listener(invalidate_verified_token_cache)
+    app.add_task(_watch_key_ring())
+    await CredentialVault().init()
+    await RevocationStore().init()
+    app.add_task(_sync_revocation_store())
+
+
+async def _load_refresh_token(token: Optional[str]) -> tuple[TokenPayload, TokenMode]:
+    """
+    校验刷新token，返回荷载与token类型
+    """
+    if token is None:
+        raise _321CQUException(error_info='Unauthorized', status_code=401)
+
+    if _is_opaque_token(token):
+        token_mode = TokenMode.OPAQUE
+        payload = await _load_opaque_token(token, _REFRESH_TOKEN)
+    else:
+        token_mode = TokenMode.JWT
+        payload = TokenPayload.parse_obj(_decode_token(token))
+
+    if payload.timestamp < datetime.now().timestamp():
+        raise _321CQUException(error_info='Token Expired', status_code=401)
+    return payload, token_mode
+
+
+def _revocation_id(payload: TokenPayload, token: str) -> str:
+    """
+    刷新token的吊销标识，不携带jti的旧token以token摘要代替，同样只能使用一次并可被吊销
+    """
+    if payload.jti is not None:
+        return payload.jti
+    return 'sha256:' + hashlib.sha256(token.encode()).hexdigest()
+
+
 @authorization_blueprint.post('refreshToken')
 @api_request(json=_RefreshTokenRequest)
 @api_response(_RefreshTokenResponse)
@@ -132,21 +286,47 @@ async def refresh_token(request: Request, body: _RefreshTokenRequest):
     """
     刷新token
     """
-    if body.refreshToken is None:
-        raise _321CQUException(error_info='Unauthorized', status_code=401)
+    payload, token_mode = await _load_refresh_token(body.refreshToken)
 
-    payload = TokenPayload.parse_obj(
-        _decode_token(body.refreshToken)
-    )
-
-    if payload.timestamp < datetime.now().timestamp():
-        raise _321CQUException(error_info='Token Expired', status_code=401)
+    # 刷新token仅可使用一次，吊销记录写入成功者才能继续签发
+    jti = _revocation_id(payload, body.refreshToken)
+    revocation_store = RevocationStore()
+    if await revocation_store.is_revoked(jti) or not await revocation_store.revoke(jti, payload.timestamp):
+        raise _321CQUException(error_info='Token Revoked', status_code=401)
+    if token_mode == TokenMode.OPAQUE:
+        await CredentialVault().remove(body.refreshToken)
 
     token_expire_time = int((datetime.now() + timedelta(minutes=15)).timestamp())
-    token = jwt.encode(TokenPayload(timestamp=token_expire_time, applyType=payload.applyType,
-                                    username=payload.username, password=payload.password).model_dump(),
-                       ConfigManager().get_config('ApiKey', 'jwt_secret'))
-    return _RefreshTokenResponse(token=token, tokenExpireTime=token_expire_time)
+    token = await _issue_token(TokenPayload(timestamp=token_expire_time, applyType=payload.applyType,
+                                            username=payload.username, password=payload.password),
+                               token_mode, _ACCESS_TOKEN)
+    new_refresh_token = await _issue_token(TokenPayload(timestamp=payload.timestamp, applyType=payload.applyType,
+                                                        username=payload.username, password=payload.password,
+                                                        jti=secrets.token_urlsafe(16)),
+                                           token_mode, _REFRESH_TOKEN)
+    return _RefreshTokenResponse(token=token, tokenExpireTime=token_expire_time,
+                                 refreshToken=new_refresh_token, refreshTokenExpireTime=payload.timestamp)
+
+
+class _RevokeTokenRequest(BaseModel):
+    refreshToken: str = Field(title='需要吊销的刷新token')
+
+    model_config = ConfigDict(title="吊销token请求值")
+
+
+@authorization_blueprint.post('revokeToken')
+@api_request(json=_RevokeTokenRequest)
+@api_response()
+async def revoke_token(request: Request, body: _RevokeTokenRequest):
+    """
+    吊销刷新token
+
+    用于退出登陆或刷新token泄露时使其失效，已签发的请求token在过期前仍然有效
+    """
+    payload, token_mode = await _load_refresh_token(body.refreshToken)
+    await RevocationStore().revoke(_revocation_id(payload, body.refreshToken), payload.timestamp)
+    if token_mode == TokenMode.OPAQUE:
+        await CredentialVault().remove(body.refreshToken)
 
 
 class AuthorizedUser(BaseModel):
@@ -156,32 +336,56 @@ class AuthorizedUser(BaseModel):
     model_config = ConfigDict(title="经验证的用户")
 
 
+class AuthorizationPolicy:
+    """
+    在路由注册时编译的api权限策略，请求时仅需一次集合查询
+    """
+
+    def __init__(self, include: Optional[list[LoginApplyType]] = None,
+                 exclude: Optional[list[LoginApplyType]] = None, need_user: bool = False):
+        if include and exclude:
+            raise InitError("Cannot set include and exclude at same time")
+
+        self.need_user = need_user
+        self.allowed: frozenset[str] = frozenset(
+            apply_type.value for apply_type in LoginApplyType
+            if not (exclude is not None and apply_type in exclude)
+            and not (include is not None and apply_type not in include)
+            and not (apply_type.need_explicit_allow and (include is None or apply_type not in include))
+        )
+
+
 def authorized(*, include: Optional[list[LoginApplyType]] = None, exclude: Optional[list[LoginApplyType]] = None,
-               need_user: bool = False, user_argument: str = 'user'):
+               need_user: bool = False, user_argument: str = 'user', token_argument: Optional[str] = None):
     """
     api权限校验装饰器
+
+    编译后的权限策略会以`authorization_policy`属性挂载在被装饰函数上
     :param include: 可以使用该api的权限请求方式
     :param exclude: 无法使用该api权限的请求方式
     :param need_user: 需要从token中获取用户
     :param user_argument: 注入到参数中的变量名称
+    :param token_argument: 请求头中没有token时，从该路由查询参数中读取token（WebSocket与EventSource无法设置请求头）
     """
-    if include and exclude:
-        raise InitError("Cannot set include and exclude at same time")
+    policy = AuthorizationPolicy(include=include, exclude=exclude, need_user=need_user)
+    allowed = policy.allowed
 
     def decorator(f):
         @wraps(f)
         async def wrapped_function(request: Request, *args, **kwargs):
-            payload = TokenPayload.parse_obj(_decode_token(request.token))
+            # 批量请求的子请求已由外层请求校验过令牌
+            payload = getattr(request.ctx, 'token_payload', None)
+            if payload is None:
+                token = request.token
+                if token is None and token_argument is not None:
+                    token = request.args.get(token_argument)
+                payload = await _verify_token(token)
             if payload.timestamp < datetime.now().timestamp():
                 raise _321CQUException(error_info='Token Expired', status_code=401)
 
-            if (payload.applyType in exclude if exclude is not None else False) \
-                    or (payload.applyType not in include if include is not None else False):
-                raise _321CQUException(error_info='No Access', status_code=403)
-
-            if LoginApplyType(payload.applyType).need_explicit_allow and \
-                    (include is None or payload.applyType not in include):
+            if payload.applyType not in allowed:
                 raise _321CQUException(error_info='No Access', status_code=403)
+            request.ctx.token_payload = payload
 
             if need_user:
                 if payload.username is None or payload.password is None or \
@@ -194,6 +398,7 @@ def authorized(*, include: Optional[list[LoginApplyType]] = None, exclude: Optio
                 retval = await retval
             return retval
 
+        wrapped_function.authorization_policy = policy
         return wrapped_function
 
     return decorator
@@ -0,0 +1,140 @@
+import asyncio
+import inspect
+from functools import partial
+from typing import Any, Dict, List, Literal, Optional
+from urllib.parse import urlencode
+
+from _321CQU.tools import gRPCManager
+from pydantic import BaseModel, Field, ConfigDict
+from pydantic_core import to_json
+from sanic import Request, Blueprint
+from sanic.compat import Header
+from sanic.response import HTTPResponse
+
+from .authorization import authorized, LoginApplyType
+from .utils.ApiInterface import api_request, api_response, JsonData
+from utils.Exceptions import _321CQUException
+from utils.Settings import ConfigManager
+
+__all__ = ['batch_blueprint']
+
+batch_blueprint = Blueprint('Batch')
+
+_config = ConfigManager()
+_MAX_REQUESTS = int(_config.get_config_with_default('BatchSetting', 'max_requests', 10))
+_CONCURRENCY = int(_config.get_config_with_default('BatchSetting', 'concurrency', 4))
+# 子请求不继承的请求头，请求体、条件请求与响应格式由子请求自身决定
+_DROPPED_HEADERS = ('content-length', 'content-type', 'transfer-encoding', 'if-none-match', 'accept-encoding',
+                    'accept')
+
+
+class _SubRequest(BaseModel):
+    method: Literal['GET', 'POST'] = Field(default='GET', title='请求方法')
+    path: str = Field(title='请求路径', description='完整路径，如`/v1/campus_lift/card`')
+    query: Optional[Dict[str, Any]] = Field(default=None, title='路由查询参数')
+    body: Optional[Dict[str, Any]] = Field(default=None, title='json请求体')
+
+
+class _BatchRequest(BaseModel):
+    requests: List[_SubRequest] = Field(title='子请求列表', min_length=1)
+
+    model_config = ConfigDict(title="批量请求请求值")
+
+
+class _SubResponse(BaseModel):
+    status: int = Field(title='子请求的Http响应码')
+    body: Any = Field(title='子请求的响应体', description='与单独调用该接口时的响应体一致')
+
+
+class _BatchResponse(BaseModel):
+    responses: List[_SubResponse] = Field(title='子请求结果，顺序与请求一致')
+
+    model_config = ConfigDict(title="批量请求回传值")
+
+
+def _build_sub_request(request: Request, sub: _SubRequest) -> Request:
+    headers = Header([(key, value) for key, value in request.headers.items() if key.lower() not in _DROPPED_HEADERS])
+    url = sub.path + ('?' + urlencode(sub.query, doseq=True) if sub.query else '')
+    sub_request = Request(url.encode(), headers, request.version, sub.method, request.transport, request.app)
+    if sub.body is not None:
+        sub_request.headers['content-type'] = 'application/json'
+        sub_request.body = to_json(sub.body)
+    sub_request.conn_info = request.conn_info
+    # 复用本次请求的令牌校验结果与截止时间
+    sub_request.ctx.token_payload = request.ctx.token_payload
+    sub_request.ctx.deadline = getattr(request.ctx, 'deadline', None)
+    sub_request.ctx.client_deadline = getattr(request.ctx, 'client_deadline', False)
+    return sub_request
+
+
+async def _dispatch(request: Request, sub: _SubRequest, dependencies: Dict[type, Any]) -> HTTPResponse:
+    sub_request = _build_sub_request(request, sub)
+    try:
+        route, handler, params = request.app.router.get(sub_request.path, sub_request.method, request.host)
+        name_parts = route.name.split('.')
+        if len(name_parts) < 3 or name_parts[1] not in _batchable_blueprints() or name_parts[1] == batch_blueprint.name \
+                or _is_unbatchable(handler):
+            raise _321CQUException(error_info='该接口不支持批量调用', status_code=400)
+        sub_request.route = route
+
+        for name, parameter in inspect.signature(handler).parameters.items():
+            if parameter.annotation in dependencies:
+                params[name] = dependencies[parameter.annotation]
+        response = handler(sub_request, **params)
+        if inspect.isawaitable(response):
+            response = await response
+    except Exception as e:
+        response = request.app.error_handler.response(sub_request, e)
+        if inspect.isawaitable(response):
+            response = await response
+    return response
+
+
+def _is_unbatchable(handler) -> bool:
+    """
+    websocket路由以`partial(app._websocket_handler, handler)`注册，需检查其标记及被包装的处理函数
+    """
+    if getattr(handler, 'is_websocket', False):
+        return True
+    if isinstance(handler, partial) and handler.args:
+        handler = handler.args[0]
+    return getattr(handler, 'unbatchable', False)
+
+
+def _batchable_blueprints() -> set:
+    from api import api_urls
+
+    return {blueprint.name for blueprint in api_urls.blueprints}
+
+
+def _encode_sub_response(response: HTTPResponse) -> bytes:
+    body = response.body
+    if not body:
+        body = b'null'
+    elif not (response.content_type or '').startswith('application/json'):
+        body = to_json(body.decode(errors='replace'))
+    return b'{"status":' + str(response.status).encode() + b',"body":' + body + b'}'
+
+
+@batch_blueprint.post(uri='batch')
+@api_request(json=_BatchRequest)
+@api_response(_BatchResponse)
+@authorized(include=list(LoginApplyType))
+async def batch(request: Request, body: _BatchRequest, grpc_manager: gRPCManager):
+    """
+    批量请求，在一次Http请求中并发调用多个接口
+
+    令牌仅校验一次，各子请求仍按各自接口的权限策略校验；子请求的响应体原样嵌入，各自携带响应码
+    """
+    if len(body.requests) > _MAX_REQUESTS:
+        raise _321CQUException(error_info=f'子请求数量不能超过{_MAX_REQUESTS}', status_code=400)
+
+    semaphore = asyncio.Semaphore(_CONCURRENCY)
+    dependencies = {gRPCManager: grpc_manager}
+
+    async def run(sub: _SubRequest) -> bytes:
+        async with semaphore:
+            return _encode_sub_response(await _dispatch(request, sub, dependencies))
+
+    results = await asyncio.gather(*[run(sub) for sub in body.requests])
+    return JsonData(payload=b'{"responses":[' + b','.join(results) + b']}')
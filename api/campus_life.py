@@ -11,27 +11,34 @@ from sanic import Request, Blueprint
 
 from .authorization import authorized, AuthorizedUser
 from .utils.ApiInterface import api_request, api_response, handle_grpc_error
-from .utils.tools import message_to_dict
+from .utils.RateLimit import RateLimiter, RateLimitRule
+from .utils.StubProxy import StubProxy
+from .utils.Transcoder import transcode
+from .utils.UserCache import user_cache
 
 __all__ = ['campus_life_blueprint']
 
 campus_life_blueprint = Blueprint('CampusLift', url_prefix='/campus_lift')
+_rate_limiter = RateLimiter('CampusLift', user_rule=RateLimitRule(rate=0.5, burst=10),
+                            apply_type_rule=RateLimitRule(rate=50, burst=100))
 
 
 @campus_life_blueprint.get(uri='card')
 @api_request()
 @api_response(Card)
 @authorized(need_user=True)
+@user_cache('campus_life.card', ttl=60)
+@_rate_limiter
 @handle_grpc_error
 async def fetch_card(request: Request, user: AuthorizedUser, grpc_manager: gRPCManager):
     """
     获取校园卡信息
     """
-    async with grpc_manager.get_stub(ServiceEnum.CardService) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.CardService) as stub:
         stub: mycqu_grpc.CardFetcherStub
         res: mycqu_model.Card = await stub.FetchCard(mycqu_rr.BaseLoginInfo(auth=user.username, password=user.password))
 
-    return Card.model_validate(message_to_dict(res))
+    return transcode(res, Card)
 
 
 class FetchBillsResponse(BaseModel):
@@ -43,16 +50,17 @@ class FetchBillsResponse(BaseModel):
 @api_request()
 @api_response(FetchBillsResponse)
 @authorized(need_user=True)
+@_rate_limiter
 @handle_grpc_error
 async def fetch_bill(request: Request, user: AuthorizedUser, grpc_manager: gRPCManager):
     """
     获取最近30天的账单信息
     """
-    async with grpc_manager.get_stub(ServiceEnum.CardService) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.CardService) as stub:
         stub: mycqu_grpc.CardFetcherStub
         res: mycqu_rr.FetchBillResponse = await stub.FetchBills(mycqu_rr.BaseLoginInfo(auth=user.username,
                                                                                        password=user.password))
-    return FetchBillsResponse.model_validate(message_to_dict(res))
+    return transcode(res, FetchBillsResponse)
 
 
 class FetchDormEnergyRequest(BaseModel):
@@ -65,13 +73,14 @@ class FetchDormEnergyRequest(BaseModel):
 @api_request(query=FetchDormEnergyRequest)
 @api_response(EnergyFees)
 @authorized(need_user=True)
+@_rate_limiter
 @handle_grpc_error
 async def fetch_dorm_energy(request: Request, query: FetchDormEnergyRequest,
                             user: AuthorizedUser, grpc_manager: gRPCManager):
     """
     获取宿舍水电费信息
     """
-    async with grpc_manager.get_stub(ServiceEnum.CardService) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.CardService) as stub:
         stub: mycqu_grpc.CardFetcherStub
         res: mycqu_model.EnergyFees = await stub.FetchEnergyFee(
             mycqu_rr.FetchEnergyFeeRequest(
@@ -80,4 +89,4 @@ async def fetch_dorm_energy(request: Request, query: FetchDormEnergyRequest,
                 room=query.room
             )
         )
-    return EnergyFees.model_validate(message_to_dict(res))
+    return transcode(res, EnergyFees)
@@ -12,8 +12,14 @@ from sanic_ext import openapi
 from sanic_ext.extensions.openapi.definitions import Parameter
 
 from .authorization import authorized
-from .utils.ApiInterface import api_request, api_response, handle_grpc_error
-from .utils.tools import message_to_dict
+from .utils.ApiInterface import api_request, api_response, handle_grpc_error, JsonData
+from .utils.Pagination import paginated
+from .utils.ResponseCache import shared_cache
+from .utils.RetryPolicy import RetryPolicy, register_retry_policy
+from .utils.StubProxy import StubProxy
+from .utils.Transcoder import transcode, transcode_items, to_json_data
+
+from utils.CourseCatalog import CourseCatalog
 
 __all__ = ['course_score_query_blueprint']
 
@@ -42,23 +48,58 @@ class _FindCourseByNameResponse(BaseModel):
     通过关键词搜索课程返回值
     """
     courses: List[Course]
+    next_cursor: Optional[str] = Field(default=None, title="下一页游标", description="为空时没有更多结果")
+
+
+register_retry_policy(ServiceEnum.CourseScoreQuery, 'FindCourseByName', RetryPolicy(hedging_percentile=95))
 
 
 @course_score_query_blueprint.get(uri='course')
 @api_request(query=_FindCourseByNameRequest)
-@api_response(_FindCourseByNameResponse)
+@api_response(_FindCourseByNameResponse, stream_field='courses')
 @authorized()
+@paginated('courses')
+@shared_cache(ttl=600)
 @handle_grpc_error
 async def find_course_by_name(request: Request, query: _FindCourseByNameRequest, grpc_manager: gRPCManager):
     """
     通过关键词搜索课程
+
+    优先在网关本地课程目录中按相关度搜索，纯字母关键词同时匹配课程代码与拼音首字母前缀
     """
-    async with grpc_manager.get_stub(ServiceEnum.CourseScoreQuery) as stub:
+    catalog = CourseCatalog()
+    courses = await catalog.search(query.course_name, query.teacher_name)
+    if courses is not None:
+        return JsonData(payload=b'{"courses":' + courses + b'}')
+
+    data = await _find_course_by_name(grpc_manager, query.course_name, query.teacher_name)
+    courses = data.obj['courses']
+    # 写入本地目录不阻塞响应
+    request.app.add_task(catalog.record(query.course_name, query.teacher_name, courses))
+    merged = await catalog.merge_initials(query.course_name, query.teacher_name, courses)
+    if merged is not courses:
+        data = JsonData({**data.obj, 'courses': merged})
+    return data
+
+
+async def _find_course_by_name(grpc_manager: gRPCManager, course_name: Optional[str],
+                               teacher_name: Optional[str]) -> JsonData:
+    async with StubProxy(grpc_manager, ServiceEnum.CourseScoreQuery) as stub:
         stub: csq_grpc.CourseScoreQueryStub
         res: csq_model.FindCourseByNameResponse = await stub.FindCourseByName(
-            csq_model.FindCourseByNameRequest(teacher_name=query.teacher_name,
-                                              course_name=query.course_name))
-    return _FindCourseByNameResponse.model_validate(message_to_dict(res))
+            csq_model.FindCourseByNameRequest(teacher_name=teacher_name, course_name=course_name))
+    return transcode(res, _FindCourseByNameResponse)
+
+
+@course_score_query_blueprint.listener('before_server_start')
+async def setup_course_catalog(app, _):
+    catalog = CourseCatalog()
+    await catalog.init()
+
+    async def fetch(course_name: Optional[str], teacher_name: Optional[str]):
+        return (await _find_course_by_name(app.ctx.grpc_manager, course_name, teacher_name)).obj['courses']
+
+    app.add_task(catalog.run(fetch))
 
 
 class _LayeredTermScoreDetail(BaseModel):
@@ -91,23 +132,27 @@ class _FetchLayeredScoreDetailResponse(BaseModel):
     score_details: List[_LayeredScoreDetail] = Field(title='分层的课程信息')
 
 
+register_retry_policy(ServiceEnum.CourseScoreQuery, 'FetchLayeredScoreDetail', RetryPolicy(hedging_percentile=95))
+
+
 @course_score_query_blueprint.get(uri='course/<cid:str>')
 @openapi.parameter(parameter=Parameter('cid', str, "path", description='课程ID'))
 @api_request()
 @api_response(_FetchLayeredScoreDetailResponse)
 @authorized()
+@shared_cache(ttl=3600)
 @handle_grpc_error
 async def fetch_layered_score_detail(request: Request, cid: str, grpc_manager: gRPCManager):
     """
     通过course id查询分级的课程往年成绩
     """
-    async with grpc_manager.get_stub(ServiceEnum.CourseScoreQuery) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.CourseScoreQuery) as stub:
         stub: csq_grpc.CourseScoreQueryStub
         res: csq_model.FetchLayeredScoreDetailResponse = await stub.FetchLayeredScoreDetail(
             csq_model.FetchLayeredScoreDetailRequest(course_code=cid)
         )
 
-    return _FetchLayeredScoreDetailResponse(
-        course_code=res.course_code, course_name=res.course_name,
-        score_details=list(map(lambda x: _LayeredScoreDetail.model_validate(message_to_dict(x)), res.score_details))
-    )
+    return to_json_data({
+        'course_code': res.course_code, 'course_name': res.course_name,
+        'score_details': transcode_items(res.score_details, _LayeredScoreDetail)
+    }, _FetchLayeredScoreDetailResponse)
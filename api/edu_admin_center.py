@@ -15,11 +15,17 @@ from sanic import Request, Blueprint
 
 from .authorization import authorized, LoginApplyType, AuthorizedUser
 from .utils.ApiInterface import api_request, api_response, handle_grpc_error
-from .utils.tools import message_to_dict
+from .utils.RateLimit import RateLimiter, RateLimitRule
+from .utils.RetryPolicy import RetryPolicy, register_retry_policy
+from .utils.StubProxy import StubProxy
+from .utils.Transcoder import transcode, transcode_items, to_json_data
+from .utils.UserCache import user_cache
 
 __all__ = ['edu_admin_center_blueprint']
 
 edu_admin_center_blueprint = Blueprint('EduAdminCenter', url_prefix='/edu_admin_center')
+_rate_limiter = RateLimiter('EduAdminCenter', user_rule=RateLimitRule(rate=0.5, burst=10),
+                            apply_type_rule=RateLimitRule(rate=50, burst=100))
 
 
 class _ValidateAuthResponse(BaseModel):
@@ -35,12 +41,13 @@ class _ValidateAuthResponse(BaseModel):
 @api_request()
 @api_response(_ValidateAuthResponse)
 @authorized(need_user=True)
+@_rate_limiter
 @handle_grpc_error
 async def validate_auth(request: Request, user: AuthorizedUser, grpc_manager: gRPCManager):
     """
     账号验证
     """
-    async with grpc_manager.get_stub(ServiceEnum.EduAdminCenter) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.EduAdminCenter) as stub:
         stub: eac_grpc.EduAdminCenterStub = stub
         res: eac_models.ValidateAuthResponse = await stub.ValidateAuth(
             mycqu_rr.BaseLoginInfo(auth=user.username, password=user.password)
@@ -62,8 +69,9 @@ class _FetchEnrollCourseInfoResponse(BaseModel):
 
 @edu_admin_center_blueprint.post(uri='fetchEnrollCourseInfo')
 @api_request(json=_FetchEnrollCourseInfoRequest)
-@api_response(_FetchEnrollCourseInfoResponse)
+@api_response(_FetchEnrollCourseInfoResponse, stream_field='result')
 @authorized(include=[LoginApplyType.IOS_APP], need_user=True)
+@_rate_limiter
 @handle_grpc_error
 async def fetch_enroll_course_info(request: Request, body: _FetchEnrollCourseInfoRequest, user: AuthorizedUser, grpc_manager: gRPCManager):
     """
@@ -71,7 +79,7 @@ async def fetch_enroll_course_info(request: Request, body: _FetchEnrollCourseInf
 
     **仅支持IOS客户端调用**
     """
-    async with grpc_manager.get_stub(ServiceEnum.EduAdminCenter) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.EduAdminCenter) as stub:
         stub: eac_grpc.EduAdminCenterStub = stub
         res: mycqu_rr.FetchEnrollCourseInfoResponse = await stub.FetchEnrollCourseInfo(
             mycqu_rr.FetchEnrollCourseInfoRequest(
@@ -80,8 +88,8 @@ async def fetch_enroll_course_info(request: Request, body: _FetchEnrollCourseInf
         )
         result = {}
         for k, v in res.result.items():
-            result[k] = list(map(lambda x: EnrollCourseInfo.model_validate(message_to_dict(x)), v.info))
-        return _FetchEnrollCourseInfoResponse(result=result)
+            result[k] = transcode_items(v.info, EnrollCourseInfo)
+        return to_json_data({'result': result}, _FetchEnrollCourseInfoResponse)
 
 
 class _FetchEnrollCourseItemRequest(BaseModel):
@@ -101,6 +109,7 @@ class _FetchEnrollCourseItemResponse(BaseModel):
 @api_request(json=_FetchEnrollCourseItemRequest)
 @api_response(_FetchEnrollCourseItemResponse)
 @authorized(include=[LoginApplyType.IOS_APP], need_user=True)
+@_rate_limiter
 @handle_grpc_error
 async def fetch_enroll_course_item(request: Request, body: _FetchEnrollCourseItemRequest, user: AuthorizedUser, grpc_manager: gRPCManager):
     """
@@ -108,7 +117,7 @@ async def fetch_enroll_course_item(request: Request, body: _FetchEnrollCourseIte
 
     **仅支持IOS客户端调用**
     """
-    async with grpc_manager.get_stub(ServiceEnum.EduAdminCenter) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.EduAdminCenter) as stub:
         stub: eac_grpc.EduAdminCenterStub = stub
         res: mycqu_rr.FetchEnrollCourseItemResponse = await stub.FetchEnrollCourseItem(
             mycqu_rr.FetchEnrollCourseItemRequest(
@@ -117,7 +126,7 @@ async def fetch_enroll_course_item(request: Request, body: _FetchEnrollCourseIte
                 is_major=body.is_major
             )
         )
-        return _FetchEnrollCourseItemResponse.model_validate(message_to_dict(res))
+        return transcode(res, _FetchEnrollCourseItemResponse)
 
 
 class _FetchExamRequest(BaseModel):
@@ -132,22 +141,27 @@ class _FetchExamResponse(BaseModel):
     model_config = ConfigDict(title="考表获取回传值")
 
 
+register_retry_policy(ServiceEnum.EduAdminCenter, 'FetchExam', RetryPolicy(hedging_percentile=95))
+
+
 @edu_admin_center_blueprint.post(uri='fetchExam')
 @api_request(json=_FetchExamRequest)
 @api_response(_FetchExamResponse)
 @authorized(need_user=True)
+@user_cache('edu_admin_center.exam', ttl=600)
+@_rate_limiter
 @handle_grpc_error
 async def fetch_exam(request: Request, body: _FetchExamRequest, user: AuthorizedUser, grpc_manager: gRPCManager):
     """
     考试安排
     """
-    async with grpc_manager.get_stub(ServiceEnum.EduAdminCenter) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.EduAdminCenter) as stub:
         stub: eac_grpc.EduAdminCenterStub = stub
         res: mycqu_rr.FetchExamResponse = await stub.FetchExam(
             mycqu_rr.FetchExamRequest(base_login_info=mycqu_rr.BaseLoginInfo(auth=user.username, password=user.password),
                                       stu_id=body.sid)
         )
-        return _FetchExamResponse.model_validate(message_to_dict(res))
+        return transcode(res, _FetchExamResponse)
 
 
 class _FetchCourseTimetableRequest(BaseModel):
@@ -166,16 +180,21 @@ class _FetchCourseTimetableResponse(BaseModel):
     model_config = ConfigDict(title="课表查询回传值")
 
 
+register_retry_policy(ServiceEnum.EduAdminCenter, 'FetchCourseTimetable', RetryPolicy(hedging_percentile=95))
+
+
 @edu_admin_center_blueprint.post(uri='fetchCourseTimetable')
 @api_request(json=_FetchCourseTimetableRequest)
 @api_response(_FetchCourseTimetableResponse)
 @authorized(need_user=True)
+@user_cache('edu_admin_center.timetable', ttl=600)
+@_rate_limiter
 @handle_grpc_error
 async def fetch_course_timetable(request: Request, body: _FetchCourseTimetableRequest, user: AuthorizedUser, grpc_manager: gRPCManager):
     """
     课表查询
     """
-    async with grpc_manager.get_stub(ServiceEnum.EduAdminCenter) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.EduAdminCenter) as stub:
         stub: eac_grpc.EduAdminCenterStub = stub
         res: eac_models.FetchCourseTimetableResponse = await stub.FetchCourseTimetable(
             eac_models.FetchCourseTimetableRequest(
@@ -184,12 +203,12 @@ async def fetch_course_timetable(request: Request, body: _FetchCourseTimetableRe
                 offset=body.offset
             )
         )
-        return _FetchCourseTimetableResponse(
-            timetables=list(map(lambda x: CourseTimetable.model_validate(message_to_dict(x)), res.course_timetables)),
-            start_date=res.start_date,
-            end_date=res.end_date,
-            session_name=res.session_name
-        )
+        return to_json_data({
+            'timetables': transcode_items(res.course_timetables, CourseTimetable),
+            'start_date': res.start_date,
+            'end_date': res.end_date,
+            'session_name': res.session_name
+        }, _FetchCourseTimetableResponse)
 
 
 class _FetchScoreRequest(BaseModel):
@@ -207,34 +226,37 @@ class _FetchScoreResponse(BaseModel):
 
 @edu_admin_center_blueprint.post(uri='fetchScore')
 @api_request(json=_FetchScoreRequest)
-@api_response(_FetchScoreResponse)
+@api_response(_FetchScoreResponse, stream_field='scores')
 @authorized(need_user=True)
+@user_cache('edu_admin_center.score', ttl=300)
+@_rate_limiter
 @handle_grpc_error
 async def fetch_score(request: Request, body: _FetchScoreRequest, user: AuthorizedUser, grpc_manager: gRPCManager):
     """
     成绩查询
     """
-    async with grpc_manager.get_stub(ServiceEnum.EduAdminCenter) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.EduAdminCenter) as stub:
         stub: eac_grpc.EduAdminCenterStub = stub
         res: mycqu_rr.FetchScoreResponse = await stub.FetchScore(
             eac_models.FetchScoreRequest(base_login_info=mycqu_rr.BaseLoginInfo(auth=user.username, password=user.password),
                                          sid=body.sid,
                                          is_minor=body.is_minor))
-        return _FetchScoreResponse.model_validate(message_to_dict(res))
+        return transcode(res, _FetchScoreResponse)
 
 
 @edu_admin_center_blueprint.post(uri='fetchGpaRanking')
 @api_request()
 @api_response(GpaRanking)
 @authorized(need_user=True)
+@_rate_limiter
 @handle_grpc_error
 async def fetch_gpa_ranking(request: Request, user: AuthorizedUser, grpc_manager: gRPCManager):
     """
     绩点排名查询
     """
-    async with grpc_manager.get_stub(ServiceEnum.EduAdminCenter) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.EduAdminCenter) as stub:
         stub: eac_grpc.EduAdminCenterStub = stub
         res: mycqu_model.GpaRanking = await stub.FetchGpaRanking(
             mycqu_rr.BaseLoginInfo(auth=user.username, password=user.password)
         )
-        return GpaRanking.model_validate(message_to_dict(res))
+        return transcode(res, GpaRanking)
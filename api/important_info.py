@@ -11,6 +11,9 @@ from sanic import Request, Blueprint
 
 from api.authorization import authorized
 from api.utils.ApiInterface import api_request, api_response, handle_grpc_error
+from api.utils.ResponseCache import shared_cache
+from api.utils.RetryPolicy import RetryPolicy, register_retry_policy
+from api.utils.StubProxy import StubProxy
 
 __all__ = ['important_info_blueprint']
 
@@ -62,16 +65,20 @@ class _HomepageResponse(BaseModel):
     homepages: List[_HomepageInfo] = Field(title="首页信息列表")
 
 
+register_retry_policy(ServiceEnum.ImportantInfoService, 'GetHomepageInfos', RetryPolicy(hedging_percentile=95))
+
+
 @important_info_blueprint.get(uri='homepages')
 @api_request()
 @api_response(_HomepageResponse)
 @authorized()
+@shared_cache(ttl=300)
 @handle_grpc_error
 async def get_homepage(request: Request, grpc_manager: gRPCManager):
     """
     获取首页轮播图
     """
-    async with grpc_manager.get_stub(ServiceEnum.ImportantInfoService) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.ImportantInfoService) as stub:
         stub: cc_grpc.ImportantInfoServiceStub = stub
         res: cc_models.HomepageResponse = await stub.GetHomepageInfos(empty_pb2.Empty())
         return _HomepageResponse(
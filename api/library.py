@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 from sanic import Request, Blueprint
@@ -11,13 +11,20 @@ from micro_services_protobuf.model.library import BookInfo
 
 from .authorization import authorized, AuthorizedUser
 from .utils.ApiInterface import api_request, api_response, handle_grpc_error
-from .utils.tools import message_to_dict
+from .utils.Pagination import paginated
+from .utils.RateLimit import RateLimiter, RateLimitRule
+from .utils.RetryPolicy import NON_RETRYABLE, register_retry_policy
+from .utils.StubProxy import StubProxy
+from .utils.Transcoder import transcode
+from .utils.UserCache import user_cache, invalidates_user_cache
 
 from utils.Exceptions import _321CQUException
 
 __all__ = ['library_blueprint']
 
 library_blueprint = Blueprint('Library', url_prefix='/library')
+_rate_limiter = RateLimiter('Library', user_rule=RateLimitRule(rate=0.5, burst=10),
+                            apply_type_rule=RateLimitRule(rate=50, burst=100))
 
 
 class FetchBorrowBookRequest(BaseModel):
@@ -26,19 +33,23 @@ class FetchBorrowBookRequest(BaseModel):
 
 class FetchBorrowBookResponse(BaseModel):
     book_infos: List[BookInfo] = Field(title="借阅列表")
+    next_cursor: Optional[str] = Field(default=None, title="下一页游标", description="为空时没有更多结果")
 
 
 @library_blueprint.get("/borrow")
 @api_request(query=FetchBorrowBookRequest)
-@api_response(FetchBorrowBookResponse)
+@api_response(FetchBorrowBookResponse, stream_field='book_infos')
 @authorized(need_user=True)
+@paginated('book_infos')
+@user_cache('library.borrow', ttl=300)
+@_rate_limiter
 @handle_grpc_error
 async def fetch_borrow_book(request: Request, query: FetchBorrowBookRequest, user: AuthorizedUser,
                             grpc_manager: gRPCManager):
     """
     获取书籍借阅信息
     """
-    async with grpc_manager.get_stub(ServiceEnum.LibraryService) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.LibraryService) as stub:
         stub: mycqu_grpc.LibraryFetcherStub
         res: mycqu_rr.FetchBorrowBookResponse = await stub.FetchBorrowBook(
             mycqu_rr.FetchBorrowBookRequest(
@@ -46,23 +57,28 @@ async def fetch_borrow_book(request: Request, query: FetchBorrowBookRequest, use
                 is_curr=query.is_curr
             )
         )
-    return FetchBorrowBookResponse.model_validate(message_to_dict(res))
+    return transcode(res, FetchBorrowBookResponse)
 
 
 class RenewBookRequest(BaseModel):
     book_id: str = Field(title="续借书籍ID")
 
 
+register_retry_policy(ServiceEnum.LibraryService, 'RenewBook', NON_RETRYABLE)
+
+
 @library_blueprint.post("/borrow")
 @api_request(query=RenewBookRequest)
 @api_response()
 @authorized(need_user=True)
+@invalidates_user_cache('library.borrow')
+@_rate_limiter
 @handle_grpc_error
 async def renew_book(request: Request, query: RenewBookRequest, user: AuthorizedUser, grpc_manager: gRPCManager):
     """
     续借书籍
     """
-    async with grpc_manager.get_stub(ServiceEnum.LibraryService) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.LibraryService) as stub:
         stub: mycqu_grpc.LibraryFetcherStub
         res: mycqu_rr.RenewBookResponse = await stub.RenewBook(
             mycqu_rr.RenewBookRequest(
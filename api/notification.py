@@ -1,6 +1,11 @@
+import asyncio
 import json
-from typing import List, Optional, Dict
+import time
+from typing import AsyncIterator, List, Optional, Dict
 
+import micro_services_protobuf.edu_admin_center.eac_models_pb2 as eac_models
+import micro_services_protobuf.edu_admin_center.eac_service_pb2_grpc as eac_grpc
+import micro_services_protobuf.mycqu_service.mycqu_request_response_pb2 as mycqu_rr
 from _321CQU.service import ServiceEnum
 from _321CQU.tools import gRPCManager
 from micro_services_protobuf.common_pb2 import DefaultResponse, UserId
@@ -8,11 +13,14 @@ from micro_services_protobuf.notification_center import service_pb2_grpc as noti
 from micro_services_protobuf.notification_center import wechat_pb2, apns_pb2, event_pb2
 from micro_services_protobuf.protobuf_enum.notification_center import NotificationEvent
 from pydantic import BaseModel, Field
-from sanic import Request, Blueprint
+from sanic import Request, Blueprint, Websocket
 from sanic_ext.extensions.openapi import openapi
 
 from api.authorization import authorized, LoginApplyType, AuthorizedUser
 from api.utils.ApiInterface import api_request, api_response, handle_grpc_error
+from api.utils.PushHub import PushConnection, PushHub
+from api.utils.RetryPolicy import NON_RETRYABLE, register_retry_policy
+from api.utils.StubProxy import StubProxy
 from utils.Exceptions import _321CQUException
 
 __all__ = ['notification_blueprint']
@@ -30,6 +38,9 @@ class _UpdateSubscribeRequest(BaseModel):
     extra_data: Optional[Dict] = Field(default=None, title='订阅事件可能需要的额外信息，任意字典')
 
 
+register_retry_policy(ServiceEnum.NotificationService, 'UpdateEventSubscribe', NON_RETRYABLE)
+
+
 @notification_blueprint.post(uri='updateSubscribe')
 @api_request(json=_UpdateSubscribeRequest)
 @api_response()
@@ -40,7 +51,7 @@ async def update_subscribe(request: Request, body: _UpdateSubscribeRequest, user
     """
     更新通知订阅设置
     """
-    async with grpc_manager.get_stub(ServiceEnum.NotificationService) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.NotificationService) as stub:
         stub: notification_grpc.NotificationStub = stub
         res: DefaultResponse = await stub.UpdateEventSubscribe(
             event_pb2.UpdateEventSubscribeRequest(
@@ -79,7 +90,7 @@ async def fetch_subscribe_info(request: Request, body: _FetchSubscribeInfoReques
     """
     获取订阅信息
     """
-    async with grpc_manager.get_stub(ServiceEnum.NotificationService) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.NotificationService) as stub:
         stub: notification_grpc.NotificationStub = stub
         res: event_pb2.FetchSubscribeInfoResponse = await stub.FetchSubscribeInfo(UserId(uid=bytes.fromhex(body.uid)))
         events = list(map(lambda x: NotificationEvent(x), res.events))
@@ -92,6 +103,9 @@ class _SetUserApnsRequest(BaseModel):
     apn: str = Field(title='设备apn代码')
 
 
+register_retry_policy(ServiceEnum.ApnsService, 'SetUserApns', NON_RETRYABLE)
+
+
 @notification_blueprint.post(uri='setApns')
 @api_request(json=_SetUserApnsRequest)
 @api_response()
@@ -103,7 +117,7 @@ async def set_user_apns(request: Request, body: _SetUserApnsRequest, grpc_manage
 
     **仅支持IOS客户端调用**
     """
-    async with grpc_manager.get_stub(ServiceEnum.ApnsService) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.ApnsService) as stub:
         stub: notification_grpc.ApnsStub = stub
         res: DefaultResponse = await stub.SetUserApns(
             apns_pb2.SetUserApnsRequest(uid=bytes.fromhex(body.uid), apn=bytes.fromhex(body.apn)))
@@ -119,6 +133,9 @@ class BindOpenIdRequest(BaseModel):
     code: str = Field(title='openid获取码')
 
 
+register_retry_policy(ServiceEnum.WechatService, 'SetUserOpenId', NON_RETRYABLE)
+
+
 @notification_blueprint.post(uri='bindOpenId')
 @api_request(json=BindOpenIdRequest)
 @api_response()
@@ -130,7 +147,7 @@ async def bind_openid(request: Request, body: BindOpenIdRequest, grpc_manager: g
 
     **仅支持微信小程序调用**
     """
-    async with grpc_manager.get_stub(ServiceEnum.WechatService) as stub:
+    async with StubProxy(grpc_manager, ServiceEnum.WechatService) as stub:
         stub: notification_grpc.WechatStub = stub
         res: DefaultResponse = await stub.SetUserOpenId(wechat_pb2.SetUserOpenIdRequest(uid=bytes.fromhex(body.uid),
                                                                                         code=body.code))
@@ -138,3 +155,111 @@ async def bind_openid(request: Request, body: BindOpenIdRequest, grpc_manager: g
             return
         else:
             raise _321CQUException(error_info=res.msg)
+
+
+class _PushRequest(BaseModel):
+    """
+    订阅推送请求值
+    """
+    uid: str = Field(title='用户身份标识符')
+    token: Optional[str] = Field(default=None, title='令牌',
+                                 description='WebSocket与EventSource无法设置请求头时通过该参数传递令牌')
+
+
+_HEARTBEAT = b'{"event":"heartbeat"}'
+
+
+async def _open_push_connection(uid: str, user: AuthorizedUser, grpc_manager: gRPCManager) -> PushConnection:
+    """
+    校验uid属于令牌中的用户后注册推送连接，uid由后端根据用户账号解析，不一致时拒绝连接
+    """
+    try:
+        user_id = UserId(uid=bytes.fromhex(uid))
+    except ValueError:
+        raise _321CQUException(error_info='请求参数错误', quite=True)
+    async with StubProxy(grpc_manager, ServiceEnum.EduAdminCenter) as stub:
+        stub: eac_grpc.EduAdminCenterStub = stub
+        auth: eac_models.ValidateAuthResponse = await stub.ValidateAuth(
+            mycqu_rr.BaseLoginInfo(auth=user.username, password=user.password))
+    if auth.uid != user_id.uid:
+        raise _321CQUException(error_info='No Access', status_code=403)
+
+    async with StubProxy(grpc_manager, ServiceEnum.NotificationService) as stub:
+        stub: notification_grpc.NotificationStub = stub
+        res: event_pb2.FetchSubscribeInfoResponse = await stub.FetchSubscribeInfo(user_id)
+    return PushHub().register(auth.uid.hex(), set(map(lambda x: NotificationEvent(x), res.events)))
+
+
+async def _push_messages(request: Request, connection: PushConnection) -> AsyncIterator[Optional[bytes]]:
+    """
+    依次产出待推送的事件，空闲超过心跳间隔时产出None；令牌过期或连接因过慢被关闭时结束
+    """
+    heartbeat_interval = PushHub().heartbeat_interval
+    expire_at = request.ctx.token_payload.timestamp
+    while not connection.closed.is_set():
+        timeout = min(heartbeat_interval, expire_at - time.time())
+        if timeout <= 0:
+            return
+        try:
+            yield await asyncio.wait_for(connection.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            yield None
+
+
+@notification_blueprint.websocket(uri='push')
+@api_request(query=_PushRequest)
+@authorized(need_user=True, token_argument='token')
+@handle_grpc_error
+async def push_websocket(request: Request, ws: Websocket, query: _PushRequest, user: AuthorizedUser,
+                         grpc_manager: gRPCManager):
+    """
+    通过WebSocket推送已订阅的通知事件
+
+    uid须为令牌中用户的身份标识符，否则返回403；
+    每条消息为一个json对象，空闲时定期发送`{"event":"heartbeat"}`；
+    令牌过期时以4001关闭连接，接收过慢时以1013关闭连接，客户端应重新连接
+    """
+    hub = PushHub()
+    connection = await _open_push_connection(query.uid, user, grpc_manager)
+    try:
+        async for message in _push_messages(request, connection):
+            await ws.send((message or _HEARTBEAT).decode())
+        if connection.closed.is_set():
+            await ws.close(1013, 'Too Slow')
+        else:
+            await ws.close(4001, 'Token Expired')
+    finally:
+        hub.unregister(connection)
+
+
+@notification_blueprint.get(uri='push/sse')
+@api_request(query=_PushRequest)
+@authorized(need_user=True, token_argument='token')
+@handle_grpc_error
+async def push_sse(request: Request, query: _PushRequest, user: AuthorizedUser, grpc_manager: gRPCManager):
+    """
+    通过Server-Sent Events推送已订阅的通知事件，用于无法使用WebSocket的客户端
+
+    uid须为令牌中用户的身份标识符，否则返回403；
+    每个事件的data为一个json对象，空闲时定期发送注释行作为心跳；令牌过期或接收过慢时结束响应，客户端应重新连接
+    """
+    hub = PushHub()
+    connection = await _open_push_connection(query.uid, user, grpc_manager)
+    try:
+        response = await request.respond(content_type='text/event-stream',
+                                         headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        async for message in _push_messages(request, connection):
+            await response.send(b'data: ' + message + b'\n\n' if message is not None else b': heartbeat\n\n')
+        await response.eof()
+    finally:
+        hub.unregister(connection)
+
+
+# 长连接接口不能在批量请求中调用
+push_websocket.unbatchable = True
+push_sse.unbatchable = True
+
+
+@notification_blueprint.listener('before_server_start')
+async def start_push_hub(app, _):
+    app.add_task(PushHub().run())
@@ -24,7 +24,7 @@ class _FetchScoreResponse(BaseModel):
 
 @recruit_blueprint.get(uri='score')
 @api_request()
-@api_response(_FetchScoreResponse)
+@api_response(_FetchScoreResponse, stream_field='scores')
 @authorized(include=[LoginApplyType.Recruit])
 async def fetch_score(request: Request):
     """
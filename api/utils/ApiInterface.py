@@ -1,22 +1,33 @@
+import hashlib
 import inspect
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import wraps
-from typing import Callable, Type, TypeVar, Generic, Dict, Optional, Union
+import types
+from typing import Any, Callable, Type, TypeVar, Generic, Dict, List, Optional, Tuple, Union, get_origin, get_args
 
+from sanic import Request
 from sanic.response import HTTPResponse
 
 from sanic_ext.exceptions import InitError
 from sanic_ext.extensions.openapi.builders import OperationStore
 from sanic_ext.utils.extraction import extract_request
 
-from pydantic import BaseModel, ValidationError, Field, SerializeAsAny
+from pydantic import BaseModel, ValidationError, Field, SerializeAsAny, TypeAdapter
+from pydantic_core import to_json
+import ujson
 
 from grpc.aio import AioRpcError
 from grpc import StatusCode
 
 from api.utils.tools import component
+from utils.Cache import LRUCache
 from utils.Exceptions import _321CQUException
+from utils.Settings import ConfigManager
 
-__all__ = ['api_request', 'api_response', 'handle_grpc_error']
+__all__ = ['api_request', 'api_response', 'compile_data_serializer', 'compile_response_serializer', 'wrap_success_payload',
+           'compute_etag', 'etag_matches', 'handle_grpc_error', 'JsonData', 'FIELDS_ARGUMENT', 'EXCLUDE_FIELDS_ARGUMENT',
+           'NDJSON_CONTENT_TYPE', 'get_field_selection', 'full_fields', 'select_fields']
 
 T = TypeVar("T", bound=BaseModel)
 
@@ -30,6 +41,309 @@ class BaseApiResponse(BaseModel, Generic[T]):
     data: SerializeAsAny[T | dict] = Field(title="数据")
 
 
+# 按ETag保存的列表字段拆分结果，同一缓存条目翻页或流式写出时无需再解析完整结果
+_splits = LRUCache(int(ConfigManager().get_config_with_default('ResponseCacheSetting', 'split_maxsize', 64)))
+
+
+class JsonData:
+    """
+    已准备好的data部分，api_response会直接写出而不再经过模型序列化
+
+    可由json原生对象（dict/list/str/...）或已序列化的json字节构造，另一种形式在需要时惰性生成
+    """
+    __slots__ = ('_obj', '_payload', 'etag', 'selected', '_split')
+
+    def __init__(self, obj: Any = None, *, payload: Optional[bytes] = None, etag: Optional[str] = None,
+                 selected: bool = False):
+        """
+        :param obj: json原生对象
+        :param payload: 已序列化的json字节，提供时忽略obj
+        :param etag: payload对应的ETag（如缓存中保存的值），为空时按需计算
+        :param selected: 是否已按当前请求的字段选择构建，为True时写出前不再裁剪
+        """
+        self._obj = obj
+        self._payload = payload
+        self.etag = etag
+        self.selected = selected
+        self._split: Optional[Tuple[str, Dict[str, Any], List[bytes]]] = None
+
+    @property
+    def obj(self) -> Any:
+        if self._obj is None and self._payload is not None:
+            self._obj = ujson.loads(self._payload)
+        return self._obj
+
+    @property
+    def payload(self) -> bytes:
+        if self._payload is None:
+            self._payload = to_json(self._obj)
+        return self._payload
+
+    @classmethod
+    def from_items(cls, rest: Dict[str, Any], field: str, items: List[bytes]) -> 'JsonData':
+        """
+        由其余字段与已序列化的列表元素拼接，元素不会被重新解析或序列化
+
+        :param rest: 列表字段以外的字段
+        :param field: 列表字段名
+        :param items: 列表中各元素的json字节
+        """
+        head = to_json(rest)[:-1]
+        data = cls(payload=head + (b',' if len(head) > 1 else b'') + to_json(field) + b':[' + b','.join(items) + b']}')
+        data._split = (field, rest, items)
+        return data
+
+    def split(self, field: str) -> Tuple[Dict[str, Any], List[bytes]]:
+        """
+        拆分列表字段，返回(其余字段, 列表中各元素的json字节)，返回值可能被共享，不应修改
+
+        带ETag的对象（缓存条目）的拆分结果按ETag保存，同一内容仅在首次拆分时解析
+        """
+        if self._split is not None and self._split[0] == field:
+            return self._split[1], self._split[2]
+        key = (self.etag, field)
+        parts = _splits.get(key) if self.etag is not None else None
+        if parts is None:
+            # 不保留解析出的完整对象，缓存条目仅多保存拆分后的字节
+            rest = dict((self._obj if self._obj is not None else ujson.loads(self.payload)) or {})
+            parts = (rest, [to_json(item) for item in rest.pop(field, None) or []])
+            if self.etag is not None:
+                _splits.set(key, parts)
+        self._split = (field, *parts)
+        return parts
+
+
+# 成功响应的固定外层结构，与BaseApiResponse(status=1, msg='success')序列化结果一致
+_SUCCESS_PREFIX = b'{"status":1,"msg":"success","data":'
+_SUCCESS_SUFFIX = b'}'
+_EMPTY_PAYLOAD = b'{}'
+_dict_adapter = TypeAdapter(Dict)
+
+# 字段选择的路由查询参数名
+FIELDS_ARGUMENT = 'fields'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+EXCLUDE_FIELDS_ARGUMENT = 'exclude_fields'
+
+
+def compile_data_serializer(retval: Optional[Union[Type[BaseModel], Dict]] = None) -> Callable[..., bytes]:
+    """
+    生成data部分的序列化函数，结果与`BaseApiResponse[retval]`中data字段的json一致
+
+    序列化函数可额外传入pydantic格式的include/exclude字段选择，未选择的字段不会被序列化
+    :param retval: 返回值类型，与api_response的retval参数相同
+    """
+    model_adapter = TypeAdapter(retval) if inspect.isclass(retval) and issubclass(retval, BaseModel) else None
+
+    def serialize(data: Any, include: Optional[dict] = None, exclude: Optional[dict] = None) -> bytes:
+        if data is None:
+            return _EMPTY_PAYLOAD
+        elif isinstance(data, JsonData):
+            if data.selected or (include is None and exclude is None):
+                return data.payload
+            # 缓存中保存的是完整结果，写出前按字段选择裁剪
+            return to_json(select_fields(data.obj, include, exclude))
+        elif isinstance(data, BaseModel):
+            # 与SerializeAsAny一致，按实例自身类型序列化
+            return data.__pydantic_serializer__.to_json(data, include=include, exclude=exclude)
+        elif model_adapter is not None:
+            return model_adapter.dump_json(model_adapter.validate_python(data), include=include, exclude=exclude)
+        else:
+            return _dict_adapter.dump_json(data, include=include, exclude=exclude)
+
+    return serialize
+
+
+# 字段树：字段名 -> (外层容器（列表/字典）层数, 字段类型为模型时其字段树)
+_FieldTree = Dict[str, Tuple[int, Optional[dict]]]
+_field_trees: Dict[Type[BaseModel], _FieldTree] = {}
+
+
+def _unwrap_optional(annotation: Any) -> Any:
+    if get_origin(annotation) in (Union, types.UnionType):
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _compile_field_tree(model: Type[BaseModel]) -> _FieldTree:
+    """
+    由模型生成可选择的字段树，用于校验字段路径
+    """
+    tree = _field_trees.get(model)
+    if tree is not None:
+        return tree
+    # 先登记再填充，以支持递归嵌套的模型
+    tree = _field_trees[model] = {}
+    for name, field_info in model.model_fields.items():
+        annotation = _unwrap_optional(field_info.annotation)
+        containers = 0
+        while get_origin(annotation) in (list, set, frozenset, tuple, dict) and get_args(annotation):
+            annotation = _unwrap_optional(get_args(annotation)[-1])
+            containers += 1
+        child = _compile_field_tree(annotation) \
+            if inspect.isclass(annotation) and issubclass(annotation, BaseModel) else None
+        tree[name] = (containers, child)
+    return tree
+
+
+def _parse_field_selector(paths: str, tree: _FieldTree) -> dict:
+    """
+    将逗号分隔的字段路径（如`a.b,c`）转换为pydantic的include/exclude格式，列表与字典中的元素以`__all__`表示
+    """
+    selector = {}
+    for path in paths.split(','):
+        path = path.strip()
+        if not path:
+            continue
+        node, node_tree = selector, tree
+        parts = path.split('.')
+        for index, part in enumerate(parts):
+            if node_tree is None or part not in node_tree:
+                raise _321CQUException(error_info=f"未知字段: {path}", status_code=400)
+            containers, child = node_tree[part]
+            if index == len(parts) - 1:
+                node[part] = True
+                break
+            sub = node.get(part)
+            if sub is True:
+                break
+            if sub is None:
+                sub = node[part] = {}
+            for _ in range(containers):
+                sub = sub.setdefault('__all__', {})
+            node, node_tree = sub, child
+    return selector
+
+
+def select_fields(value: Any, include: Optional[dict], exclude: Optional[dict]) -> Any:
+    """
+    按pydantic格式的include/exclude字段选择裁剪json原生对象
+    """
+    if include is not None:
+        value = _select_fields(value, include, True)
+    if exclude is not None:
+        value = _select_fields(value, exclude, False)
+    return value
+
+
+# 当前路由的响应模型与字段选择(retval, include, exclude)，由api_response设置
+_field_selection: ContextVar[Optional[Tuple[Any, Optional[dict], Optional[dict]]]] = \
+    ContextVar('field_selection', default=None)
+
+
+def get_field_selection(model: Any) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    当前请求对model的字段选择(include, exclude)，转码器据此跳过未选择的字段
+
+    model不是当前路由的响应模型，或处于full_fields上下文中时返回(None, None)
+    """
+    selection = _field_selection.get()
+    if selection is None or selection[0] is not model:
+        return None, None
+    return selection[1], selection[2]
+
+
+@contextmanager
+def full_fields():
+    """
+    在该上下文中构建的结果不应用字段选择，用于缓存等需要保存完整结果的装饰器
+    """
+    token = _field_selection.set(None)
+    try:
+        yield
+    finally:
+        _field_selection.reset(token)
+
+
+def _select_fields(value: Any, selector: dict, include: bool) -> Any:
+    """
+    按字段选择裁剪json原生对象，与pydantic的include/exclude语义一致
+    """
+    if '__all__' in selector:
+        sub = selector['__all__']
+        if isinstance(value, list):
+            return [_select_fields(item, sub, include) for item in value]
+        if isinstance(value, dict):
+            return {key: _select_fields(item, sub, include) for key, item in value.items()}
+        return value
+    if not isinstance(value, dict):
+        return value
+
+    result = {}
+    for key, item in value.items():
+        sub = selector.get(key)
+        if include:
+            if sub is not None:
+                result[key] = item if sub is True else _select_fields(item, sub, True)
+        elif sub is not True:
+            result[key] = item if sub is None else _select_fields(item, sub, False)
+    return result
+
+
+def wrap_success_payload(payload: bytes) -> bytes:
+    """
+    将data部分的json包装为完整的成功响应体
+    """
+    return _SUCCESS_PREFIX + payload + _SUCCESS_SUFFIX
+
+
+def compile_response_serializer(retval: Optional[Union[Type[BaseModel], Dict]] = None) -> Callable[[Any], bytes]:
+    """
+    生成成功响应的序列化函数，结果与`BaseApiResponse[retval](status=1, msg='success', data=...)`的json一致
+
+    外层结构预先编码，仅需序列化data部分
+    :param retval: 返回值类型，与api_response的retval参数相同
+    """
+    serialize_data = compile_data_serializer(retval)
+    return lambda data: wrap_success_payload(serialize_data(data))
+
+
+def compute_etag(payload: bytes) -> str:
+    """
+    计算data部分的强ETag，成功响应的外层结构固定，因此data相同即响应体相同
+    """
+    return '"' + hashlib.blake2b(payload, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    判断If-None-Match是否命中，同时接受压缩后带有编码后缀的ETag（如`"xxx-gzip"`）
+    """
+    if not if_none_match:
+        return False
+    prefix = etag[:-1] + '-'
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag or tag.startswith(prefix):
+            return True
+    return False
+
+
+def _compile_query_parser(query: Type[BaseModel]) -> Callable[[Dict[str, list]], BaseModel]:
+    """
+    生成路由查询参数解析函数，预先确定哪些字段为列表类型
+
+    列表字段始终传入全部取值，其余字段只传入第一个取值
+    """
+    list_fields = set()
+    for name, field_info in query.model_fields.items():
+        annotation = _unwrap_optional(field_info.annotation)
+        if get_origin(annotation) in (list, set, frozenset, tuple) or annotation in (list, set, frozenset, tuple):
+            list_fields.add(name)
+
+    def parse(args: Dict[str, list]) -> BaseModel:
+        return query.model_validate({
+            key: value if key in list_fields else value[0] for key, value in args.items()
+        })
+
+    return parse
+
+
 def api_request(
         json: Type[BaseModel] | None = None,
         form: Type[BaseModel] | None = None,
@@ -65,22 +379,23 @@ def api_request(
             } if form is not None else None
         )
         params = {**kwargs}
+        query_parser = _compile_query_parser(query) if query is not None else None
 
         @wraps(f)
         async def decorated_function(*args, **kwargs):
             request = extract_request(*args)
             try:
                 if json:
-                    kwargs[body_argument] = json.model_validate(request.json)
+                    # 直接由pydantic-core解析原始请求体，避免先解析为dict再校验
+                    kwargs[body_argument] = json.model_validate_json(request.body)
                 elif form:
                     kwargs[body_argument] = form.model_validate(request.form)
                 if query:
-                    parsed_args = {}
-                    for key, value in request.args.items():
-                        parsed_args[key] = value[0] if len(value) == 1 else value
-                    kwargs[query_argument] = query.model_validate(parsed_args)
+                    kwargs[query_argument] = query_parser(request.args)
             except ValidationError as e:
-                raise _321CQUException(error_info=f"请求参数错误", quite=True)
+                # 请求体为空或不是合法json时返回400，与sanic解析request.json失败时一致
+                status_code = 400 if any(error['type'] == 'json_invalid' for error in e.errors()) else None
+                raise _321CQUException(error_info=f"请求参数错误", status_code=status_code, quite=True)
             retval = f(*args, **kwargs)
             if inspect.isawaitable(retval):
                 retval = await retval
@@ -109,32 +424,112 @@ def api_request(
     return decorator
 
 
+async def _stream_ndjson(request: Request, ret: Any, stream_field: str, list_field: bool,
+                         serialize_data: Callable[..., bytes], include: Optional[dict],
+                         exclude: Optional[dict]) -> None:
+    """
+    以NDJSON流式写出响应，响应已通过request.respond发送，路由函数应返回None
+
+    首行为`{"status":1,"msg":"success","stream_field":字段名,"data":其余字段}`，其后每行为流式字段中的一个元素；
+    流式字段为字典时每行为`{"key":键,"item":元素}`，值为列表时逐个元素输出。
+    流式字段为列表时，缓存得到的JsonData直接写出拆分后的各元素字节，同一缓存条目仅在首次流式写出时解析
+    :param list_field: 流式字段是否为列表
+    """
+    unselected = include is None and exclude is None
+    if isinstance(ret, BaseModel) and unselected:
+        items = getattr(ret, stream_field)
+        rest = ret.__pydantic_serializer__.to_json(ret, exclude={stream_field})
+    elif isinstance(ret, JsonData) and (unselected or ret.selected) and list_field:
+        rest_obj, items = ret.split(stream_field)
+        rest = to_json(rest_obj)
+    else:
+        obj = ret.obj if isinstance(ret, JsonData) and (unselected or ret.selected) \
+            else ujson.loads(serialize_data(ret, include, exclude))
+        # 缓存中的对象可能被共享，复制后再取出流式字段
+        obj = dict(obj or {})
+        items = obj.pop(stream_field, None)
+        rest = to_json(obj)
+
+    def dump(item: Any) -> bytes:
+        if isinstance(item, bytes):
+            return item
+        return item.__pydantic_serializer__.to_json(item) if isinstance(item, BaseModel) else to_json(item)
+
+    response = await request.respond(content_type=NDJSON_CONTENT_TYPE)
+    await response.send(b'{"status":1,"msg":"success","stream_field":' + to_json(stream_field) +
+                        b',"data":' + rest + b'}\n')
+    if isinstance(items, dict):
+        for key, value in items.items():
+            encoded_key = to_json(key)
+            for item in (value if isinstance(value, list) else [value]):
+                await response.send(b'{"key":' + encoded_key + b',"item":' + dump(item) + b'}\n')
+    elif items is not None:
+        for item in items:
+            await response.send(dump(item) + b'\n')
+    await response.eof()
+
+
 def api_response(retval: Optional[Union[Type[BaseModel], Dict, HTTPResponse]] = None, status: int = 200,
                  description: str = '',
-                 *, auto_wrap: bool = True, **kwargs):
+                 *, auto_wrap: bool = True, stream_field: Optional[str] = None, **kwargs):
     """
     实现参数返回值自动包装与API页面生成的装饰器
     :param retval: 返回值信息，可以为ApiResponse的子类或字典，为空则返回值中data项置None
     :param status: Response Http相应码
     :param description: 返回值相关描述，显示在/docs页面中
     :param auto_wrap: 强制关键字参数，为False时直接返回被装饰函数运行结果
+    :param stream_field: 强制关键字参数，retval中的列表或字典字段，请求头Accept包含`application/x-ndjson`时逐个元素流式写出
     :param kwargs: 其他需要显示在/docs中的参数（需满足OpenAPI规范）
     """
 
+    serialize_data = compile_data_serializer(retval) if auto_wrap else None
+    field_tree = _compile_field_tree(retval) \
+        if auto_wrap and inspect.isclass(retval) and issubclass(retval, BaseModel) else None
+    list_stream = False
+    if stream_field is not None:
+        if field_tree is None or stream_field not in field_tree or field_tree[stream_field][0] == 0:
+            raise InitError(f"stream_field {stream_field} must be a list or dict field of retval")
+        stream_annotation = _unwrap_optional(retval.model_fields[stream_field].annotation)
+        list_stream = (get_origin(stream_annotation) or stream_annotation) is not dict
+        description = (description + '\n\n' if description else '') + \
+            f'请求头Accept包含`{NDJSON_CONTENT_TYPE}`时以NDJSON流式返回，首行为响应状态与其余字段，其后每行为`{stream_field}`中的一个元素'
+
     def decorator(f):
         @wraps(f)
         async def decorated_function(*args, **kwargs):
-            ret = f(*args, **kwargs)
-            if inspect.isawaitable(ret):
-                ret = await ret
+            request = extract_request(*args)
+            include = exclude = None
+            if field_tree is not None:
+                if FIELDS_ARGUMENT in request.args:
+                    include = _parse_field_selector(','.join(request.args.getlist(FIELDS_ARGUMENT)), field_tree)
+                if EXCLUDE_FIELDS_ARGUMENT in request.args:
+                    exclude = _parse_field_selector(','.join(request.args.getlist(EXCLUDE_FIELDS_ARGUMENT)),
+                                                    field_tree)
+
+            token = _field_selection.set((retval, include, exclude)
+                                         if include is not None or exclude is not None else None)
+            try:
+                ret = f(*args, **kwargs)
+                if inspect.isawaitable(ret):
+                    ret = await ret
+            finally:
+                _field_selection.reset(token)
 
             kwargs["status"] = status
+            if stream_field is not None and NDJSON_CONTENT_TYPE in request.headers.get('accept', ''):
+                await _stream_ndjson(request, ret, stream_field, list_stream, serialize_data, include, exclude)
+                return None
             if auto_wrap:
-                return HTTPResponse(
-                    BaseApiResponse[(retval if retval is not None else Dict)](
-                        status=1, msg='success', data=(ret if ret is not None else {})
-                    ).model_dump_json(),
-                    content_type="application/json")
+                payload = serialize_data(ret, include, exclude)
+                if request.method != 'GET':
+                    return HTTPResponse(wrap_success_payload(payload), content_type="application/json")
+
+                etag = ret.etag if isinstance(ret, JsonData) and ret.etag is not None \
+                    and (ret.selected or (include is None and exclude is None)) else compute_etag(payload)
+                if etag_matches(request.headers.get('if-none-match'), etag):
+                    return HTTPResponse(status=304, headers={'etag': etag})
+                return HTTPResponse(wrap_success_payload(payload), headers={'etag': etag},
+                                    content_type="application/json")
             else:
                 return ret
 
@@ -142,6 +537,13 @@ def api_response(retval: Optional[Union[Type[BaseModel], Dict, HTTPResponse]] =
         if f in OperationStore():
             OperationStore()[decorated_function] = OperationStore().pop(f)
 
+        if field_tree is not None:
+            OperationStore()[decorated_function].parameter(
+                FIELDS_ARGUMENT, str, 'query',
+                description='仅返回所选字段，逗号分隔的字段路径，嵌套字段以`.`连接，如`a.b,c`')
+            OperationStore()[decorated_function].parameter(
+                EXCLUDE_FIELDS_ARGUMENT, str, 'query', description='不返回所选字段，格式与fields相同')
+
         if auto_wrap:
             if inspect.isclass(retval) and issubclass(retval, BaseModel):
                 OperationStore()[decorated_function].response(
@@ -163,7 +565,7 @@ def api_response(retval: Optional[Union[Type[BaseModel], Dict, HTTPResponse]] =
 
 def handle_grpc_error(func):
     """
-    处理AioRpcError，返回的HttpResponse中包含503与grpc报错详细信息
+    处理AioRpcError，返回的HttpResponse中包含503（超时为504）与grpc报错详细信息
     """
 
     @wraps(func)
@@ -177,6 +579,8 @@ def handle_grpc_error(func):
             if e.code() == StatusCode.UNAVAILABLE:
                 raise _321CQUException(error_info=e.details() if e.details() is not None else "服务调用异常",
                                        extra=e.details(), status_code=503, quite=False)
+            elif e.code() == StatusCode.DEADLINE_EXCEEDED:
+                raise _321CQUException(error_info="请求超时", extra=e.details(), status_code=504, quite=True)
             elif e.code() == StatusCode.INVALID_ARGUMENT:
                 raise _321CQUException(error_info=e.details() if e.details() is not None else "服务调用异常",
                                        extra=e.details(), status_code=503, quite=True)
@@ -0,0 +1,235 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from enum import StrEnum
+from typing import Any, Dict, Optional
+
+from _321CQU.service import ServiceEnum
+from grpc import StatusCode
+from grpc.aio import AioRpcError
+from sanic.log import logger
+
+from utils.Exceptions import _321CQUException
+from utils.Metrics import MetricsRegistry
+from utils.Settings import ConfigManager
+
+__all__ = ['CircuitState', 'CircuitBreaker', 'AdaptiveLimiter', 'ServiceGuard', 'get_service_guard']
+
+# 视为服务故障的状态码，其余状态码（参数错误等）不影响熔断与并发限制
+_FAILURE_CODES = (StatusCode.UNAVAILABLE, StatusCode.RESOURCE_EXHAUSTED)
+
+
+def _get_setting(service: ServiceEnum, key: str, default: Any) -> Any:
+    """
+    读取`CircuitBreakerSetting`节中的配置，`{ServiceEnum名称}_{key}`优先于`{key}`
+    """
+    config = ConfigManager()
+    return config.get_config_with_default('CircuitBreakerSetting', f'{service.name}_{key}',
+                                          config.get_config_with_default('CircuitBreakerSetting', key, default))
+
+
+class CircuitState(StrEnum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    关闭状态下统计`window`秒内的调用，调用数不少于`min_requests`且失败率达到`failure_ratio`时打开；
+    打开`open_time`秒后进入半开状态，放行最多`half_open_requests`个探测调用，全部成功则关闭，任一失败则重新打开
+    """
+
+    def __init__(self, service: ServiceEnum):
+        self.window = float(_get_setting(service, 'window', 10))
+        self.min_requests = int(_get_setting(service, 'min_requests', 20))
+        self.failure_ratio = float(_get_setting(service, 'failure_ratio', 0.5))
+        self.open_time = float(_get_setting(service, 'open_time', 10))
+        self.half_open_requests = int(_get_setting(service, 'half_open_requests', 3))
+
+        self.service = service
+        self.state = CircuitState.CLOSED
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._window_start = time.monotonic()
+        self._requests = 0
+        self._failures = 0
+        self._probes = 0
+        self._probe_successes = 0
+
+    def retry_after(self, now: float) -> float:
+        return max(0.0, self.opened_at + self.open_time - now)
+
+    def allow(self, now: float) -> bool:
+        if self.state == CircuitState.OPEN:
+            if self.retry_after(now) > 0:
+                return False
+            self.state = CircuitState.HALF_OPEN
+            self._probes = 0
+            self._probe_successes = 0
+        if self.state == CircuitState.HALF_OPEN:
+            if self._probes >= self.half_open_requests:
+                return False
+            self._probes += 1
+        return True
+
+    def record(self, now: float, failed: bool) -> None:
+        if self.state == CircuitState.HALF_OPEN:
+            if failed:
+                self._open(now)
+            else:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_requests:
+                    self._close(now)
+            return
+        if self.state == CircuitState.OPEN:
+            return
+
+        if now - self._window_start >= self.window:
+            self._reset_window(now)
+        self._requests += 1
+        self._failures += failed
+        if self._requests >= self.min_requests and self._failures >= self.failure_ratio * self._requests:
+            self._open(now)
+
+    def cancel(self) -> None:
+        """
+        调用被取消，不计入统计，并归还半开状态下占用的探测名额
+        """
+        if self.state == CircuitState.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def _open(self, now: float) -> None:
+        self.state = CircuitState.OPEN
+        self.opened_at = now
+        self.times_opened += 1
+        logger.warning(f"Circuit of {self.service.name} opened for {self.open_time}s")
+
+    def _close(self, now: float) -> None:
+        self.state = CircuitState.CLOSED
+        self._reset_window(now)
+        logger.info(f"Circuit of {self.service.name} closed")
+
+    def _reset_window(self, now: float) -> None:
+        self._window_start = now
+        self._requests = 0
+        self._failures = 0
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {'state': self.state.value, 'times_opened': self.times_opened,
+                'retry_after': self.retry_after(now) if self.state == CircuitState.OPEN else 0.0,
+                'window_requests': self._requests, 'window_failures': self._failures}
+
+
+class AdaptiveLimiter:
+    """
+    基于延迟的AIMD并发限制
+
+    以各方法观测到的最小延迟为基准（同一服务中登录、成绩查询等方法的正常延迟相差很大，不能共用基准），
+    调用失败或延迟超过该方法基准的`latency_tolerance`倍时按`backoff_ratio`缩小并发上限，
+    否则在并发数接近上限时加一。基准会缓慢上调以适应后端性能的长期变化
+    """
+
+    def __init__(self, service: ServiceEnum):
+        self.min_limit = int(_get_setting(service, 'min_limit', 2))
+        self.max_limit = int(_get_setting(service, 'max_limit', 200))
+        self.latency_tolerance = float(_get_setting(service, 'latency_tolerance', 2))
+        self.backoff_ratio = float(_get_setting(service, 'backoff_ratio', 0.9))
+        self.limit = float(_get_setting(service, 'initial_limit', 20))
+        self.in_flight = 0
+        self.baselines: Dict[str, float] = {}
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self, latency: Optional[float], failed: bool, method: str = '') -> None:
+        """
+        :param latency: 调用耗时，调用被取消时为None
+        :param failed: 调用是否因服务故障失败
+        :param method: 调用的方法名，各方法分别维护延迟基准
+        """
+        in_flight = self.in_flight
+        self.in_flight -= 1
+        if latency is None:
+            return
+        baseline = self.baselines.get(method, math.inf)
+        if not failed:
+            baseline = self.baselines[method] = min(baseline * 1.01, latency) if baseline != math.inf else latency
+        if failed or latency > baseline * self.latency_tolerance:
+            self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+        elif in_flight * 2 >= self.limit:
+            self.limit = min(self.max_limit, self.limit + 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'limit': int(self.limit), 'in_flight': self.in_flight,
+                'baseline_latency': dict(self.baselines)}
+
+
+class ServiceGuard:
+    """
+    单个服务的熔断器与并发限制，拒绝时快速返回503
+    """
+
+    def __init__(self, service: ServiceEnum):
+        self.breaker = CircuitBreaker(service)
+        self.limiter = AdaptiveLimiter(service)
+        self.rejected_by_breaker = 0
+        self.rejected_by_limiter = 0
+
+    @asynccontextmanager
+    async def admit(self, method: str = '', count_timeouts: bool = True):
+        """
+        :param method: 调用的方法名，用于并发限制的延迟基准
+        :param count_timeouts: 超时（DEADLINE_EXCEEDED）是否计为服务故障，截止时间由客户端缩短时应为False
+        """
+        now = time.monotonic()
+        if not self.breaker.allow(now):
+            self.rejected_by_breaker += 1
+            raise _321CQUException(error_info="服务暂不可用，请稍后再试", status_code=503,
+                                   headers={'Retry-After': str(math.ceil(self.breaker.retry_after(now)) or 1)})
+        if not self.limiter.try_acquire():
+            self.breaker.cancel()
+            self.rejected_by_limiter += 1
+            raise _321CQUException(error_info="服务繁忙，请稍后再试", status_code=503, headers={'Retry-After': '1'})
+
+        try:
+            yield
+        except asyncio.CancelledError:
+            self.limiter.release(None, False, method)
+            self.breaker.cancel()
+            raise
+        except AioRpcError as e:
+            self._release(now, method, e.code() in _FAILURE_CODES or
+                          (count_timeouts and e.code() == StatusCode.DEADLINE_EXCEEDED))
+            raise
+        except BaseException:
+            self._release(now, method, False)
+            raise
+        else:
+            self._release(now, method, False)
+
+    def _release(self, start: float, method: str, failed: bool) -> None:
+        end = time.monotonic()
+        self.limiter.release(end - start, failed, method)
+        self.breaker.record(end, failed)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.breaker.stats(time.monotonic()), **self.limiter.stats(),
+                'rejected_by_breaker': self.rejected_by_breaker, 'rejected_by_limiter': self.rejected_by_limiter}
+
+
+_guards: Dict[ServiceEnum, ServiceGuard] = {}
+MetricsRegistry().register('grpc_service_guard', lambda: {service.name: guard.stats() for service, guard in _guards.items()})
+
+
+def get_service_guard(service: ServiceEnum) -> ServiceGuard:
+    guard = _guards.get(service)
+    if guard is None:
+        guard = _guards[service] = ServiceGuard(service)
+    return guard
@@ -0,0 +1,176 @@
+import asyncio
+import gzip
+import hashlib
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Optional, Tuple
+
+from sanic import Request
+from sanic.response import HTTPResponse
+
+from utils.Cache import LRUCache
+from utils.Metrics import MetricsRegistry
+from utils.Settings import ConfigManager
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = ['compress_response']
+
+_config = ConfigManager()
+_MIN_SIZE = int(_config.get_config_with_default('CompressionSetting', 'min_size', 1024))
+_OFFLOAD_SIZE = int(_config.get_config_with_default('CompressionSetting', 'offload_size', 65536))
+_GZIP_LEVEL = int(_config.get_config_with_default('CompressionSetting', 'gzip_level', 6))
+
+# 按优先级排列，客户端权重相同时选择靠前者
+_COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {}
+if zstandard is not None:
+    _COMPRESSORS['zstd'] = lambda data: zstandard.ZstdCompressor(level=3).compress(data)
+if brotli is not None:
+    _COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=5)
+_COMPRESSORS['gzip'] = lambda data: gzip.compress(data, compresslevel=_GZIP_LEVEL)
+
+# 可缓存（GET）响应的压缩结果，键为(ETag或响应体摘要, 编码)
+_compressed_cache = LRUCache(int(_config.get_config_with_default('CompressionSetting', 'cache_size', 1024)))
+_stats: Dict[str, Dict[str, float]] = defaultdict(
+    lambda: {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_seconds': 0.0, 'cache_hits': 0})
+
+
+def _collect_stats():
+    return {
+        'routes': {route: {**value, 'ratio': value['bytes_out'] / value['bytes_in'] if value['bytes_in'] else None}
+                   for route, value in _stats.items()},
+        'cache': _compressed_cache.stats(),
+        'encodings': list(_COMPRESSORS.keys()),
+    }
+
+
+MetricsRegistry().register('compression', _collect_stats)
+
+
+def _choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    按Accept-Encoding中的权重选择编码，不支持任何编码时返回None
+    """
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                continue
+        weights[name.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in _COMPRESSORS:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def _compress(encoding: str, data: bytes) -> Tuple[bytes, float]:
+    start = time.thread_time()
+    compressed = _COMPRESSORS[encoding](data)
+    return compressed, time.thread_time() - start
+
+
+def _vary_on_encoding(response: HTTPResponse) -> None:
+    """
+    在Vary中追加Accept-Encoding，保留路由或其他中间件已设置的值
+    """
+    vary = response.headers.get('vary')
+    if not vary:
+        response.headers['vary'] = 'Accept-Encoding'
+        return
+    values = [value.strip().lower() for value in vary.split(',')]
+    if 'accept-encoding' not in values and '*' not in values:
+        response.headers['vary'] = vary + ', Accept-Encoding'
+
+
+def _restore_representation_etag(request: Request, response: HTTPResponse) -> None:
+    """
+    304响应没有响应体，按客户端缓存的表示返回与200一致的ETag（压缩时带编码后缀）与Vary
+    """
+    etag = response.headers.get('etag')
+    if etag is None:
+        return
+    _vary_on_encoding(response)
+    encoding = _choose_encoding(request.headers.get('accept-encoding', ''))
+    if encoding is None:
+        return
+    suffixed = etag[:-1] + '-' + encoding + '"'
+    for tag in request.headers.get('if-none-match', '').split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == suffixed:
+            response.headers['etag'] = suffixed
+            return
+
+
+async def compress_response(request: Request, response: HTTPResponse):
+    """
+    响应中间件，按Accept-Encoding压缩超过阈值的json/文本响应
+
+    较大的响应在线程池中压缩以免阻塞事件循环，GET请求的压缩结果会被缓存；
+    304响应按客户端缓存的表示补全ETag编码后缀与Vary
+    """
+    if response.status == 304:
+        _restore_representation_etag(request, response)
+        return
+    body = response.body
+    if not body or len(body) < _MIN_SIZE or response.status != 200 or 'content-encoding' in response.headers:
+        return
+    content_type = response.content_type or ''
+    if not (content_type.startswith('application/json') or content_type.startswith('text/')):
+        return
+
+    _vary_on_encoding(response)
+    encoding = _choose_encoding(request.headers.get('accept-encoding', ''))
+    if encoding is None:
+        return
+
+    route = request.route.name if request.route is not None else request.path
+    stats = _stats[route]
+
+    cache_key = None
+    compressed = None
+    etag = response.headers.get('etag')
+    if etag is not None:
+        # 强ETag需区分编码，If-None-Match比较时会忽略该后缀
+        response.headers['etag'] = etag[:-1] + '-' + encoding + '"'
+    if request.method == 'GET':
+        # 已有ETag时直接以其作为缓存键，无需再次计算摘要
+        cache_key = (etag if etag is not None else hashlib.blake2b(body, digest_size=16).digest(), encoding)
+        compressed = _compressed_cache.get(cache_key)
+        if compressed is not None:
+            stats['cache_hits'] += 1
+
+    if compressed is None:
+        if len(body) >= _OFFLOAD_SIZE:
+            compressed, cpu_seconds = await asyncio.get_running_loop().run_in_executor(None, _compress, encoding, body)
+        else:
+            compressed, cpu_seconds = _compress(encoding, body)
+        stats['cpu_seconds'] += cpu_seconds
+        if cache_key is not None:
+            _compressed_cache.set(cache_key, compressed)
+
+    stats['responses'] += 1
+    stats['bytes_in'] += len(body)
+    stats['bytes_out'] += len(compressed)
+
+    response.body = compressed
+    response.headers['content-encoding'] = encoding
+    if 'content-length' in response.headers:
+        response.headers['content-length'] = str(len(compressed))
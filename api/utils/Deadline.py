@@ -0,0 +1,87 @@
+import time
+from typing import Dict, Optional
+
+from sanic import Request
+from sanic.exceptions import SanicException
+
+from utils.Exceptions import _321CQUException
+from utils.Settings import ConfigManager
+
+__all__ = ['apply_deadline', 'remaining_time', 'is_client_deadline', 'DEADLINE_HEADER']
+
+# 客户端可通过该请求头（单位秒）缩短本次请求的时间预算，但不能超过路由配置的预算
+DEADLINE_HEADER = 'x-request-timeout'
+
+_config = ConfigManager()
+_DEFAULT_BUDGET = float(_config.get_config_with_default('DeadlineSetting', 'default', 10))
+# 客户端设置的预算下限
+_MIN_CLIENT_BUDGET = float(_config.get_config_with_default('DeadlineSetting', 'min_client', 1))
+_budgets: Dict[str, float] = {}
+
+
+def _get_budget(blueprint: str) -> float:
+    """
+    读取蓝图的时间预算，配置文件`DeadlineSetting`节中以蓝图名称为键，未配置时使用`default`
+    """
+    budget = _budgets.get(blueprint)
+    if budget is None:
+        budget = _budgets[blueprint] = float(_config.get_config_with_default('DeadlineSetting', blueprint,
+                                                                              _DEFAULT_BUDGET))
+    return budget
+
+
+async def apply_deadline(request: Request):
+    """
+    请求中间件，为请求设置截止时间`request.ctx.deadline`（time.monotonic时间）
+    """
+    name_parts = request.name.split('.') if request.name else []
+    budget = _get_budget(name_parts[1] if len(name_parts) >= 3 else '')
+
+    client_deadline = False
+    client_budget = request.headers.get(DEADLINE_HEADER)
+    if client_budget is not None:
+        try:
+            client_budget = float(client_budget)
+        except ValueError:
+            raise _321CQUException(error_info=f'{DEADLINE_HEADER}格式错误', status_code=400)
+        if client_budget > 0:
+            client_budget = max(client_budget, _MIN_CLIENT_BUDGET)
+            client_deadline = client_budget < budget
+            budget = min(budget, client_budget)
+
+    request.ctx.deadline = time.monotonic() + budget
+    request.ctx.client_deadline = client_deadline
+
+
+def remaining_time(request: Optional[Request] = None) -> Optional[float]:
+    """
+    当前请求剩余的时间预算，预算已耗尽时抛出504，不在请求上下文中或未设置截止时间时返回None
+
+    :param request: 未传入时使用当前正在处理的请求
+    """
+    if request is None:
+        try:
+            request = Request.get_current()
+        except SanicException:
+            return None
+    deadline = getattr(request.ctx, 'deadline', None)
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise _321CQUException(error_info='请求超时', status_code=504)
+    return remaining
+
+
+def is_client_deadline(request: Optional[Request] = None) -> bool:
+    """
+    截止时间是否由客户端缩短至路由预算以下，此时的gRPC超时反映的是客户端要求而非后端故障，不应计入熔断与实例健康统计
+
+    :param request: 未传入时使用当前正在处理的请求
+    """
+    if request is None:
+        try:
+            request = Request.get_current()
+        except SanicException:
+            return False
+    return getattr(request.ctx, 'client_deadline', False)
@@ -0,0 +1,143 @@
+import base64
+import hashlib
+import hmac
+import inspect
+import secrets
+import struct
+from functools import wraps
+from typing import Iterable, Optional, Tuple
+
+from sanic_ext.extensions.openapi.builders import OperationStore
+from sanic_ext.utils.extraction import extract_request
+
+from api.utils.ApiInterface import JsonData, compute_etag, full_fields
+from api.utils.ResponseCache import make_cache_key, prepare_cached_data
+from utils.Exceptions import _321CQUException
+from utils.Settings import ConfigManager
+
+__all__ = ['paginated', 'CURSOR_ARGUMENT', 'PAGE_SIZE_ARGUMENT', 'NEXT_CURSOR_FIELD']
+
+# 分页的路由查询参数名与响应中下一页游标的字段名
+CURSOR_ARGUMENT = 'cursor'
+PAGE_SIZE_ARGUMENT = 'page_size'
+NEXT_CURSOR_FIELD = 'next_cursor'
+
+_config = ConfigManager()
+_DEFAULT_PAGE_SIZE = int(_config.get_config_with_default('PaginationSetting', 'default_page_size', 50))
+_MAX_PAGE_SIZE = int(_config.get_config_with_default('PaginationSetting', 'max_page_size', 200))
+
+# 游标结构：偏移量(4) + 查询摘要(8) + 结果摘要(8) + 签名(12)
+_CURSOR_BODY = struct.Struct('>I8s8s')
+_MAC_SIZE = 12
+
+
+def _cursor_secret() -> bytes:
+    """
+    游标签名密钥需在各worker间一致，未单独配置时由jwt密钥派生
+    """
+    secret = _config.get_config_with_default('PaginationSetting', 'cursor_secret') or \
+        _config.get_config_with_default('ApiKey', 'jwt_secret')
+    if secret is None:
+        return secrets.token_bytes(32)
+    return hmac.new(secret.encode(), b'pagination-cursor', hashlib.sha256).digest()
+
+
+_secret = _cursor_secret()
+
+
+def _digest(value: bytes) -> bytes:
+    return hashlib.sha256(value).digest()[:8]
+
+
+def _encode_cursor(offset: int, scope: bytes, snapshot: bytes) -> str:
+    body = _CURSOR_BODY.pack(offset, scope, snapshot)
+    mac = hmac.new(_secret, body, hashlib.sha256).digest()[:_MAC_SIZE]
+    return base64.urlsafe_b64encode(body + mac).rstrip(b'=').decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[int, bytes, bytes]:
+    """
+    :return: (偏移量, 查询摘要, 结果摘要)
+    :raise _321CQUException: 游标格式错误或签名不正确
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    except ValueError:
+        raw = b''
+    body, mac = raw[:_CURSOR_BODY.size], raw[_CURSOR_BODY.size:]
+    if len(body) != _CURSOR_BODY.size or \
+            not hmac.compare_digest(mac, hmac.new(_secret, body, hashlib.sha256).digest()[:_MAC_SIZE]):
+        raise _321CQUException(error_info='分页游标无效', status_code=400, quite=True)
+    return _CURSOR_BODY.unpack(body)
+
+
+def _parse_page_size(value: Optional[str], default: int, maximum: int) -> int:
+    if value is None:
+        return default
+    try:
+        page_size = int(value)
+    except ValueError:
+        page_size = 0
+    if page_size < 1:
+        raise _321CQUException(error_info='请求参数错误', status_code=400, quite=True)
+    return min(page_size, maximum)
+
+
+def paginated(list_field: str, *, page_size: Optional[int] = None, max_page_size: Optional[int] = None,
+              ignore: Iterable[str] = ('user',)):
+    """
+    列表结果的游标分页装饰器，需放置在`authorized`之下、`shared_cache`/`user_cache`之上
+
+    被装饰函数始终返回完整结果，由下方的缓存保存，翻页时直接从缓存中切片，不再调用后端服务。
+    游标由偏移量、查询参数摘要与完整结果摘要组成并签名，不能用于其他查询；
+    完整结果发生变化（缓存过期后重新获取且内容不同）时旧游标失效，客户端需重新查询。
+    页大小默认值与上限可在配置文件`PaginationSetting`节中以`default_page_size`、`max_page_size`设置
+    :param list_field: 返回值中需要分页的列表字段
+    :param page_size: 默认页大小
+    :param max_page_size: 页大小上限
+    :param ignore: 不参与查询摘要计算的参数名
+    """
+    maximum = max_page_size if max_page_size is not None else _MAX_PAGE_SIZE
+    default = min(page_size if page_size is not None else _DEFAULT_PAGE_SIZE, maximum)
+    ignore = frozenset(ignore)
+
+    def decorator(f):
+        route = f"{f.__module__}.{f.__qualname__}"
+
+        @wraps(f)
+        async def wrapped_function(*args, **kwargs):
+            request = extract_request(*args)
+            size = _parse_page_size(request.args.get(PAGE_SIZE_ARGUMENT), default, maximum)
+            scope = _digest(repr((route, make_cache_key(kwargs, ignore))).encode())
+            cursor = request.args.get(CURSOR_ARGUMENT)
+            offset, snapshot = 0, None
+            if cursor:
+                offset, cursor_scope, snapshot = _decode_cursor(cursor)
+                if cursor_scope != scope:
+                    raise _321CQUException(error_info='分页游标无效', status_code=400, quite=True)
+
+            with full_fields():
+                ret = f(*args, **kwargs)
+                if inspect.isawaitable(ret):
+                    ret = await ret
+            data = ret if isinstance(ret, JsonData) else prepare_cached_data(ret)
+            current = _digest((data.etag or compute_etag(data.payload)).encode())
+            if snapshot is not None and snapshot != current:
+                raise _321CQUException(error_info='分页游标已失效，请重新查询', status_code=400, quite=True)
+
+            # 完整结果的拆分按ETag保存，翻页只切片并拼接各元素的字节，不再解析完整结果
+            rest, items = data.split(list_field)
+            end = offset + size
+            return JsonData.from_items(
+                {**rest, NEXT_CURSOR_FIELD: _encode_cursor(end, scope, current) if end < len(items) else None},
+                list_field, items[offset:end])
+
+        if f in OperationStore():
+            OperationStore()[wrapped_function] = OperationStore().pop(f)
+        OperationStore()[wrapped_function].parameter(
+            CURSOR_ARGUMENT, str, 'query', description=f'分页游标，取上一页响应中的`{NEXT_CURSOR_FIELD}`，为空时返回第一页')
+        OperationStore()[wrapped_function].parameter(
+            PAGE_SIZE_ARGUMENT, int, 'query', description=f'每页`{list_field}`的数量，默认{default}，最大{maximum}')
+        return wrapped_function
+
+    return decorator
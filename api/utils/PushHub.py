@@ -0,0 +1,142 @@
+import asyncio
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from _321CQU.tools import Singleton
+from micro_services_protobuf.protobuf_enum.notification_center import NotificationEvent
+from pydantic import BaseModel, Field
+from sanic.log import logger
+
+from utils.Metrics import MetricsRegistry
+from utils.Settings import ConfigManager
+
+__all__ = ['PushEvent', 'PushConnection', 'PushHub', 'EventSource', 'LocalEventSource']
+
+
+class PushEvent(BaseModel):
+    """
+    推送给客户端的通知事件
+    """
+    uid: str = Field(title='用户身份标识符')
+    event: NotificationEvent = Field(title='事件类型', description=NotificationEvent.get_all_events_description())
+    data: Optional[Dict[str, Any]] = Field(default=None, title='事件内容')
+
+
+class PushConnection:
+    """
+    一个推送连接，事件先进入有界队列再由连接处理函数写出
+
+    队列已满时丢弃最旧的事件，连续丢弃`max_dropped`个事件的慢速连接会被标记为关闭
+    """
+
+    def __init__(self, uid: str, events: Optional[Set[NotificationEvent]], queue_size: int, max_dropped: int):
+        self.uid = uid
+        self.events = events
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(queue_size)
+        self.max_dropped = max_dropped
+        self.dropped = 0
+        self.closed = asyncio.Event()
+
+    def accepts(self, event: NotificationEvent) -> bool:
+        return self.events is None or event in self.events
+
+    def offer(self, message: bytes) -> bool:
+        """
+        :return: 是否因队列已满丢弃了最旧的事件
+        """
+        dropped = self.queue.full()
+        if dropped:
+            self.queue.get_nowait()
+            self.dropped += 1
+            if self.dropped >= self.max_dropped:
+                self.closed.set()
+        else:
+            self.dropped = 0
+        self.queue.put_nowait(message)
+        return dropped
+
+
+class EventSource(ABC):
+    """
+    通知事件来源，PushHub从中读取事件并分发给本worker中的连接
+    """
+
+    @abstractmethod
+    def events(self) -> AsyncIterator[PushEvent]:
+        ...
+
+
+class LocalEventSource(EventSource):
+    """
+    进程内事件来源，事件由publish写入，用于测试及尚未接入后端事件流时使用
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue[PushEvent] = asyncio.Queue()
+
+    def publish(self, event: PushEvent) -> None:
+        self._queue.put_nowait(event)
+
+    async def events(self) -> AsyncIterator[PushEvent]:
+        while True:
+            yield await self._queue.get()
+
+
+class PushHub(metaclass=Singleton):
+    """
+    本worker的推送连接注册表，按uid分发事件
+    """
+
+    def __init__(self):
+        config = ConfigManager()
+        self.queue_size = int(config.get_config_with_default('PushSetting', 'queue_size', 64))
+        self.max_dropped = int(config.get_config_with_default('PushSetting', 'max_dropped', 256))
+        self.heartbeat_interval = float(config.get_config_with_default('PushSetting', 'heartbeat_interval', 25))
+        self.source: EventSource = LocalEventSource()
+        self._connections: Dict[str, Set[PushConnection]] = defaultdict(set)
+        self.delivered = 0
+        self.dropped = 0
+        MetricsRegistry().register('push_hub', self.stats)
+
+    def register(self, uid: str, events: Optional[Set[NotificationEvent]] = None) -> PushConnection:
+        """
+        :param uid: 用户身份标识符
+        :param events: 推送的事件类型，为None时推送该用户的全部事件
+        """
+        connection = PushConnection(uid, events, self.queue_size, self.max_dropped)
+        self._connections[uid].add(connection)
+        return connection
+
+    def unregister(self, connection: PushConnection) -> None:
+        connections = self._connections.get(connection.uid)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self._connections[connection.uid]
+
+    def publish(self, event: PushEvent) -> None:
+        message = event.__pydantic_serializer__.to_json(event, exclude={'uid'})
+        for connection in tuple(self._connections.get(event.uid, ())):
+            if connection.accepts(event.event):
+                self.dropped += connection.offer(message)
+                self.delivered += 1
+
+    async def run(self) -> None:
+        """
+        持续读取事件来源并分发，来源异常时稍后重试
+        """
+        while True:
+            try:
+                async for event in self.source.events():
+                    self.publish(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Push event source failed: {e!r}")
+                await asyncio.sleep(1)
+
+    def stats(self) -> Dict[str, int]:
+        return {'users': len(self._connections),
+                'connections': sum(len(connections) for connections in self._connections.values()),
+                'delivered': self.delivered, 'dropped': self.dropped}
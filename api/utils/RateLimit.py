@@ -0,0 +1,146 @@
+import hashlib
+import inspect
+import math
+import time
+from collections import Counter
+from functools import wraps
+from multiprocessing import Array
+from typing import Optional
+
+from pydantic import BaseModel, Field
+from sanic import Sanic
+from sanic_ext.utils.extraction import extract_request
+
+from utils.Exceptions import _321CQUException
+from utils.Metrics import MetricsRegistry
+from utils.Settings import ConfigManager
+
+__all__ = ['RateLimitRule', 'RateLimiter', 'create_shared_buckets']
+
+_limited_counter: Counter = Counter()
+_allowed_counter: Counter = Counter()
+MetricsRegistry().register('rate_limit', lambda: {'allowed': dict(_allowed_counter), 'limited': dict(_limited_counter)})
+
+
+def create_shared_buckets() -> Array:
+    """
+    创建跨worker共享的令牌桶槽位，需在主进程启动时（main_process_start）调用并存入`app.shared_ctx.rate_limit_buckets`
+
+    每个槽位占用两个double，分别为剩余令牌数与上次补充时间；键被哈希到固定槽位，冲突的键共享同一个桶
+    """
+    slot_count = int(ConfigManager().get_config_with_default('RateLimitSetting', 'slot_count', 65536))
+    return Array('d', slot_count * 2)
+
+
+_local_buckets: Optional[Array] = None
+
+
+def _get_buckets(app: Sanic) -> Array:
+    global _local_buckets
+    buckets = getattr(app.shared_ctx, 'rate_limit_buckets', None)
+    if buckets is not None:
+        return buckets
+    # 未通过app.run启动（如测试中的ASGI客户端）时退化为进程内令牌桶
+    if _local_buckets is None:
+        _local_buckets = create_shared_buckets()
+    return _local_buckets
+
+
+class RateLimitRule(BaseModel):
+    """令牌桶规则"""
+    rate: float = Field(title='每秒补充的令牌数')
+    burst: int = Field(title='令牌桶容量')
+
+
+def _slot(buckets: Array, key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') % (len(buckets) // 2)
+
+
+def _acquire(buckets: Array, key: str, rule: RateLimitRule) -> float:
+    """
+    从key对应的令牌桶中取出一个令牌
+
+    :return: 成功时为0，失败时为需要等待的秒数
+    """
+    slot = _slot(buckets, key)
+    now = time.time()
+    with buckets.get_lock():
+        raw = buckets.get_obj()
+        tokens, last = raw[slot * 2], raw[slot * 2 + 1]
+        tokens = rule.burst if last == 0 else min(rule.burst, tokens + (now - last) * rule.rate)
+        if tokens >= 1:
+            raw[slot * 2], raw[slot * 2 + 1] = tokens - 1, now
+            return 0
+        raw[slot * 2], raw[slot * 2 + 1] = tokens, now
+    return (1 - tokens) / rule.rate
+
+
+def _refund(buckets: Array, key: str, rule: RateLimitRule) -> None:
+    """
+    归还_acquire成功取出的令牌
+    """
+    slot = _slot(buckets, key)
+    with buckets.get_lock():
+        raw = buckets.get_obj()
+        raw[slot * 2] = min(rule.burst, raw[slot * 2] + 1)
+
+
+class RateLimiter:
+    """
+    按蓝图配置的限流装饰器，需放置在`authorized`之下
+
+    每个被装饰路由分别按请求类型、按用户维护令牌桶，令牌桶状态在worker间共享。
+    规则可在配置文件`RateLimitSetting`节中以`{name}_user_rate`、`{name}_user_burst`、
+    `{name}_apply_type_rate`、`{name}_apply_type_burst`覆盖
+    """
+
+    def __init__(self, name: str, *, user_rule: Optional[RateLimitRule] = None,
+                 apply_type_rule: Optional[RateLimitRule] = None):
+        """
+        :param name: 限流器名称，通常为蓝图名称
+        :param user_rule: 单个用户访问单个路由的默认规则
+        :param apply_type_rule: 单个请求类型访问单个路由的默认规则
+        """
+        self.name = name
+        self.user_rule = self._load_rule('user', user_rule)
+        self.apply_type_rule = self._load_rule('apply_type', apply_type_rule)
+
+    def _load_rule(self, scope: str, default: Optional[RateLimitRule]) -> Optional[RateLimitRule]:
+        config = ConfigManager()
+        rate = config.get_config_with_default('RateLimitSetting', f'{self.name}_{scope}_rate')
+        burst = config.get_config_with_default('RateLimitSetting', f'{self.name}_{scope}_burst')
+        if rate is None or burst is None:
+            return default
+        return RateLimitRule(rate=float(rate), burst=int(burst))
+
+    def __call__(self, f):
+        route = f"{self.name}.{f.__name__}"
+
+        @wraps(f)
+        async def wrapped_function(*args, **kwargs):
+            request = extract_request(*args)
+            payload = request.ctx.token_payload
+            buckets = _get_buckets(request.app)
+
+            # 先检查用户令牌桶，被限流用户的请求不消耗同一请求类型下其他用户共享的令牌
+            wait = 0
+            user_key = f"{route}|u|{payload.applyType}|{payload.username}" \
+                if self.user_rule is not None and payload.username else None
+            if user_key is not None:
+                wait = _acquire(buckets, user_key, self.user_rule)
+            if wait == 0 and self.apply_type_rule is not None:
+                wait = _acquire(buckets, f"{route}|a|{payload.applyType}", self.apply_type_rule)
+                if wait > 0 and user_key is not None:
+                    _refund(buckets, user_key, self.user_rule)
+            if wait > 0:
+                _limited_counter[route] += 1
+                raise _321CQUException(error_info='请求过于频繁', status_code=429,
+                                       headers={'Retry-After': str(math.ceil(wait))})
+            _allowed_counter[route] += 1
+
+            retval = f(*args, **kwargs)
+            if inspect.isawaitable(retval):
+                retval = await retval
+            return retval
+
+        return wrapped_function
@@ -0,0 +1,89 @@
+import inspect
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, Iterable, Tuple
+
+from pydantic import BaseModel
+
+from api.utils.ApiInterface import JsonData, compile_data_serializer, compute_etag, full_fields
+from utils.Cache import LRUCache
+from utils.Metrics import MetricsRegistry
+from utils.Settings import ConfigManager
+from utils.SingleFlight import SingleFlight
+
+__all__ = ['shared_cache', 'make_cache_key', 'prepare_cached_data']
+
+_route_stats: Dict[str, Callable[[], Dict[str, Any]]] = {}
+MetricsRegistry().register('shared_response_cache', lambda: {route: stats() for route, stats in _route_stats.items()})
+
+_serialize_data = compile_data_serializer()
+
+
+def make_cache_key(kwargs: Dict[str, Any], ignore: Iterable[str] = ()) -> Tuple[Hashable, ...]:
+    """
+    由经过校验的请求模型与路径参数生成缓存键，注入的依赖（gRPCManager等）不参与计算
+
+    :param kwargs: 被装饰函数收到的关键字参数
+    :param ignore: 不参与计算的参数名
+    """
+    key = []
+    for name in sorted(kwargs):
+        if name in ignore:
+            continue
+        value = kwargs[name]
+        if isinstance(value, BaseModel):
+            key.append((name, value.model_dump_json()))
+        elif value is None or isinstance(value, (str, int, float, bool)):
+            key.append((name, value))
+    return tuple(key)
+
+
+def prepare_cached_data(ret: Any) -> JsonData:
+    """
+    将被装饰函数的返回值序列化为可直接写出的data，并一同保存ETag
+    """
+    payload = _serialize_data(ret)
+    return JsonData(payload=payload, etag=compute_etag(payload))
+
+
+def shared_cache(ttl: float, maxsize: int = 256, ignore: Iterable[str] = ('user',)):
+    """
+    用户无关接口的共享响应缓存装饰器，需放置在`authorized`之下以保证仍进行权限校验
+
+    缓存已序列化的data与其ETag，同一参数的并发未命中只会触发一次后端调用。
+    过期时间可在配置文件`ResponseCacheSetting`节中以`{函数名}_ttl`覆盖
+    :param ttl: 缓存有效秒数
+    :param maxsize: 该路由最多缓存的条目数
+    :param ignore: 不参与缓存键计算的参数名
+    """
+    ignore = frozenset(ignore)
+
+    def decorator(f):
+        route = f"{f.__module__}.{f.__qualname__}"
+        route_ttl = float(ConfigManager().get_config_with_default('ResponseCacheSetting', f'{f.__name__}_ttl', ttl))
+        cache = LRUCache(maxsize)
+        flight = SingleFlight()
+        _route_stats[route] = lambda: {**cache.stats(), 'single_flight': flight.stats()}
+
+        @wraps(f)
+        async def wrapped_function(*args, **kwargs):
+            key = make_cache_key(kwargs, ignore)
+            data = cache.get(key)
+            if data is not None:
+                return data
+
+            async def load() -> JsonData:
+                ret = f(*args, **kwargs)
+                if inspect.isawaitable(ret):
+                    ret = await ret
+                result = prepare_cached_data(ret)
+                cache.set(key, result, time.time() + route_ttl)
+                return result
+
+            # 缓存完整结果，字段选择在写出时应用
+            with full_fields():
+                return await flight.do(key, load)
+
+        return wrapped_function
+
+    return decorator
@@ -0,0 +1,184 @@
+import asyncio
+import random
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from _321CQU.service import ServiceEnum
+from grpc import StatusCode
+from grpc.aio import AioRpcError
+from pydantic import BaseModel, Field
+
+from utils.Metrics import MetricsRegistry
+from utils.Settings import ConfigManager
+
+__all__ = ['RetryPolicy', 'NON_RETRYABLE', 'register_retry_policy', 'get_retry_policy', 'call_with_policy']
+
+
+class RetryPolicy(BaseModel):
+    """
+    gRPC方法的重试策略，仅应用于幂等的读取方法
+    """
+    max_attempts: int = Field(default=3, ge=1, title="最多尝试次数（含首次调用）")
+    retryable_codes: List[StatusCode] = Field(default=[StatusCode.UNAVAILABLE], title="可重试的状态码")
+    initial_backoff: float = Field(default=0.05, gt=0, title="首次重试的最大退避秒数")
+    max_backoff: float = Field(default=1.0, gt=0, title="最大退避秒数")
+    hedging_percentile: Optional[float] = Field(default=None, gt=0, lt=100,
+                                                title="延迟超过该百分位仍未返回时发起对冲请求，为None时不对冲")
+
+
+# 写操作使用该策略声明不可重试
+NON_RETRYABLE = RetryPolicy(max_attempts=1, retryable_codes=[])
+
+_policies: Dict[Tuple[ServiceEnum, str], RetryPolicy] = {}
+
+
+def register_retry_policy(service: ServiceEnum, method: str, policy: RetryPolicy) -> None:
+    """
+    声明gRPC方法的重试策略，未声明的方法不重试
+
+    :param service: 方法所属的服务
+    :param method: stub上的方法名
+    :param policy: 重试策略
+    """
+    _policies[(service, method)] = policy
+
+
+def get_retry_policy(service: ServiceEnum, method: str) -> Optional[RetryPolicy]:
+    return _policies.get((service, method))
+
+
+class _RetryBudget:
+    """
+    服务级别的重试令牌桶，每次首次调用存入`ratio`个令牌，每次重试或对冲消耗一个令牌，
+    使重试与对冲请求不超过正常流量的固定比例
+    """
+
+    def __init__(self, ratio: float, max_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class _LatencyTracker:
+    """
+    记录最近若干次成功调用的延迟，用于计算对冲延迟
+    """
+    _MIN_SAMPLES = 20
+
+    def __init__(self, size: int = 256):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._sorted: Optional[List[float]] = None
+
+    def record(self, latency: float) -> None:
+        self._samples.append(latency)
+        self._sorted = None
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if len(self._samples) < self._MIN_SAMPLES:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        return self._sorted[min(len(self._sorted) - 1, int(len(self._sorted) * percentile / 100))]
+
+
+_config = ConfigManager()
+_BUDGET_RATIO = float(_config.get_config_with_default('RetrySetting', 'budget_ratio', 0.1))
+_BUDGET_MAX = float(_config.get_config_with_default('RetrySetting', 'budget_max', 10))
+
+_budgets: Dict[ServiceEnum, _RetryBudget] = defaultdict(lambda: _RetryBudget(_BUDGET_RATIO, _BUDGET_MAX))
+_trackers: Dict[Tuple[ServiceEnum, str], _LatencyTracker] = defaultdict(_LatencyTracker)
+_stats: Dict[str, Dict[str, int]] = defaultdict(
+    lambda: {'calls': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0, 'budget_exhausted': 0})
+MetricsRegistry().register('grpc_retry', lambda: {
+    'methods': dict(_stats), 'budgets': {service.name: budget.tokens for service, budget in _budgets.items()}})
+
+
+async def call_with_policy(service: ServiceEnum, method: str, policy: RetryPolicy, timeout: Optional[float],
+                           attempt: Callable[[Optional[float]], Awaitable[Any]]) -> Any:
+    """
+    按重试策略执行调用
+
+    可重试状态码的失败以full jitter指数退避重试；设置了hedging_percentile时，
+    首次请求超过该百分位延迟仍未返回则发起第二个请求，先成功者作为结果，另一个被取消。
+    重试与对冲均消耗服务的重试令牌，令牌不足时不再重试或对冲
+    :param service: 方法所属的服务
+    :param method: stub上的方法名
+    :param policy: 重试策略
+    :param timeout: 总的剩余时间预算，为None时不限制
+    :param attempt: 以单次调用的timeout为参数执行一次调用
+    """
+    budget = _budgets[service]
+    tracker = _trackers[(service, method)]
+    stats = _stats[f'{service.name}.{method}']
+    stats['calls'] += 1
+    budget.deposit()
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    def remaining() -> Optional[float]:
+        return None if deadline is None else deadline - time.monotonic()
+
+    async def timed_attempt() -> Any:
+        start = time.monotonic()
+        result = await attempt(remaining())
+        tracker.record(time.monotonic() - start)
+        return result
+
+    async def hedged_attempt() -> Any:
+        delay = tracker.percentile(policy.hedging_percentile) if policy.hedging_percentile is not None else None
+        if delay is None:
+            return await timed_attempt()
+
+        tasks = [asyncio.ensure_future(timed_attempt())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return tasks[0].result()
+            if not budget.withdraw():
+                stats['budget_exhausted'] += 1
+                return await tasks[0]
+
+            stats['hedges'] += 1
+            tasks.append(asyncio.ensure_future(timed_attempt()))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is tasks[1]:
+                            stats['hedge_wins'] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            return await hedged_attempt()
+        except AioRpcError as e:
+            if e.code() not in policy.retryable_codes or attempts >= policy.max_attempts:
+                raise
+            backoff = random.uniform(0, min(policy.max_backoff, policy.initial_backoff * 2 ** (attempts - 1)))
+            left = remaining()
+            if left is not None and left <= backoff:
+                raise
+            if not budget.withdraw():
+                stats['budget_exhausted'] += 1
+                raise
+            stats['retries'] += 1
+            await asyncio.sleep(backoff)
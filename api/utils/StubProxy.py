@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import time
+from collections import defaultdict
+from functools import partial
+from typing import Any, Dict, Hashable, Optional
+
+from _321CQU.service import ServiceEnum
+from _321CQU.tools import gRPCManager
+from google.protobuf.message import Message
+from grpc import StatusCode
+from grpc.aio import AioRpcError
+
+from api.utils.CircuitBreaker import get_service_guard
+from api.utils.Deadline import is_client_deadline, remaining_time
+from api.utils.RetryPolicy import NON_RETRYABLE, call_with_policy, get_retry_policy
+from utils.ChannelPool import count_timeouts
+from utils.Exceptions import _321CQUException
+from utils.Metrics import MetricsRegistry
+from utils.SingleFlight import SingleFlight
+
+__all__ = ['StubProxy']
+
+_flight = SingleFlight()
+_stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {'calls': 0, 'merged': 0, 'deadline_fallbacks': 0})
+# 进行中的合并调用的发起者截止时间（time.monotonic时间）
+_leader_deadlines: Dict[Hashable, Optional[float]] = {}
+MetricsRegistry().register('grpc_coalescing', lambda: {'methods': dict(_stats), **_flight.stats()})
+
+
+class StubProxy:
+    """
+    gRPC stub的代理，合并并发的相同调用（服务、方法与序列化后的请求均相同）
+
+    声明为NON_RETRYABLE的写操作不合并，每次调用都单独发送到后端；
+    实际调用在独立的Task中获取stub并执行，某个调用者被取消不会影响其他调用者，所有调用者都取消后才取消该调用；
+    实际调用受该服务的熔断器与并发限制保护，拒绝时直接返回503；
+    未指定timeout时以当前请求剩余的时间预算作为gRPC截止时间，已声明RetryPolicy的方法按策略重试与对冲；
+    合并的调用以发起者的截止时间执行，发起者先于自身超时时，其余调用者以自身剩余的预算重新调用；
+    调用异常会原样抛给所有调用者，由handle_grpc_error统一处理。合并的调用者共享同一响应消息，不应修改该消息。
+    用法与`grpc_manager.get_stub`一致：
+        async with StubProxy(grpc_manager, ServiceEnum.XXX) as stub:
+            res = await stub.Method(request)
+    """
+
+    def __init__(self, grpc_manager: gRPCManager, service: ServiceEnum):
+        self._grpc_manager = grpc_manager
+        self._service = service
+
+    async def __aenter__(self) -> 'StubProxy':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        return None
+
+    def __getattr__(self, method: str):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return partial(self._call, method)
+
+    async def _call(self, method: str, request: Message, **kwargs) -> Any:
+        stats = _stats[f'{self._service.name}.{method}']
+        stats['calls'] += 1
+        timeout = kwargs.pop('timeout', None)
+        client_deadline = False
+        if timeout is None:
+            timeout = remaining_time()
+            client_deadline = is_client_deadline()
+        if kwargs or get_retry_policy(self._service, method) is NON_RETRYABLE:
+            # 写操作不合并，metadata等附加参数不参与合并
+            return await self._invoke(method, request, timeout, client_deadline, kwargs)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        key = (self._service.name, method, client_deadline,
+               hashlib.blake2b(request.SerializeToString(deterministic=True), digest_size=16).digest())
+        merged = key in _flight
+        if merged:
+            stats['merged'] += 1
+            leader_deadline = _leader_deadlines.get(key)
+        else:
+            _leader_deadlines[key] = deadline
+        call = _flight.do(key, partial(self._lead, key, method, request, timeout, client_deadline, kwargs))
+        if not merged:
+            return await call
+
+        # 合并的调用以发起者的截止时间调用后端，其余调用者各自等待至自身截止时间
+        try:
+            return await (call if timeout is None else asyncio.wait_for(call, timeout))
+        except asyncio.TimeoutError:
+            raise _321CQUException(error_info='请求超时', status_code=504)
+        except AioRpcError as e:
+            # 发起者的截止时间早于自身时，发起者的超时不代表本调用者超时，以自身剩余的预算单独调用
+            if e.code() != StatusCode.DEADLINE_EXCEEDED or leader_deadline is None or \
+                    (deadline is not None and deadline <= leader_deadline):
+                raise
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    raise _321CQUException(error_info='请求超时', status_code=504)
+            stats['deadline_fallbacks'] += 1
+            return await self._invoke(method, request, timeout, client_deadline, kwargs)
+
+    async def _lead(self, key: Hashable, method: str, request: Message, timeout: Optional[float],
+                    client_deadline: bool, kwargs: Dict[str, Any]) -> Any:
+        try:
+            return await self._invoke(method, request, timeout, client_deadline, kwargs)
+        finally:
+            _leader_deadlines.pop(key, None)
+
+    async def _invoke(self, method: str, request: Message, timeout: Optional[float], client_deadline: bool,
+                      kwargs: Dict[str, Any]) -> Any:
+        policy = get_retry_policy(self._service, method)
+        if policy is None:
+            return await self._attempt(method, request, timeout, client_deadline, kwargs)
+        return await call_with_policy(self._service, method, policy, timeout,
+                                      partial(self._attempt, method, request,
+                                              client_deadline=client_deadline, kwargs=kwargs))
+
+    async def _attempt(self, method: str, request: Message, timeout: Optional[float], client_deadline: bool,
+                       kwargs: Dict[str, Any]) -> Any:
+        # 客户端缩短截止时间导致的超时不计入熔断器与连接池的实例健康统计
+        token = count_timeouts.set(not client_deadline)
+        try:
+            async with get_service_guard(self._service).admit(method, count_timeouts=not client_deadline):
+                async with self._grpc_manager.get_stub(self._service) as stub:
+                    return await getattr(stub, method)(request, timeout=timeout, **kwargs)
+        finally:
+            count_timeouts.reset(token)
@@ -0,0 +1,309 @@
+import base64
+import types
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type, Union, get_args, get_origin
+
+from google.protobuf.descriptor import Descriptor, FieldDescriptor
+from google.protobuf.message import Message
+from pydantic import BaseModel, TypeAdapter
+
+from api.utils.ApiInterface import JsonData, get_field_selection, select_fields
+from api.utils.tools import message_to_dict
+from utils.Settings import ConfigManager
+
+try:
+    from google.protobuf.internal.type_checkers import ToShortestFloat
+except ImportError:  # pragma: no cover
+    ToShortestFloat = float
+
+__all__ = ['MessageTranscoder', 'get_transcoder', 'transcode', 'transcode_items', 'to_json_data',
+           'set_strict_transcoding']
+
+_Converter = Callable[[Any], Any]
+# 接受子字段选择(include, exclude)的转换函数，仅为对应模型的消息字段生成
+_SelectiveConverter = Callable[[Any, Optional[dict], Optional[dict]], Any]
+
+# 严格模式下仍按 message_to_dict -> model_validate 的原路径校验，转码结果不一致时抛出异常，供测试使用
+_strict = ConfigManager().get_config_with_default('TranscodeSetting', 'strict', 'false').lower() == 'true'
+
+
+def set_strict_transcoding(enabled: bool) -> None:
+    global _strict
+    _strict = enabled
+
+
+_PROTO_PYTHON_TYPES = {
+    FieldDescriptor.CPPTYPE_INT32: int, FieldDescriptor.CPPTYPE_INT64: int,
+    FieldDescriptor.CPPTYPE_UINT32: int, FieldDescriptor.CPPTYPE_UINT64: int,
+    FieldDescriptor.CPPTYPE_DOUBLE: float, FieldDescriptor.CPPTYPE_FLOAT: float,
+    FieldDescriptor.CPPTYPE_BOOL: bool, FieldDescriptor.CPPTYPE_STRING: str,
+}
+
+
+def _unwrap_optional(annotation: Any) -> Any:
+    if get_origin(annotation) in (Union, types.UnionType):
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+def _is_model(annotation: Any) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
+
+
+def _element_selector(selector: Optional[dict]) -> Optional[dict]:
+    """
+    列表或字典字段的选择中元素部分的选择，`__all__: True`等同于不选择
+    """
+    if selector is None:
+        return None
+    sub = selector.get('__all__')
+    return sub if isinstance(sub, dict) else None
+
+
+class MessageTranscoder:
+    """
+    按protobuf描述符与pydantic模型预先编译的转码器
+
+    直接将protobuf消息转换为与`model.model_validate(message_to_dict(message)).model_dump(mode='json')`
+    一致的json原生对象，省去中间字典、模型校验与模型构建；
+    传入字段选择时未选择的字段（包括嵌套消息中的字段）不会被转换
+    """
+
+    def __init__(self, descriptor: Descriptor, model: Type[BaseModel]):
+        self.descriptor = descriptor
+        self.model = model
+        self._fields: List[Tuple[str, str, _Converter, bool, Any, Optional[_SelectiveConverter]]] = []
+
+    def compile(self) -> None:
+        for name, field_info in self.model.model_fields.items():
+            proto_field = self.descriptor.fields_by_name.get(name)
+            if proto_field is None:
+                if field_info.is_required():
+                    raise TypeError(f"{self.model.__name__}.{name} not found in {self.descriptor.full_name}")
+                default = TypeAdapter(field_info.annotation).dump_python(
+                    field_info.get_default(call_default_factory=True), mode='json')
+                self._fields.append((name, '', _identity, False, default, None))
+                continue
+
+            # 单个消息字段、oneof成员与proto3 optional标量（位于合成oneof中）可区分是否设置，
+            # 未设置时message_to_dict省略该字段，模型取默认值
+            has_presence = proto_field.label != FieldDescriptor.LABEL_REPEATED and \
+                (proto_field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE or proto_field.containing_oneof is not None)
+            default = None
+            if has_presence and not field_info.is_required():
+                default = TypeAdapter(field_info.annotation).dump_python(
+                    field_info.get_default(call_default_factory=True), mode='json')
+            self._fields.append((name, proto_field.name, self._compile_field(proto_field, field_info.annotation),
+                                 has_presence and not field_info.is_required(), default,
+                                 self._compile_selective(proto_field, field_info.annotation)))
+
+    def to_python(self, message: Message, include: Optional[dict] = None,
+                  exclude: Optional[dict] = None) -> Dict[str, Any]:
+        """
+        :param include: pydantic格式的字段选择，仅转换所选字段
+        :param exclude: pydantic格式的字段选择，不转换所选字段
+        """
+        if include is not None or exclude is not None:
+            return self._to_python_selected(message, include, exclude)
+        result = {}
+        for name, proto_name, converter, use_default_when_unset, default, _ in self._fields:
+            if not proto_name or (use_default_when_unset and not message.HasField(proto_name)):
+                result[name] = default
+            else:
+                result[name] = converter(getattr(message, proto_name))
+        return result
+
+    def _to_python_selected(self, message: Message, include: Optional[dict],
+                            exclude: Optional[dict]) -> Dict[str, Any]:
+        result = {}
+        for name, proto_name, converter, use_default_when_unset, default, selective in self._fields:
+            sub_include = sub_exclude = None
+            if include is not None:
+                sub_include = include.get(name)
+                if sub_include is None:
+                    continue
+                if sub_include is True:
+                    sub_include = None
+            if exclude is not None:
+                sub_exclude = exclude.get(name)
+                if sub_exclude is True:
+                    continue
+
+            if not proto_name or (use_default_when_unset and not message.HasField(proto_name)):
+                value = select_fields(default, sub_include, sub_exclude)
+            elif sub_include is None and sub_exclude is None:
+                value = converter(getattr(message, proto_name))
+            elif selective is not None:
+                value = selective(getattr(message, proto_name), sub_include, sub_exclude)
+            else:
+                # 非模型字段（dict等）无法在转换时选择，转换后裁剪
+                value = select_fields(converter(getattr(message, proto_name)), sub_include, sub_exclude)
+            result[name] = value
+        return result
+
+    @staticmethod
+    def _compile_selective(proto_field: FieldDescriptor, annotation: Any) -> Optional[_SelectiveConverter]:
+        """
+        为对应pydantic模型的消息字段（含列表与字典中的元素）生成可传入子字段选择的转换函数，
+        列表与字典中的元素以`__all__`表示，与ApiInterface中的字段选择格式一致
+        """
+        annotation = _unwrap_optional(annotation)
+        if proto_field.message_type is None:
+            return None
+
+        if proto_field.message_type.GetOptions().map_entry:
+            value_field = proto_field.message_type.fields_by_name['value']
+            value_annotation = _unwrap_optional(get_args(annotation)[1]) if len(get_args(annotation)) == 2 else Any
+            if value_field.message_type is None or not _is_model(value_annotation):
+                return None
+            transcoder = get_transcoder(value_field.message_type, value_annotation)
+            return lambda value, include, exclude: {
+                str(k): transcoder.to_python(v, _element_selector(include), _element_selector(exclude))
+                for k, v in value.items()}
+
+        if proto_field.label == FieldDescriptor.LABEL_REPEATED:
+            item_annotation = _unwrap_optional(get_args(annotation)[0]) if get_args(annotation) else Any
+            if not _is_model(item_annotation):
+                return None
+            transcoder = get_transcoder(proto_field.message_type, item_annotation)
+            return lambda value, include, exclude: [
+                transcoder.to_python(v, _element_selector(include), _element_selector(exclude)) for v in value]
+
+        if not _is_model(annotation):
+            return None
+        transcoder = get_transcoder(proto_field.message_type, annotation)
+        return transcoder.to_python
+
+    def _compile_field(self, proto_field: FieldDescriptor, annotation: Any) -> _Converter:
+        annotation = _unwrap_optional(annotation)
+
+        if proto_field.message_type is not None and proto_field.message_type.GetOptions().map_entry:
+            value_annotation = get_args(annotation)[1] if len(get_args(annotation)) == 2 else Any
+            value_converter = self._compile_value(proto_field.message_type.fields_by_name['value'], value_annotation)
+            return lambda value: {str(k): value_converter(v) for k, v in value.items()}
+
+        if proto_field.label == FieldDescriptor.LABEL_REPEATED:
+            item_annotation = get_args(annotation)[0] if get_args(annotation) else Any
+            item_converter = self._compile_value(proto_field, item_annotation)
+            return lambda value: [item_converter(v) for v in value]
+
+        return self._compile_value(proto_field, annotation)
+
+    @staticmethod
+    def _compile_value(proto_field: FieldDescriptor, annotation: Any) -> _Converter:
+        annotation = _unwrap_optional(annotation)
+
+        if proto_field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE:
+            if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+                transcoder = get_transcoder(proto_field.message_type, annotation)
+                return lambda value: transcoder.to_python(value)
+            adapter = TypeAdapter(annotation)
+            return lambda value: adapter.dump_python(adapter.validate_python(message_to_dict(value)), mode='json')
+
+        if proto_field.cpp_type == FieldDescriptor.CPPTYPE_ENUM:
+            if annotation is int:
+                return _identity
+            names = {value.number: value.name for value in proto_field.enum_type.values}
+            if isinstance(annotation, type) and issubclass(annotation, Enum):
+                mapping = {}
+                for number, name in names.items():
+                    if name in annotation.__members__:
+                        mapping[number] = annotation[name].value
+                    else:
+                        try:
+                            mapping[number] = annotation(name).value
+                        except ValueError:
+                            mapping[number] = annotation(number).value
+                return lambda value: mapping[value]
+            return lambda value: names.get(value, value)
+
+        if proto_field.type == FieldDescriptor.TYPE_BYTES:
+            return lambda value: base64.b64encode(value).decode()
+
+        proto_type = _PROTO_PYTHON_TYPES[proto_field.cpp_type]
+        if annotation is proto_type or annotation is Any:
+            return ToShortestFloat if proto_field.cpp_type == FieldDescriptor.CPPTYPE_FLOAT else _identity
+        if annotation is float and proto_type is int:
+            return float
+        if annotation is str and proto_field.cpp_type in (FieldDescriptor.CPPTYPE_INT64,
+                                                          FieldDescriptor.CPPTYPE_UINT64):
+            return str
+
+        # 其他类型（日期等）交由pydantic处理该字段
+        adapter = TypeAdapter(annotation)
+        return lambda value: adapter.dump_python(adapter.validate_python(value), mode='json')
+
+
+_transcoders: Dict[Tuple[str, Type[BaseModel]], MessageTranscoder] = {}
+
+
+def get_transcoder(descriptor: Descriptor, model: Type[BaseModel]) -> MessageTranscoder:
+    """
+    获取（必要时编译）消息类型与模型对应的转码器，编译结果会被缓存
+    """
+    key = (descriptor.full_name, model)
+    transcoder = _transcoders.get(key)
+    if transcoder is None:
+        transcoder = MessageTranscoder(descriptor, model)
+        # 先登记再编译，以支持递归嵌套的消息类型
+        _transcoders[key] = transcoder
+        try:
+            transcoder.compile()
+        except Exception:
+            del _transcoders[key]
+            raise
+    return transcoder
+
+
+def _check_strict(obj: Any, model: Type[BaseModel], expected: BaseModel, include: Optional[dict] = None,
+                  exclude: Optional[dict] = None) -> None:
+    if obj != expected.model_dump(mode='json', include=include, exclude=exclude):
+        raise ValueError(f"Transcoded {model.__name__} differs from validated result")
+
+
+def transcode(message: Message, model: Type[BaseModel]) -> JsonData:
+    """
+    将可信的后端响应直接转码为api_response可写出的data
+
+    model为当前路由的响应模型时直接按请求的字段选择转码，需缓存的结果（user_cache等）始终完整转码
+    :param message: protobuf消息
+    :param model: 与消息对应的pydantic模型，仅用于决定字段与类型
+    """
+    include, exclude = get_field_selection(model)
+    obj = get_transcoder(message.DESCRIPTOR, model).to_python(message, include, exclude)
+    if _strict:
+        _check_strict(obj, model, model.model_validate(message_to_dict(message)), include, exclude)
+    return JsonData(obj, selected=include is not None or exclude is not None)
+
+
+def transcode_items(messages: Iterable[Message], model: Type[BaseModel]) -> List[Dict[str, Any]]:
+    """
+    转码同类型消息列表，用于组装由多个字段构成的响应
+    """
+    transcoder = None
+    result = []
+    for message in messages:
+        if transcoder is None:
+            transcoder = get_transcoder(message.DESCRIPTOR, model)
+        obj = transcoder.to_python(message)
+        if _strict:
+            _check_strict(obj, model, model.model_validate(message_to_dict(message)))
+        result.append(obj)
+    return result
+
+
+def to_json_data(obj: Dict[str, Any], model: Type[BaseModel]) -> JsonData:
+    """
+    包装由transcode_items等组装的json原生对象
+
+    各元素与原路径的一致性已在transcode_items中校验，严格模式下此处仅校验组装的结构与model一致
+    """
+    if _strict:
+        _check_strict(obj, model, model.model_validate(obj))
+    return JsonData(obj)
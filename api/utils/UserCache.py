@@ -0,0 +1,151 @@
+import base64
+import hashlib
+import hmac
+import inspect
+import secrets
+import time
+from collections import Counter
+from functools import wraps
+from multiprocessing import Array
+from typing import Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+from sanic import Sanic
+from sanic_ext.utils.extraction import extract_request
+
+from api.utils.ApiInterface import JsonData, full_fields
+from api.utils.ResponseCache import make_cache_key, prepare_cached_data
+from utils.Cache import LRUCache
+from utils.Metrics import MetricsRegistry
+from utils.Settings import ConfigManager
+
+__all__ = ['user_cache', 'invalidates_user_cache', 'create_shared_generations']
+
+_config = ConfigManager()
+# 每个worker启动时随机生成，用户名仅以加盐摘要形式出现在缓存键中
+_salt = secrets.token_bytes(16)
+_entries = LRUCache(int(_config.get_config_with_default('UserCacheSetting', 'maxsize', 8192)))
+_counter = Counter()
+MetricsRegistry().register('user_response_cache', lambda: {**_entries.stats(), **_counter})
+
+
+def _user_digest(username: str) -> bytes:
+    return hmac.new(_salt, username.encode(), hashlib.sha256).digest()
+
+
+def _user_fernet(username: str, password: str) -> Fernet:
+    """
+    由用户凭据派生缓存加密密钥，没有该用户的凭据无法解密其缓存
+    """
+    key = hashlib.pbkdf2_hmac('sha256', f'{username}\0{password}'.encode(), _salt, 1)
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def create_shared_generations() -> Array:
+    """
+    创建跨worker共享的缓存代际计数，需在主进程启动时（main_process_start）调用并存入`app.shared_ctx.user_cache_generations`
+
+    每个(用户, 命名空间)被哈希到固定槽位，失效时槽位计数加一，所有worker中该槽位的旧条目随即不可达，
+    随后由LRU/TTL自然淘汰；冲突的键共享同一计数，只会导致多余的失效
+    """
+    slot_count = int(_config.get_config_with_default('UserCacheSetting', 'generation_slots', 65536))
+    return Array('Q', slot_count)
+
+
+_local_generations: Optional[Array] = None
+
+
+def _get_generations(app: Sanic) -> Array:
+    global _local_generations
+    generations = getattr(app.shared_ctx, 'user_cache_generations', None)
+    if generations is not None:
+        return generations
+    # 未通过app.run启动（如测试中的ASGI客户端）时退化为进程内计数
+    if _local_generations is None:
+        _local_generations = create_shared_generations()
+    return _local_generations
+
+
+def _generation_slot(generations: Array, username: str, namespace: str) -> int:
+    # 各worker的盐不同，槽位需由不加盐的摘要计算
+    digest = hashlib.blake2b(f'{namespace}\0{username}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % len(generations)
+
+
+def user_cache(namespace: str, ttl: float, *, user_argument: str = 'user'):
+    """
+    需要用户凭据的只读接口的短时缓存装饰器，需放置在`authorized`之下
+
+    缓存键由加盐的用户名摘要与请求参数组成，缓存值使用由用户凭据派生的密钥加密。
+    请求头包含`Cache-Control: no-cache`时跳过缓存并刷新。
+    过期时间可在配置文件`UserCacheSetting`节中以`{namespace}_ttl`覆盖
+    :param namespace: 缓存命名空间，供invalidates_user_cache按命名空间失效
+    :param ttl: 缓存有效秒数
+    :param user_argument: AuthorizedUser注入的参数名
+    """
+    ttl = float(_config.get_config_with_default('UserCacheSetting', f'{namespace}_ttl', ttl))
+    ignore = frozenset((user_argument,))
+
+    def decorator(f):
+        @wraps(f)
+        async def wrapped_function(*args, **kwargs):
+            request = extract_request(*args)
+            user = kwargs[user_argument]
+            generations = _get_generations(request.app)
+            generation = generations.get_obj()[_generation_slot(generations, user.username, namespace)]
+            key = (_user_digest(user.username), namespace, generation, make_cache_key(kwargs, ignore))
+            fernet = _user_fernet(user.username, user.password)
+
+            if 'no-cache' in request.headers.get('cache-control', ''):
+                _counter['bypasses'] += 1
+            else:
+                entry = _entries.get(key)
+                if entry is not None:
+                    try:
+                        return JsonData(payload=fernet.decrypt(entry[0]), etag=entry[1])
+                    except InvalidToken:
+                        # 用户更换密码后旧条目无法解密，视为未命中
+                        _counter['decrypt_failures'] += 1
+
+            # 缓存完整结果，字段选择在写出时应用
+            with full_fields():
+                ret = f(*args, **kwargs)
+                if inspect.isawaitable(ret):
+                    ret = await ret
+            data = prepare_cached_data(ret)
+            _entries.set(key, (fernet.encrypt(data.payload), data.etag), time.time() + ttl)
+            return data
+
+        return wrapped_function
+
+    return decorator
+
+
+def invalidates_user_cache(*namespaces: str, user_argument: str = 'user'):
+    """
+    写操作接口的装饰器，调用后使该用户在指定命名空间中的缓存失效，失效经共享的代际计数对所有worker生效
+
+    :param namespaces: 需要失效的缓存命名空间
+    :param user_argument: AuthorizedUser注入的参数名
+    """
+
+    def decorator(f):
+        @wraps(f)
+        async def wrapped_function(*args, **kwargs):
+            try:
+                ret = f(*args, **kwargs)
+                if inspect.isawaitable(ret):
+                    ret = await ret
+                return ret
+            finally:
+                username = kwargs[user_argument].username
+                generations = _get_generations(extract_request(*args).app)
+                with generations.get_lock():
+                    raw = generations.get_obj()
+                    for namespace in namespaces:
+                        raw[_generation_slot(generations, username, namespace)] += 1
+                _counter['invalidations'] += 1
+
+        return wrapped_function
+
+    return decorator
@@ -0,0 +1,53 @@
+"""
+api_response序列化微基准
+
+对比逐请求参数化BaseApiResponse后序列化的旧方式与预编译序列化函数，在项目根目录下运行：
+
+    python -m benchmark.api_response
+"""
+import timeit
+from typing import Dict, List
+
+from pydantic import BaseModel
+
+from api.utils.ApiInterface import BaseApiResponse, compile_response_serializer
+
+
+class _Item(BaseModel):
+    name: str
+    code: str
+    credit: float
+    instructor: str
+
+
+class _ListResponse(BaseModel):
+    items: List[_Item]
+
+
+def _legacy_serialize(retval, ret) -> bytes:
+    return BaseApiResponse[(retval if retval is not None else Dict)](
+        status=1, msg='success', data=(ret if ret is not None else {})
+    ).model_dump_json().encode()
+
+
+def main(number: int = 20000):
+    data = _ListResponse(items=[_Item(name=f'课程{i}', code=f'CST{i:05}', credit=2.0, instructor=f'教师{i}')
+                                for i in range(20)])
+    serialize = compile_response_serializer(_ListResponse)
+    serialize_empty = compile_response_serializer()
+    assert serialize(data) == _legacy_serialize(_ListResponse, data)
+    assert serialize_empty(None) == _legacy_serialize(None, None)
+
+    cases = [
+        ('legacy  / model', lambda: _legacy_serialize(_ListResponse, data)),
+        ('compiled/ model', lambda: serialize(data)),
+        ('legacy  / empty', lambda: _legacy_serialize(None, None)),
+        ('compiled/ empty', lambda: serialize_empty(None)),
+    ]
+    for name, func in cases:
+        cost = min(timeit.repeat(func, number=number, repeat=5)) / number
+        print(f'{name}: {cost * 1e6:8.2f} us/op')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,13 @@ from sanic import Sanic
 
 from _321CQU.tools.gRPCManager import gRPCManager
 
+from utils.ChannelPool import ChannelPool, PooledgRPCManager, configured_address
 from utils.Exceptions import _321CQUErrorHandler
 from utils.log_config import LogConfig
 from utils.SqlManager import SqlManager, SqliteManager
 from api import *
+from api.utils.RateLimit import create_shared_buckets
+from api.utils.UserCache import create_shared_generations
 
 app = Sanic('API_Gateway', log_config=LogConfig)
 
@@ -15,9 +18,29 @@ app.config.CORS_SUPPORTS_CREDENTIALS = True
 app.error_handler = _321CQUErrorHandler()
 
 app.ext.add_dependency(SqlManager, SqliteManager)
-app.ext.add_dependency(gRPCManager, lambda: gRPCManager())
+app.ext.add_dependency(gRPCManager, lambda: app.ctx.grpc_manager)
 
 app.blueprint(api_urls)
 
+
+@app.main_process_start
+async def setup_shared_ctx(app: Sanic):
+    app.shared_ctx.rate_limit_buckets = create_shared_buckets()
+    app.shared_ctx.user_cache_generations = create_shared_generations()
+
+
+@app.before_server_start
+async def setup_grpc_channels(app: Sanic):
+    app.ctx.channel_pool = ChannelPool(default_address=configured_address)
+    await app.ctx.channel_pool.start()
+    app.add_task(app.ctx.channel_pool.watch())
+    app.ctx.grpc_manager = PooledgRPCManager(app.ctx.channel_pool)
+
+
+@app.after_server_stop
+async def close_grpc_channels(app: Sanic):
+    await app.ctx.channel_pool.close()
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000, access_log=True)
@@ -6,6 +6,7 @@ from sanic import Sanic
 from _321CQU.tools.gRPCManager import gRPCManager, MockGRPCManager
 
 from api import api_urls
+from api.utils.Transcoder import set_strict_transcoding
 from utils.Exceptions import _321CQUErrorHandler
 from utils.SqlManager import SqlManager, SqliteManager
 from utils.log_config import LogConfig
@@ -20,6 +21,7 @@ def app() -> Sanic:
     my_app.ext.add_dependency(gRPCManager, MockGRPCManager)
 
     my_app.blueprint(api_urls)
+    set_strict_transcoding(True)
     return my_app
 
 
@@ -0,0 +1,90 @@
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+import pytest
+from sanic_testing.testing import SanicASGITestClient
+
+from api.utils.ApiInterface import BaseApiResponse, JsonData, compile_data_serializer, compile_response_serializer, \
+    compute_etag, etag_matches, _compile_field_tree, _compile_query_parser, _parse_field_selector
+from test import test_client, app
+from utils.Exceptions import _321CQUException
+
+
+class _Item(BaseModel):
+    name: str
+    credit: float
+
+
+class _ItemsResponse(BaseModel):
+    items: List[_Item]
+    groups: Dict[str, List[_Item]] = {}
+
+
+def test_compiled_serializer_matches_base_api_response():
+    data = _ItemsResponse(items=[_Item(name='高等数学', credit=5.0)])
+    assert compile_response_serializer(_ItemsResponse)(data) == \
+        BaseApiResponse[_ItemsResponse](status=1, msg='success', data=data).model_dump_json().encode()
+    assert compile_response_serializer()(None) == \
+        BaseApiResponse[Dict](status=1, msg='success', data={}).model_dump_json().encode()
+
+
+def test_etag_matches():
+    etag = compute_etag(b'{"items":[]}')
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches(etag[:-1] + '-gzip"', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches(compute_etag(b'{}'), etag)
+
+
+def test_field_selection():
+    data = _ItemsResponse(items=[_Item(name='高等数学', credit=5.0)], groups={'必修': [_Item(name='线性代数', credit=3.0)]})
+    tree = _compile_field_tree(_ItemsResponse)
+    serialize = compile_data_serializer(_ItemsResponse)
+
+    include = _parse_field_selector('items.name,groups.credit', tree)
+    assert include == {'items': {'__all__': {'name': True}}, 'groups': {'__all__': {'__all__': {'credit': True}}}}
+    expected = '{"items":[{"name":"高等数学"}],"groups":{"必修":[{"credit":3.0}]}}'.encode()
+    assert serialize(data, include) == expected
+    # 转码或缓存得到的JsonData与模型的选择结果一致
+    assert serialize(JsonData(data.model_dump(mode='json')), include) == expected
+
+    exclude = _parse_field_selector('groups,items.credit', tree)
+    assert serialize(data, None, exclude) == serialize(JsonData(data.model_dump(mode='json')), None, exclude)
+
+    with pytest.raises(_321CQUException):
+        _parse_field_selector('items.unknown', tree)
+
+
+def test_json_data_split():
+    payload = b'{"items":[{"name":"a","credit":1.0},{"name":"b","credit":2.0}],"groups":{}}'
+    rest, items = JsonData(payload=payload, etag=compute_etag(payload)).split('items')
+    assert rest == {'groups': {}}
+    assert items == [b'{"name":"a","credit":1.0}', b'{"name":"b","credit":2.0}']
+    # 相同ETag的缓存条目复用拆分结果，不再解析
+    assert JsonData(payload=payload, etag=compute_etag(payload)).split('items')[1] is items
+
+
+class _Query(BaseModel):
+    ids: List[int]
+    name: str
+    page: Optional[int] = None
+
+
+def test_query_parser():
+    parse = _compile_query_parser(_Query)
+    # 重复的查询参数传入列表字段，非列表字段只取第一个值
+    query = parse({'ids': ['1', '2'], 'name': ['高等数学', '线性代数'], 'page': ['3']})
+    assert query == _Query(ids=[1, 2], name='高等数学', page=3)
+    assert parse({'ids': ['1'], 'name': ['高等数学']}).ids == [1]
+
+
+@pytest.mark.asyncio
+async def test_api_request_rejects_malformed_body(test_client: SanicASGITestClient):
+    for body in (b'', b'{"apiKey":'):
+        _, response = await test_client.post('/v1/authorization/login', content=body,
+                                             headers={'content-type': 'application/json'})
+        assert response.status == 400
+        assert response.json == {'status': 0, 'msg': '请求参数错误', 'data': None}
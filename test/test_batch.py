@@ -0,0 +1,42 @@
+import pytest
+from sanic_testing.testing import SanicASGITestClient
+
+from test import test_client
+from test.test_login import get_success_login_response
+
+
+@pytest.mark.asyncio
+async def test_batch(test_client: SanicASGITestClient):
+    login_response = await get_success_login_response(test_client)
+    headers = {'Authorization': 'Bearer ' + login_response.token}
+
+    request, response = await test_client.post("/v1/batch", json={'requests': [
+        {'method': 'GET', 'path': '/v1/important_info/homepages'},
+        {'method': 'GET', 'path': '/v1/recruit/score'},
+        {'method': 'GET', 'path': '/v1/not_exist'},
+        {'method': 'POST', 'path': '/v1/batch', 'body': {'requests': []}},
+    ]}, headers=headers)
+    assert response.status == 200
+
+    responses = response.json['data']['responses']
+    assert [item['status'] for item in responses] == [200, 403, 404, 400]
+    assert responses[0]['body']['status'] == 1
+    assert responses[1]['body']['status'] == 0
+
+    request, response = await test_client.post("/v1/batch", json={'requests': [
+        {'method': 'GET', 'path': '/v1/important_info/homepages'}
+    ]})
+    assert response.status == 401
+
+
+@pytest.mark.asyncio
+async def test_batch_rejects_push_routes(test_client: SanicASGITestClient):
+    login_response = await get_success_login_response(test_client)
+    headers = {'Authorization': 'Bearer ' + login_response.token}
+
+    request, response = await test_client.post("/v1/batch", json={'requests': [
+        {'method': 'GET', 'path': '/v1/notification/push', 'query': {'uid': '00'}},
+        {'method': 'GET', 'path': '/v1/notification/push/sse', 'query': {'uid': '00'}},
+    ]}, headers=headers)
+    assert response.status == 200
+    assert [item['status'] for item in response.json['data']['responses']] == [400, 400]
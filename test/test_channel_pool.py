@@ -0,0 +1,182 @@
+import time
+
+import pytest
+from _321CQU.service import ServiceEnum
+from grpc import StatusCode
+from grpc.aio import AioRpcError, Metadata
+
+from utils.ChannelPool import ChannelPool, _Endpoint, count_timeouts
+from utils.ServiceRegistry import ServiceRegistry
+
+
+class _FakeEndpoint:
+    """
+    不建立连接的实例，stub为实例地址
+    """
+    is_ejected = _Endpoint.is_ejected
+
+    def __init__(self, address: str, outstanding: int = 0, healthy: bool = True):
+        self.address = address
+        self.outstanding = outstanding
+        self.healthy = healthy
+        self.latency = None
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+
+    def is_healthy(self) -> bool:
+        return self.healthy
+
+    def stub(self) -> str:
+        return self.address
+
+
+def _make_pool() -> ChannelPool:
+    pool = ChannelPool()
+    pool.failure_threshold = 2
+    pool.ejection_time = 30
+    pool.latency_factor = 3
+    pool.latency_floor = 0.05
+    return pool
+
+
+def test_choose_prefers_less_loaded_endpoint():
+    pool = _make_pool()
+    busy, idle = _FakeEndpoint('busy', outstanding=3), _FakeEndpoint('idle')
+    ejected, unhealthy = _FakeEndpoint('ejected'), _FakeEndpoint('unhealthy', healthy=False)
+    ejected.ejected_until = time.monotonic() + 60
+
+    assert all(pool._choose([busy, idle]) is idle for _ in range(20))
+    assert {pool._choose([busy, idle, ejected, unhealthy]).address for _ in range(50)} <= {'busy', 'idle'}
+    # 全部不可用时仍返回一个实例
+    assert pool._choose([ejected, unhealthy]) in (ejected, unhealthy)
+
+
+def test_eject_and_recover():
+    pool = _make_pool()
+    a, b = _FakeEndpoint('a'), _FakeEndpoint('b', outstanding=5)
+    endpoints = [a, b]
+
+    pool._record(endpoints, a, 0.01, False)
+    pool._record(endpoints, a, 0.01, True)
+    assert not a.is_ejected(time.monotonic())
+    pool._record(endpoints, a, 0.01, True)
+    assert a.is_ejected(time.monotonic()) and a.ejections == 1
+    assert all(pool._choose(endpoints) is b for _ in range(20))
+
+    # 至少保留一个实例在轮换中
+    pool._record(endpoints, b, 0.01, True)
+    pool._record(endpoints, b, 0.01, True)
+    assert not b.is_ejected(time.monotonic())
+
+    # 移出时间结束后重新加入轮换，并重新采样延迟
+    a.ejected_until = time.monotonic() - 1
+    assert a.latency is None
+    assert pool._choose(endpoints) is a
+
+
+def test_eject_high_latency_endpoint():
+    pool = _make_pool()
+    fast, slow = _FakeEndpoint('fast'), _FakeEndpoint('slow')
+    endpoints = [fast, slow]
+
+    pool._record(endpoints, fast, 0.01, False)
+    pool._record(endpoints, slow, 0.02, False)
+    assert not slow.is_ejected(time.monotonic())
+    pool._record(endpoints, slow, 1.0, False)
+    assert slow.is_ejected(time.monotonic())
+
+
+@pytest.mark.asyncio
+async def test_acquire_counts_backend_failures_only():
+    pool = _make_pool()
+    pool.failure_threshold = 1
+    endpoint = _FakeEndpoint('a')
+    pool._endpoints = {ServiceEnum.CourseScoreQuery: [endpoint, _FakeEndpoint('b', outstanding=100)]}
+
+    async def fail(code: StatusCode):
+        with pytest.raises(AioRpcError):
+            async with pool.acquire(ServiceEnum.CourseScoreQuery) as stub:
+                assert stub == 'a'
+                raise AioRpcError(code, Metadata(), Metadata())
+
+    await fail(StatusCode.INVALID_ARGUMENT)
+    token = count_timeouts.set(False)
+    try:
+        await fail(StatusCode.DEADLINE_EXCEEDED)
+    finally:
+        count_timeouts.reset(token)
+    assert not endpoint.is_ejected(time.monotonic())
+    assert endpoint.outstanding == 0 and endpoint.requests == 2
+
+    await fail(StatusCode.UNAVAILABLE)
+    assert endpoint.is_ejected(time.monotonic())
+
+    async with pool.acquire(ServiceEnum.LibraryService) as stub:
+        # 查找不到地址的服务交由gRPCManager原有逻辑处理
+        assert stub is None
+
+
+@pytest.mark.asyncio
+async def test_refresh_from_registry():
+    registry = ServiceRegistry()
+    await registry.init()
+    pool = _make_pool()
+    pool.warmup_timeout = 0.01
+    service = ServiceEnum.CourseScoreQuery.name
+    first, second = '127.0.0.1:1', '127.0.0.1:2'
+
+    try:
+        await registry.register(service, first)
+        await pool.refresh()
+        endpoint = next(e for e in pool._endpoints[ServiceEnum.CourseScoreQuery] if e.address == first)
+
+        await registry.register(service, second)
+        await pool.refresh()
+        addresses = [e.address for e in pool._endpoints[ServiceEnum.CourseScoreQuery]]
+        assert first in addresses and second in addresses
+        # 已有实例保留原有channel与统计
+        assert endpoint in pool._endpoints[ServiceEnum.CourseScoreQuery]
+
+        await registry.deregister(service, first)
+        await pool.refresh()
+        assert first not in [e.address for e in pool._endpoints[ServiceEnum.CourseScoreQuery]]
+    finally:
+        await registry.deregister(service, first)
+        await registry.deregister(service, second)
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_refresh_uses_default_address():
+    await ServiceRegistry().init()
+
+    def default_address(service: ServiceEnum) -> str:
+        if service == ServiceEnum.ApnsService:
+            raise KeyError(service.name)
+        return '127.0.0.1:3'
+
+    pool = ChannelPool(default_address=default_address)
+    pool.warmup_timeout = 0.01
+    try:
+        await pool.refresh()
+        # 未登记地址的服务同样经过连接池，只有查找失败的服务回退到gRPCManager
+        assert ServiceEnum.LibraryService in pool._endpoints
+        assert ServiceEnum.ApnsService not in pool._endpoints
+        assert ServiceEnum.ApnsService in pool._unresolved
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_endpoint_warm_up_and_close():
+    endpoint = _Endpoint('127.0.0.1:1', lambda channel: channel, 2)
+    try:
+        # 预热失败的channel保留在池中由gRPC自动重连，不影响启动
+        await endpoint.warm_up(0.01)
+        assert len(endpoint.channels) == 2
+        assert endpoint.stub() in [channel for channel, _ in endpoint.channels]
+    finally:
+        await endpoint.close(None)
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+from _321CQU.service import ServiceEnum
+
+from api.utils.CircuitBreaker import AdaptiveLimiter, CircuitBreaker, CircuitState, ServiceGuard
+from utils.Exceptions import _321CQUException
+
+
+def test_circuit_breaker_transitions():
+    breaker = CircuitBreaker(ServiceEnum.EduAdminCenter)
+    breaker.min_requests, breaker.failure_ratio, breaker.open_time, breaker.half_open_requests = 4, 0.5, 10, 2
+
+    for failed in (False, True, False, True):
+        assert breaker.allow(0)
+        breaker.record(0, failed)
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow(5)
+
+    # 半开状态只放行有限的探测请求
+    assert breaker.allow(10) and breaker.allow(10)
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert not breaker.allow(10)
+    breaker.record(10, False)
+    breaker.record(10, False)
+    assert breaker.state == CircuitState.CLOSED
+
+
+def test_adaptive_limiter():
+    limiter = AdaptiveLimiter(ServiceEnum.EduAdminCenter)
+    limiter.limit = 2
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+    limiter.release(0.1, False)
+    limiter.release(0.1, False)
+    assert limiter.limit > 2
+
+    limit = limiter.limit
+    assert limiter.try_acquire()
+    limiter.release(1.0, False)
+    assert limiter.limit < limit
+
+
+def test_adaptive_limiter_mixed_latency_methods():
+    limiter = AdaptiveLimiter(ServiceEnum.EduAdminCenter)
+    limiter.limit = 10
+    # 慢方法稳定的高延迟不应因快方法的基准而被视为拥塞
+    for _ in range(50):
+        for method, latency in (('FetchFast', 0.01), ('FetchSlow', 1.0)):
+            assert limiter.try_acquire()
+            limiter.release(latency, False, method)
+    assert limiter.limit >= 10
+
+    limit = limiter.limit
+    assert limiter.try_acquire()
+    limiter.release(5.0, False, 'FetchSlow')
+    assert limiter.limit < limit
+
+
+@pytest.mark.asyncio
+async def test_service_guard_fails_fast():
+    guard = ServiceGuard(ServiceEnum.EduAdminCenter)
+    guard.breaker._open(time.monotonic())
+
+    with pytest.raises(_321CQUException) as exc_info:
+        async with guard.admit():
+            pass
+    assert exc_info.value.status_code == 503
+    assert guard.rejected_by_breaker == 1
@@ -0,0 +1,52 @@
+import gzip
+from types import SimpleNamespace
+
+import pytest
+from sanic.compat import Header
+from sanic.response import HTTPResponse
+
+from api.utils.Compression import compress_response
+
+
+def _make_request(headers: dict) -> SimpleNamespace:
+    return SimpleNamespace(headers=Header(headers), method='GET', route=None, path='/test')
+
+
+@pytest.mark.asyncio
+async def test_not_modified_keeps_representation_etag():
+    body = b'{"items":[' + b','.join([b'"course"'] * 300) + b']}'
+    request = _make_request({'accept-encoding': 'gzip'})
+    response = HTTPResponse(body, headers={'etag': '"abc"'}, content_type='application/json')
+    await compress_response(request, response)
+    assert gzip.decompress(response.body) == body
+    assert response.headers['etag'] == '"abc-gzip"'
+    assert response.headers['vary'] == 'Accept-Encoding'
+
+    # 304与客户端缓存的200表示使用相同的ETag与Vary
+    request = _make_request({'accept-encoding': 'gzip', 'if-none-match': '"abc-gzip"'})
+    response = HTTPResponse(status=304, headers={'etag': '"abc"'})
+    await compress_response(request, response)
+    assert response.headers['etag'] == '"abc-gzip"'
+    assert response.headers['vary'] == 'Accept-Encoding'
+
+    # 未压缩的表示保持原ETag
+    request = _make_request({'accept-encoding': 'gzip', 'if-none-match': '"abc"'})
+    response = HTTPResponse(status=304, headers={'etag': '"abc"'})
+    await compress_response(request, response)
+    assert response.headers['etag'] == '"abc"'
+    assert response.headers['vary'] == 'Accept-Encoding'
+
+
+@pytest.mark.asyncio
+async def test_vary_keeps_existing_values():
+    body = b'{"items":[' + b','.join([b'"course"'] * 300) + b']}'
+    request = _make_request({'accept-encoding': 'gzip'})
+    response = HTTPResponse(body, headers={'vary': 'Authorization'}, content_type='application/json')
+    await compress_response(request, response)
+    assert response.headers['vary'] == 'Authorization, Accept-Encoding'
+
+    # 已包含Accept-Encoding时不重复追加
+    request = _make_request({'accept-encoding': 'gzip', 'if-none-match': '"abc-gzip"'})
+    response = HTTPResponse(status=304, headers={'etag': '"abc"', 'vary': 'Authorization, accept-encoding'})
+    await compress_response(request, response)
+    assert response.headers['vary'] == 'Authorization, accept-encoding'
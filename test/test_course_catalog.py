@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+from utils.CourseCatalog import CourseCatalog
+from utils.SqlManager import SqliteManager
+
+
+def _course(name: str, code: str, instructor: str) -> dict:
+    return {'name': name, 'code': code, 'course_num': None, 'dept': None, 'credit': 2.0, 'instructor': instructor,
+            'session': None}
+
+
+@pytest.fixture
+def catalog(tmp_path) -> CourseCatalog:
+    """
+    使用临时数据库，避免写入DatabaseSetting.dev_path且各测试互不影响
+    """
+    manager = SqliteManager()
+    connect_args, manager.connect_args = manager.connect_args, (str(tmp_path / 'course_catalog.db'),)
+    try:
+        yield CourseCatalog()
+    finally:
+        manager.connect_args = connect_args
+
+
+@pytest.mark.asyncio
+async def test_course_catalog_search(catalog: CourseCatalog):
+    await catalog.init()
+    if not catalog.enabled:
+        pytest.skip('SQLite FTS5 is not available')
+
+    courses = [_course('测试目录高等数学', 'TSTMATH101', '测试目录教师甲'),
+               _course('测试目录线性代数与高等数学', 'TSTMATH102', '测试目录教师乙')]
+    # 未记录过的关键词需回退到后端
+    assert await catalog.search('测试目录高等', None) is None
+
+    await catalog.record('测试目录', None, courses)
+    result = json.loads(await catalog.search('测试目录高等数学', None))
+    assert [course['code'] for course in result] == ['TSTMATH101']
+    result = json.loads(await catalog.search('测试目录', None))
+    assert {course['code'] for course in result} == {'TSTMATH101', 'TSTMATH102'}
+    # 模糊匹配不要求字词相邻
+    assert len(json.loads(await catalog.search('测试目录线性数学', None))) == 1
+    # 同时指定课程与教师关键词时不经过本地目录
+    assert await catalog.search('测试目录', '测试目录教师甲') is None
+
+    # 后端结果中已不存在的课程被移除
+    await catalog.record('测试目录', None, courses[:1])
+    result = json.loads(await catalog.search('测试目录', None))
+    assert [course['code'] for course in result] == ['TSTMATH101']
+
+
+@pytest.mark.asyncio
+async def test_course_catalog_code_prefix(catalog: CourseCatalog):
+    await catalog.init()
+    if not catalog.enabled:
+        pytest.skip('SQLite FTS5 is not available')
+
+    courses = [_course('测试目录高等数学', 'TSTMATH101', '测试目录教师甲'),
+               _course('测试目录线性代数', 'TSTMATH201', '测试目录教师乙')]
+    # 纯字母关键词未被覆盖时仍需回退到后端
+    assert await catalog.search('tstmath10', None) is None
+
+    await catalog.record('tstmath', None, courses)
+    result = json.loads(await catalog.search('tstmath10', None))
+    assert [course['code'] for course in result] == ['TSTMATH101']
+    result = json.loads(await catalog.search('tstmath', None))
+    assert {course['code'] for course in result} == {'TSTMATH101', 'TSTMATH201'}
+
+
+@pytest.mark.asyncio
+async def test_course_catalog_merge_initials(catalog: CourseCatalog):
+    pytest.importorskip('pypinyin')
+    await catalog.init()
+    if not catalog.enabled:
+        pytest.skip('SQLite FTS5 is not available')
+
+    courses = [_course('测试目录高等数学', 'TSTMATH101', '测试目录教师甲'),
+               _course('测试目录线性代数', 'TSTMATH201', '测试目录教师乙')]
+    await catalog.record('测试目录', None, courses)
+
+    # 拼音首字母前缀匹配的课程追加在后端结果之后，已在后端结果中的课程不重复
+    assert await catalog.merge_initials('csmlgd', None, []) == courses[:1]
+    assert await catalog.merge_initials('csml', None, courses[1:]) == [courses[1], courses[0]]
+    # 非纯字母关键词与教师字段不匹配时保持后端结果
+    assert await catalog.merge_initials('测试目录', None, courses[1:]) == courses[1:]
+    assert await catalog.merge_initials(None, 'csmlgd', []) == []
+
+
+@pytest.mark.asyncio
+async def test_course_catalog_refresh(catalog: CourseCatalog):
+    await catalog.init()
+    if not catalog.enabled:
+        pytest.skip('SQLite FTS5 is not available')
+
+    await catalog.record(None, '测试刷新教师', [_course('测试刷新课程', 'TSTREF001', '测试刷新教师')])
+    refresh_interval, catalog.refresh_interval = catalog.refresh_interval, -1
+    calls = []
+
+    async def fetch(course_name, teacher_name):
+        calls.append((course_name, teacher_name))
+        return [_course('测试刷新课程', 'TSTREF002', '测试刷新教师')]
+
+    try:
+        assert await catalog.refresh(fetch) == 1
+        # 已认领的关键词在租约内不会被重复刷新
+        assert await catalog.refresh(fetch) == 0
+    finally:
+        catalog.refresh_interval = refresh_interval
+    assert calls == [(None, '测试刷新教师')]
+    result = json.loads(await catalog.search(None, '测试刷新教师'))
+    assert [course['code'] for course in result] == ['TSTREF002']
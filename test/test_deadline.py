@@ -0,0 +1,93 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+from _321CQU.service import ServiceEnum
+from google.protobuf import type_pb2
+from grpc import StatusCode
+from grpc.aio import AioRpcError, Metadata
+
+from api.utils.CircuitBreaker import ServiceGuard
+from api.utils.Deadline import apply_deadline, is_client_deadline, remaining_time
+from api.utils.StubProxy import StubProxy
+from utils.Exceptions import _321CQUException
+
+
+def _request(timeout=None):
+    headers = {} if timeout is None else {'x-request-timeout': timeout}
+    return SimpleNamespace(name='API_Gateway.TestDeadline.route', headers=headers, ctx=SimpleNamespace())
+
+
+@pytest.mark.asyncio
+async def test_apply_deadline():
+    request = _request()
+    await apply_deadline(request)
+    assert 9 < remaining_time(request) <= 10
+    assert not is_client_deadline(request)
+
+    # 客户端只能缩短预算，缩短时标记为客户端截止时间
+    request = _request('2')
+    await apply_deadline(request)
+    assert 1 < remaining_time(request) <= 2
+    assert is_client_deadline(request)
+
+    request = _request('100')
+    await apply_deadline(request)
+    assert 9 < remaining_time(request) <= 10
+    assert not is_client_deadline(request)
+
+    with pytest.raises(_321CQUException):
+        await apply_deadline(_request('abc'))
+
+    request = _request()
+    request.ctx.deadline = time.monotonic() - 1
+    with pytest.raises(_321CQUException):
+        remaining_time(request)
+
+
+@pytest.mark.asyncio
+async def test_client_deadline_timeouts_not_counted():
+    guard = ServiceGuard(ServiceEnum.CourseScoreQuery)
+    for count_timeouts in (False, True):
+        with pytest.raises(AioRpcError):
+            async with guard.admit(count_timeouts=count_timeouts):
+                raise AioRpcError(StatusCode.DEADLINE_EXCEEDED, Metadata(), Metadata())
+    assert guard.breaker.stats(time.monotonic())['window_failures'] == 1
+
+
+class _SlowStub:
+    def __init__(self):
+        self.calls = 0
+
+    async def Echo(self, request, timeout=None):
+        self.calls += 1
+        if timeout is not None and timeout < 0.05:
+            await asyncio.sleep(timeout)
+            raise AioRpcError(StatusCode.DEADLINE_EXCEEDED, Metadata(), Metadata())
+        await asyncio.sleep(0.05)
+        return request
+
+
+class _SlowManager:
+    def __init__(self):
+        self.stub = _SlowStub()
+
+    @asynccontextmanager
+    async def get_stub(self, service):
+        yield self.stub
+
+
+@pytest.mark.asyncio
+async def test_follower_not_bound_by_leader_deadline():
+    manager = _SlowManager()
+    request = type_pb2.Field(name='deadline')
+    leader = asyncio.ensure_future(StubProxy(manager, ServiceEnum.CourseScoreQuery).Echo(request, timeout=0.01))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(StubProxy(manager, ServiceEnum.CourseScoreQuery).Echo(request, timeout=1))
+
+    with pytest.raises(AioRpcError):
+        await leader
+    assert (await follower).name == 'deadline'
+    assert manager.stub.calls == 2
@@ -1,11 +1,16 @@
+from datetime import datetime, timedelta
+
 import pytest
 from sanic import Sanic, Request
 from sanic.response import json
 from sanic_testing.testing import SanicASGITestClient
 
-from api import authorized, LoginApplyType, AuthorizedUser, TokenPayload
-from api.authorization import _LoginResponse, _RefreshTokenResponse, _decode_token
+from api import authorized, AuthorizationPolicy, LoginApplyType, AuthorizedUser, TokenPayload
+from api.authorization import _LoginResponse, _RefreshTokenResponse, _decode_token, _verify_token, \
+    _verified_token_cache
 from test import test_client, app
+from utils.Exceptions import _321CQUException
+from utils.KeyRing import KeyRing
 from utils.Settings import ConfigManager
 
 _login_params = {
@@ -74,6 +79,59 @@ async def test_refresh_token(test_client: SanicASGITestClient):
     assert token_data.username == 'test2'
     assert token_data.password == '123'
 
+    request, response = await test_client.post(
+        "/v1/authorization/refreshToken",
+        json={'refreshToken': success_login_response.refreshToken}
+    )
+    assert response.status == 401
+
+    request, response = await test_client.post(
+        "/v1/authorization/refreshToken",
+        json={'refreshToken': res.refreshToken}
+    )
+    assert response.status == 200
+
+
+@pytest.mark.asyncio
+async def test_revoke_token(test_client: SanicASGITestClient):
+    success_login_response = await get_success_login_response(test_client)
+
+    request, response = await test_client.post(
+        "/v1/authorization/revokeToken",
+        json={'refreshToken': success_login_response.refreshToken}
+    )
+    assert response.status == 200
+
+    request, response = await test_client.post(
+        "/v1/authorization/refreshToken",
+        json={'refreshToken': success_login_response.refreshToken}
+    )
+    assert response.status == 401
+
+
+@pytest.mark.asyncio
+async def test_revoke_legacy_refresh_token(test_client: SanicASGITestClient):
+    # 不携带jti的旧刷新token同样只能使用一次，且可被吊销
+    refresh_expire_time = int((datetime.now() + timedelta(weeks=1)).timestamp())
+    legacy_token = KeyRing().sign(TokenPayload(timestamp=refresh_expire_time, applyType='WX_Mini_APP',
+                                               username='test2', password='123').model_dump(exclude_none=True))
+
+    request, response = await test_client.post("/v1/authorization/refreshToken",
+                                               json={'refreshToken': legacy_token})
+    assert response.status == 200
+    request, response = await test_client.post("/v1/authorization/refreshToken",
+                                               json={'refreshToken': legacy_token})
+    assert response.status == 401
+
+    legacy_token = KeyRing().sign(TokenPayload(timestamp=refresh_expire_time - 1, applyType='WX_Mini_APP',
+                                               username='test2', password='123').model_dump(exclude_none=True))
+    request, response = await test_client.post("/v1/authorization/revokeToken",
+                                               json={'refreshToken': legacy_token})
+    assert response.status == 200
+    request, response = await test_client.post("/v1/authorization/refreshToken",
+                                               json={'refreshToken': legacy_token})
+    assert response.status == 401
+
 
 @pytest.mark.asyncio
 async def test_authorized_include(app: Sanic):
@@ -131,3 +189,57 @@ async def test_when_no_user(app: Sanic):
         headers={'Authorization': 'Bearer ' + success_login_response.token}
     )
     assert response.status == 401
+
+
+@pytest.mark.asyncio
+async def test_verified_token_cache(test_client: SanicASGITestClient):
+    success_login_response = await get_success_login_response(test_client)
+
+    first = await _verify_token(success_login_response.token)
+    hits = _verified_token_cache.hits
+    second = await _verify_token(success_login_response.token)
+    assert _verified_token_cache.hits == hits + 1
+    assert second is first
+    assert second.username == 'test2'
+
+
+@pytest.mark.asyncio
+async def test_opaque_token(test_client: SanicASGITestClient):
+    request, response = await test_client.post(
+        "/v1/authorization/login",
+        json={**_login_params, 'tokenMode': 'OPAQUE'}
+    )
+    assert response.status == 200
+
+    res = _LoginResponse.model_validate(response.json['data'])
+    assert '.' not in res.token
+    token_data = await _verify_token(res.token)
+    assert token_data.username == 'test2'
+    assert token_data.password == '123'
+
+    with pytest.raises(_321CQUException):
+        await _verify_token(res.refreshToken)
+
+    request, response = await test_client.post(
+        "/v1/authorization/refreshToken",
+        json={'refreshToken': res.refreshToken}
+    )
+    assert response.status == 200
+    refreshed = _RefreshTokenResponse.model_validate(response.json['data'])
+    assert (await _verify_token(refreshed.token)).username == 'test2'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('token', ['garbage', 'a' * 31, 'a' * 31 + '!', 'a.b'])
+async def test_malformed_token(token: str):
+    with pytest.raises(_321CQUException) as e:
+        await _verify_token(token)
+    assert e.value.status_code == 401
+
+
+def test_authorization_policy():
+    assert AuthorizationPolicy().allowed == {LoginApplyType.WX_Mini_APP, LoginApplyType.IOS_APP,
+                                             LoginApplyType.Announcement_Website}
+    assert AuthorizationPolicy(include=[LoginApplyType.Recruit]).allowed == {LoginApplyType.Recruit}
+    assert AuthorizationPolicy(exclude=[LoginApplyType.WX_Mini_APP]).allowed == {
+        LoginApplyType.IOS_APP, LoginApplyType.Announcement_Website}
@@ -0,0 +1,67 @@
+import pytest
+from sanic import Request, Sanic
+from sanic.compat import Header
+from sanic_testing.testing import SanicASGITestClient
+
+from api.utils.ApiInterface import JsonData, compute_etag, _splits
+from api.utils.Pagination import _decode_cursor, _encode_cursor, paginated
+from test import test_client, app
+from test.test_login import get_success_login_response
+from utils.Exceptions import _321CQUException
+
+
+def test_cursor_signature():
+    cursor = _encode_cursor(20, b'a' * 8, b'b' * 8)
+    assert _decode_cursor(cursor) == (20, b'a' * 8, b'b' * 8)
+
+    tampered = ('A' if cursor[0] != 'A' else 'B') + cursor[1:]
+    for invalid in (tampered, cursor[:-2], 'not a cursor'):
+        with pytest.raises(_321CQUException):
+            _decode_cursor(invalid)
+
+
+@pytest.mark.asyncio
+async def test_course_pagination(test_client: SanicASGITestClient):
+    login_response = await get_success_login_response(test_client)
+    headers = {'Authorization': 'Bearer ' + login_response.token}
+
+    params = {'course_name': '数学', 'page_size': 2}
+    request, response = await test_client.get("/v1/course_score_query/course", params=params, headers=headers)
+    assert response.status == 200
+    first = response.json['data']
+    assert len(first['courses']) <= 2
+
+    if first['next_cursor'] is not None:
+        request, response = await test_client.get("/v1/course_score_query/course",
+                                                  params={**params, 'cursor': first['next_cursor']}, headers=headers)
+        assert response.status == 200
+        assert response.json['data']['courses'] != first['courses']
+
+        # 游标不能用于其他查询
+        request, response = await test_client.get("/v1/course_score_query/course",
+                                                  params={'course_name': '物理', 'cursor': first['next_cursor']},
+                                                  headers=headers)
+        assert response.status == 400
+
+
+@pytest.mark.asyncio
+async def test_pagination_slices_split_items(app: Sanic):
+    payload = b'{"items":[1,2,3,4,5],"next_cursor":null,"total":5}'
+
+    @paginated('items', page_size=2)
+    async def fetch(request):
+        return JsonData(payload=payload, etag=compute_etag(payload))
+
+    hits = _splits.hits
+    pages, cursor = [], None
+    while True:
+        url = b'/' if cursor is None else f'/?cursor={cursor}'.encode()
+        page = (await fetch(Request(url, Header({}), '1.1', 'GET', None, app))).obj
+        pages.append(page['items'])
+        assert page['total'] == 5
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert pages == [[1, 2], [3, 4], [5]]
+    # 完整结果仅在首次翻页时拆分，之后的翻页直接切片
+    assert _splits.hits - hits == 2
@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import pytest
+from micro_services_protobuf.protobuf_enum.notification_center import NotificationEvent
+
+from api.utils.PushHub import LocalEventSource, PushEvent, PushHub
+
+
+@pytest.mark.asyncio
+async def test_push_hub_fan_out():
+    events = list(NotificationEvent)
+    hub = PushHub()
+    hub.source = source = LocalEventSource()
+    task = asyncio.create_task(hub.run())
+
+    subscribed = hub.register('00ff', {events[0]})
+    everything = hub.register('00ff')
+    other = hub.register('ff00')
+    try:
+        source.publish(PushEvent(uid='00ff', event=events[0], data={'a': 1}))
+        if len(events) > 1:
+            source.publish(PushEvent(uid='00ff', event=events[1]))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        message = json.loads(await asyncio.wait_for(subscribed.queue.get(), 1))
+        assert message == {'event': events[0].value, 'data': {'a': 1}}
+        assert subscribed.queue.empty()
+        assert everything.queue.qsize() == min(len(events), 2)
+        assert other.queue.empty()
+    finally:
+        task.cancel()
+        for connection in (subscribed, everything, other):
+            hub.unregister(connection)
+    assert hub.stats()['connections'] == 0
+
+
+def test_push_connection_backpressure():
+    hub = PushHub()
+    event = list(NotificationEvent)[0]
+    connection = hub.register('0a0a', None)
+    connection.max_dropped = 3
+    try:
+        for index in range(hub.queue_size + 2):
+            hub.publish(PushEvent(uid='0a0a', event=event, data={'index': index}))
+        # 队列满时丢弃最旧的事件
+        assert connection.queue.qsize() == hub.queue_size
+        assert json.loads(connection.queue.get_nowait())['data'] == {'index': 2}
+        assert not connection.closed.is_set()
+
+        for index in range(4):
+            hub.publish(PushEvent(uid='0a0a', event=event))
+        assert connection.closed.is_set()
+    finally:
+        hub.unregister(connection)
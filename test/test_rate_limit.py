@@ -0,0 +1,97 @@
+import multiprocessing
+from types import SimpleNamespace
+
+import pytest
+from sanic import Request, Sanic
+from sanic.compat import Header
+
+from api.utils import RateLimit
+from api.utils.RateLimit import RateLimiter, RateLimitRule, _acquire, create_shared_buckets
+from test import app
+from utils.Exceptions import _321CQUException
+
+
+def test_token_refill(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(RateLimit, 'time', SimpleNamespace(time=lambda: now[0]))
+    buckets = create_shared_buckets()
+    rule = RateLimitRule(rate=2, burst=2)
+
+    assert _acquire(buckets, 'key', rule) == 0
+    assert _acquire(buckets, 'key', rule) == 0
+    assert _acquire(buckets, 'key', rule) == pytest.approx(0.5)
+    # 其他键使用独立的令牌桶
+    assert _acquire(buckets, 'other', rule) == 0
+
+    now[0] += 0.5
+    assert _acquire(buckets, 'key', rule) == 0
+    assert _acquire(buckets, 'key', rule) > 0
+    # 补充的令牌不超过桶容量
+    now[0] += 60
+    assert _acquire(buckets, 'key', rule) == 0
+    assert _acquire(buckets, 'key', rule) == 0
+    assert _acquire(buckets, 'key', rule) > 0
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_returns_429(app: Sanic):
+    @RateLimiter('test', user_rule=RateLimitRule(rate=0.5, burst=1))
+    async def handler(request):
+        return 'ok'
+
+    def make_request(username: str) -> Request:
+        request = Request(b'/', Header({}), '1.1', 'GET', None, app)
+        request.ctx.token_payload = SimpleNamespace(applyType='WX_Mini_APP', username=username)
+        return request
+
+    assert await handler(make_request('rate_limit_a')) == 'ok'
+    with pytest.raises(_321CQUException) as e:
+        await handler(make_request('rate_limit_a'))
+    assert e.value.status_code == 429
+    assert e.value.headers['Retry-After'] == '2'
+    # 按用户限流，其他用户不受影响
+    assert await handler(make_request('rate_limit_b')) == 'ok'
+
+
+@pytest.mark.asyncio
+async def test_throttled_user_keeps_apply_type_tokens(app: Sanic):
+    @RateLimiter('test_fair', user_rule=RateLimitRule(rate=0.001, burst=1),
+                 apply_type_rule=RateLimitRule(rate=0.001, burst=3))
+    async def handler(request):
+        return 'ok'
+
+    def make_request(username: str) -> Request:
+        request = Request(b'/', Header({}), '1.1', 'GET', None, app)
+        request.ctx.token_payload = SimpleNamespace(applyType='WX_Mini_APP', username=username)
+        return request
+
+    assert await handler(make_request('rate_limit_a')) == 'ok'
+    # 被限流用户的重复请求不消耗请求类型的令牌
+    for _ in range(5):
+        with pytest.raises(_321CQUException):
+            await handler(make_request('rate_limit_a'))
+    assert await handler(make_request('rate_limit_b')) == 'ok'
+    assert await handler(make_request('rate_limit_c')) == 'ok'
+    # 请求类型令牌耗尽时归还用户令牌
+    with pytest.raises(_321CQUException):
+        await handler(make_request('rate_limit_d'))
+    buckets = RateLimit._get_buckets(app)
+    user_rule = RateLimitRule(rate=0.001, burst=1)
+    assert _acquire(buckets, 'test_fair.handler|u|WX_Mini_APP|rate_limit_d', user_rule) == 0
+
+
+def _drain(buckets, key: str, rule: RateLimitRule) -> None:
+    for _ in range(rule.burst):
+        _acquire(buckets, key, rule)
+
+
+def test_buckets_shared_across_processes():
+    buckets = create_shared_buckets()
+    rule = RateLimitRule(rate=0.001, burst=3)
+
+    # 模拟另一个worker耗尽令牌
+    process = multiprocessing.get_context('fork').Process(target=_drain, args=(buckets, 'shared', rule))
+    process.start()
+    process.join(10)
+    assert process.exitcode == 0
+    assert _acquire(buckets, 'shared', rule) > 0
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+from _321CQU.service import ServiceEnum
+from grpc import StatusCode
+from grpc.aio import AioRpcError, Metadata
+
+from api.utils.RetryPolicy import NON_RETRYABLE, RetryPolicy, _trackers, call_with_policy
+
+
+def _rpc_error(code: StatusCode) -> AioRpcError:
+    return AioRpcError(code, Metadata(), Metadata())
+
+
+@pytest.mark.asyncio
+async def test_retry_transient_error():
+    calls = 0
+
+    async def attempt(timeout):
+        nonlocal calls
+        calls += 1
+        if calls < 3:
+            raise _rpc_error(StatusCode.UNAVAILABLE)
+        return 'ok'
+
+    policy = RetryPolicy(max_attempts=3, initial_backoff=0.001)
+    assert await call_with_policy(ServiceEnum.CourseScoreQuery, 'TestRetry', policy, None, attempt) == 'ok'
+    assert calls == 3
+
+
+@pytest.mark.asyncio
+async def test_non_retryable():
+    calls = 0
+
+    async def attempt(timeout):
+        nonlocal calls
+        calls += 1
+        raise _rpc_error(StatusCode.UNAVAILABLE)
+
+    with pytest.raises(AioRpcError):
+        await call_with_policy(ServiceEnum.LibraryService, 'TestNonRetryable', NON_RETRYABLE, None, attempt)
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_cancels_loser():
+    tracker = _trackers[(ServiceEnum.CourseScoreQuery, 'TestHedge')]
+    for _ in range(20):
+        tracker.record(0.01)
+
+    delays = [1, 0]
+    cancelled = []
+
+    async def attempt(timeout):
+        delay = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    policy = RetryPolicy(hedging_percentile=95)
+    assert await call_with_policy(ServiceEnum.CourseScoreQuery, 'TestHedge', policy, None, attempt) == 0
+    await asyncio.sleep(0)
+    assert cancelled == [1]
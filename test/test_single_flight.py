@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from utils.SingleFlight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_merges_concurrent_calls():
+    flight = SingleFlight()
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    results = await asyncio.gather(*[flight.do('key', load) for _ in range(5)])
+    assert results == [1] * 5
+    assert calls == 1
+    assert flight.merged == 4
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_leader_cancel():
+    flight = SingleFlight()
+
+    async def load():
+        await asyncio.sleep(0.01)
+        return 'done'
+
+    leader = asyncio.ensure_future(flight.do('key', load))
+    follower = asyncio.ensure_future(flight.do('key', load))
+    await asyncio.sleep(0)
+    leader.cancel()
+    assert await follower == 'done'
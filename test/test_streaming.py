@@ -0,0 +1,50 @@
+import json
+
+import pytest
+from sanic_testing.testing import SanicASGITestClient
+
+from test import test_client
+from test.test_login import get_success_login_response
+from utils.Settings import ConfigManager
+
+_login_params = {'apiKey': ConfigManager().get_config('ApiKey', 'Recruit'), 'applyType': 'Recruit'}
+
+
+@pytest.mark.asyncio
+async def test_ndjson_stream(test_client: SanicASGITestClient):
+    request, response = await test_client.post("/v1/authorization/login", json=_login_params)
+    headers = {'Authorization': 'Bearer ' + response.json['data']['token']}
+
+    request, response = await test_client.get("/v1/recruit/score",
+                                              headers={**headers, 'Accept': 'application/x-ndjson'})
+    assert response.status == 200
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0] == {'status': 1, 'msg': 'success', 'stream_field': 'scores', 'data': {}}
+    assert len(lines) == 11
+    assert all('course' in line for line in lines[1:])
+
+    request, response = await test_client.get("/v1/recruit/score", headers=headers)
+    assert len(response.json['data']['scores']) == 10
+
+
+@pytest.mark.asyncio
+async def test_ndjson_stream_cached_route(test_client: SanicASGITestClient):
+    login_response = await get_success_login_response(test_client)
+    headers = {'Authorization': 'Bearer ' + login_response.token}
+    params = {'course_name': '数学', 'page_size': 200}
+
+    request, response = await test_client.get("/v1/course_score_query/course", params=params, headers=headers)
+    assert response.status == 200
+    expected = response.json['data']
+
+    # 第二次请求命中共享缓存，直接写出拆分后的各元素
+    for _ in range(2):
+        request, response = await test_client.get("/v1/course_score_query/course", params=params,
+                                                  headers={**headers, 'Accept': 'application/x-ndjson'})
+        assert response.status == 200
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert lines[0] == {'status': 1, 'msg': 'success', 'stream_field': 'courses',
+                            'data': {key: value for key, value in expected.items() if key != 'courses'}}
+        assert lines[1:] == expected['courses']
@@ -0,0 +1,69 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+from _321CQU.service import ServiceEnum
+from google.protobuf import type_pb2
+
+from api.utils.RetryPolicy import NON_RETRYABLE, register_retry_policy
+from api.utils.StubProxy import StubProxy
+
+
+class _FakeStub:
+    def __init__(self):
+        self.calls = 0
+
+    async def Echo(self, request, timeout=None):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return request
+
+    Write = Echo
+
+
+class _FakeManager:
+    def __init__(self):
+        self.stub = _FakeStub()
+
+    @asynccontextmanager
+    async def get_stub(self, service):
+        yield self.stub
+
+
+@pytest.mark.asyncio
+async def test_stub_proxy_coalesces_identical_calls():
+    manager = _FakeManager()
+
+    async def call(name):
+        async with StubProxy(manager, ServiceEnum.CourseScoreQuery) as stub:
+            return await stub.Echo(type_pb2.Field(name=name))
+
+    results = await asyncio.gather(call('a'), call('a'), call('a'), call('b'))
+    assert [res.name for res in results] == ['a', 'a', 'a', 'b']
+    assert manager.stub.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_stub_proxy_survives_caller_cancel():
+    manager = _FakeManager()
+    leader = asyncio.ensure_future(StubProxy(manager, ServiceEnum.CourseScoreQuery).Echo(type_pb2.Field(name='c')))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(StubProxy(manager, ServiceEnum.CourseScoreQuery).Echo(type_pb2.Field(name='c')))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    assert (await follower).name == 'c'
+    assert manager.stub.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_stub_proxy_does_not_coalesce_writes():
+    manager = _FakeManager()
+    register_retry_policy(ServiceEnum.CourseScoreQuery, 'Write', NON_RETRYABLE)
+
+    async def call():
+        async with StubProxy(manager, ServiceEnum.CourseScoreQuery) as stub:
+            return await stub.Write(type_pb2.Field(name='w'))
+
+    await asyncio.gather(call(), call())
+    assert manager.stub.calls == 2
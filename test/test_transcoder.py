@@ -0,0 +1,81 @@
+from typing import List, Optional
+
+from google.protobuf import struct_pb2, type_pb2
+from pydantic import BaseModel
+
+from api.utils.ApiInterface import _compile_field_tree, _parse_field_selector
+from api.utils.Transcoder import get_transcoder, set_strict_transcoding, transcode, transcode_items
+from api.utils.tools import message_to_dict
+
+
+class _Option(BaseModel):
+    name: str
+
+
+class _Field(BaseModel):
+    kind: str
+    name: str
+    number: int
+    packed: bool
+    options: List[_Option]
+    default_value: Optional[str] = None
+
+
+def test_transcode_matches_validated_model():
+    message = type_pb2.Field(kind=type_pb2.Field.TYPE_STRING, name='课程名', number=3,
+                             options=[type_pb2.Option(name='a'), type_pb2.Option(name='b')])
+
+    expected = _Field.model_validate(message_to_dict(message)).model_dump_json().encode()
+    assert transcode(message, _Field).payload == expected
+
+
+def test_transcode_items():
+    messages = [type_pb2.Field(name=str(i), number=i) for i in range(3)]
+    assert transcode_items(messages, _Field) == [
+        _Field.model_validate(message_to_dict(x)).model_dump(mode='json') for x in messages
+    ]
+
+
+class _Value(BaseModel):
+    number_value: Optional[float] = None
+    string_value: Optional[str] = None
+    bool_value: Optional[bool] = None
+
+
+def test_transcode_unset_oneof_scalars():
+    set_strict_transcoding(True)
+    try:
+        for message in (struct_pb2.Value(string_value='a'), struct_pb2.Value(number_value=0),
+                        struct_pb2.Value(bool_value=False)):
+            expected = _Value.model_validate(message_to_dict(message)).model_dump(mode='json')
+            assert transcode(message, _Value).obj == expected
+            assert transcode_items([message], _Value) == [expected]
+        # 未设置的oneof成员为模型默认值而非零值
+        assert transcode(struct_pb2.Value(string_value='a'), _Value).obj == \
+            {'number_value': None, 'string_value': 'a', 'bool_value': None}
+    finally:
+        set_strict_transcoding(False)
+
+
+class _Type(BaseModel):
+    name: str
+    fields: List[_Field]
+    options: List[_Option]
+
+
+def test_transcode_field_selection():
+    message = type_pb2.Type(name='课程', fields=[type_pb2.Field(name='课程名', number=1,
+                                                                 options=[type_pb2.Option(name='a')])],
+                            options=[type_pb2.Option(name='b')])
+    model = _Type.model_validate(message_to_dict(message))
+    transcoder = get_transcoder(message.DESCRIPTOR, _Type)
+    tree = _compile_field_tree(_Type)
+
+    # 未选择的字段不会被转换，结果与模型按相同选择序列化一致
+    include = _parse_field_selector('fields.name,fields.options', tree)
+    assert transcoder.to_python(message, include) == model.model_dump(mode='json', include=include) == \
+        {'fields': [{'name': '课程名', 'options': [{'name': 'a'}]}]}
+    exclude = _parse_field_selector('options,fields.options,fields.kind', tree)
+    assert transcoder.to_python(message, None, exclude) == model.model_dump(mode='json', exclude=exclude)
+    assert transcoder.to_python(message, include, exclude) == \
+        model.model_dump(mode='json', include=include, exclude=exclude)
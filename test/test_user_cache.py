@@ -0,0 +1,53 @@
+import pytest
+from sanic import Request, Sanic
+from sanic.compat import Header
+
+from api.authorization import AuthorizedUser
+from api.utils.UserCache import user_cache, invalidates_user_cache, _generation_slot, _get_generations
+
+
+def _make_request(app: Sanic, headers=None) -> Request:
+    return Request(b'/', Header(headers or {}), '1.1', 'GET', None, app)
+
+
+@pytest.mark.asyncio
+async def test_user_cache(app: Sanic):
+    calls = []
+
+    @user_cache('test.user_cache', ttl=60)
+    async def fetch(request, user: AuthorizedUser, term: str):
+        calls.append((user.username, term))
+        return {'term': term, 'calls': len(calls)}
+
+    @invalidates_user_cache('test.user_cache')
+    async def write(request, user: AuthorizedUser):
+        return None
+
+    alice = AuthorizedUser(username='alice', password='pwd')
+    bob = AuthorizedUser(username='bob', password='pwd')
+    request = _make_request(app)
+
+    first = await fetch(request, user=alice, term='1')
+    assert (await fetch(request, user=alice, term='1')).obj == first.obj
+    assert len(calls) == 1
+
+    # 不同用户、不同参数互不共享
+    await fetch(request, user=bob, term='1')
+    await fetch(request, user=alice, term='2')
+    assert len(calls) == 3
+
+    # 密码变更后旧条目无法解密
+    await fetch(request, user=AuthorizedUser(username='alice', password='new'), term='1')
+    assert len(calls) == 4
+
+    await fetch(_make_request(app, {'cache-control': 'no-cache'}), user=bob, term='1')
+    assert len(calls) == 5
+
+    # 失效写入跨worker共享的代际计数
+    generations = _get_generations(app)
+    slot = _generation_slot(generations, 'bob', 'test.user_cache')
+    generation = generations[slot]
+    await write(request, user=bob)
+    assert generations[slot] == generation + 1
+    await fetch(request, user=bob, term='1')
+    assert len(calls) == 6
@@ -0,0 +1,70 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+__all__ = ['LRUCache']
+
+
+class LRUCache:
+    """
+    带过期时间的LRU缓存
+
+    仅在单个worker的事件循环内使用，不做线程安全处理
+    """
+
+    def __init__(self, maxsize: int):
+        """
+        :param maxsize: 最大缓存条目数，超出时淘汰最久未使用的条目
+        """
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, Tuple[Any, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        value, expire_at = item
+        if expire_at < time.time():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, expire_at: float = math.inf) -> None:
+        """
+        :param key: 缓存键
+        :param value: 缓存值
+        :param expire_at: 过期时间戳（秒），默认永不过期
+        """
+        self._data[key] = (value, expire_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return item[0] if item is not None else default
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[1] >= time.time()
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        return {'size': len(self._data), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
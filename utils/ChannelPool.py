@@ -0,0 +1,298 @@
+import asyncio
+import itertools
+import random
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import grpc
+import micro_services_protobuf.course_score_query.service_pb2_grpc as csq_grpc
+import micro_services_protobuf.edu_admin_center.eac_service_pb2_grpc as eac_grpc
+import micro_services_protobuf.mycqu_service.mycqu_service_pb2_grpc as mycqu_grpc
+from _321CQU.service import ServiceEnum
+from _321CQU.tools import gRPCManager
+from grpc.aio import AioRpcError
+from micro_services_protobuf.control_center import control_center_service_pb2_grpc as cc_grpc
+from micro_services_protobuf.notification_center import service_pb2_grpc as notification_grpc
+from sanic.log import logger
+
+from utils.Metrics import MetricsRegistry
+from utils.ServiceRegistry import ServiceRegistry
+from utils.Settings import ConfigManager
+
+__all__ = ['ChannelPool', 'PooledgRPCManager', 'count_timeouts', 'configured_address']
+
+_STUB_FACTORIES: Dict[ServiceEnum, Callable[[grpc.aio.Channel], Any]] = {
+    ServiceEnum.EduAdminCenter: eac_grpc.EduAdminCenterStub,
+    ServiceEnum.CardService: mycqu_grpc.CardFetcherStub,
+    ServiceEnum.LibraryService: mycqu_grpc.LibraryFetcherStub,
+    ServiceEnum.CourseScoreQuery: csq_grpc.CourseScoreQueryStub,
+    ServiceEnum.ImportantInfoService: cc_grpc.ImportantInfoServiceStub,
+    ServiceEnum.NotificationService: notification_grpc.NotificationStub,
+    ServiceEnum.ApnsService: notification_grpc.ApnsStub,
+    ServiceEnum.WechatService: notification_grpc.WechatStub,
+}
+
+
+
+def configured_address(service: ServiceEnum) -> str:
+    """
+    gRPCManager按原有方式连接该服务时使用的地址，查找失败时抛出异常
+    """
+    host, port = gRPCManager().get_service_config(service)
+    return f"{host}:{port}"
+
+
+_CHANNEL_OPTIONS = [
+    # 同一地址的多个channel各自建立连接，而非共享全局子通道
+    ('grpc.use_local_subchannel_pool', 1),
+    ('grpc.keepalive_time_ms', 30000),
+    ('grpc.keepalive_timeout_ms', 10000),
+    ('grpc.keepalive_permit_without_calls', 1),
+]
+
+_UNHEALTHY_STATES = (grpc.ChannelConnectivity.TRANSIENT_FAILURE, grpc.ChannelConnectivity.SHUTDOWN)
+# 计入实例故障的状态码，其他状态码（参数错误等）与实例健康无关
+_FAILURE_CODES = (grpc.StatusCode.UNAVAILABLE,)
+# 当前调用的超时（DEADLINE_EXCEEDED）是否计入实例故障，截止时间由客户端缩短时由调用方设为False
+count_timeouts: ContextVar[bool] = ContextVar('count_timeouts', default=True)
+# 延迟EWMA的平滑系数
+_LATENCY_ALPHA = 0.2
+
+
+class _Endpoint:
+    """
+    服务的一个后端实例，持有`pool_size`个channel并记录负载与健康状况
+    """
+
+    def __init__(self, address: str, factory: Callable[[grpc.aio.Channel], Any], pool_size: int):
+        self.address = address
+        self.channels: List[Tuple[grpc.aio.Channel, Any]] = []
+        for _ in range(pool_size):
+            channel = grpc.aio.insecure_channel(address, options=_CHANNEL_OPTIONS)
+            self.channels.append((channel, factory(channel)))
+        self._cursor = itertools.count()
+        self.outstanding = 0
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+    def is_healthy(self) -> bool:
+        return any(channel.get_state(try_to_connect=False) not in _UNHEALTHY_STATES for channel, _ in self.channels)
+
+    def stub(self) -> Any:
+        start = next(self._cursor)
+        for offset in range(len(self.channels)):
+            channel, stub = self.channels[(start + offset) % len(self.channels)]
+            if channel.get_state(try_to_connect=False) not in _UNHEALTHY_STATES:
+                return stub
+        return self.channels[start % len(self.channels)][1]
+
+    async def warm_up(self, timeout: float) -> None:
+        results = await asyncio.gather(*[asyncio.wait_for(channel.channel_ready(), timeout)
+                                         for channel, _ in self.channels], return_exceptions=True)
+        failed = [result for result in results if isinstance(result, BaseException)]
+        if failed:
+            logger.warning(f"{len(failed)} gRPC channel(s) to {self.address} not ready after warm-up: {failed[0]!r}")
+
+    async def close(self, grace: Optional[float]) -> None:
+        await asyncio.gather(*[channel.close(grace) for channel, _ in self.channels], return_exceptions=True)
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {'address': self.address, 'outstanding': self.outstanding, 'latency': self.latency,
+                'requests': self.requests, 'errors': self.errors, 'ejections': self.ejections,
+                'ejected': self.is_ejected(now),
+                'states': [channel.get_state(try_to_connect=False).name for channel, _ in self.channels]}
+
+
+class ChannelPool:
+    """
+    由应用生命周期持有的gRPC长连接池，负责服务发现与客户端负载均衡
+
+    各服务的实例地址由ServiceRegistry提供并定期刷新，未登记地址的服务使用default_address给出的地址，
+    每个实例建立`pool_size`个channel；
+    请求使用power of two choices选择未完成请求数较少的实例，连续失败或延迟显著高于其他实例的实例会被暂时移出轮换。
+    只有两处均查找不到地址的服务交由gRPCManager原有逻辑处理
+    """
+
+    def __init__(self, default_address: Optional[Callable[[ServiceEnum], str]] = None):
+        """
+        :param default_address: 注册表中未登记地址时获取服务地址的函数，通常为configured_address
+        """
+        self.default_address = default_address
+        config = ConfigManager()
+        self.pool_size = int(config.get_config_with_default('gRPCChannelSetting', 'pool_size', 2))
+        self.warmup_timeout = float(config.get_config_with_default('gRPCChannelSetting', 'warmup_timeout', 3))
+        self.refresh_interval = float(config.get_config_with_default('gRPCChannelSetting', 'refresh_interval', 30))
+        self.close_grace = float(config.get_config_with_default('gRPCChannelSetting', 'close_grace', 5))
+        self.failure_threshold = int(config.get_config_with_default('gRPCChannelSetting', 'failure_threshold', 5))
+        self.ejection_time = float(config.get_config_with_default('gRPCChannelSetting', 'ejection_time', 30))
+        self.latency_factor = float(config.get_config_with_default('gRPCChannelSetting', 'latency_factor', 3))
+        self.latency_floor = float(config.get_config_with_default('gRPCChannelSetting', 'latency_floor', 0.2))
+
+        self._endpoints: Dict[ServiceEnum, List[_Endpoint]] = {}
+        self._unresolved: Set[ServiceEnum] = set()
+        MetricsRegistry().register('grpc_channels', self.health)
+
+    async def start(self) -> None:
+        """
+        读取注册表并预热所有channel，预热失败的channel保留在池中由gRPC自动重连
+        """
+        await ServiceRegistry().init()
+        await self.refresh()
+
+    async def refresh(self) -> None:
+        """
+        按注册表更新实例列表，新实例预热后加入轮换，已下线实例在处理完进行中的请求后关闭
+        """
+        registry = await ServiceRegistry().load([service.name for service in _STUB_FACTORIES])
+        added: List[_Endpoint] = []
+        retired: List[_Endpoint] = []
+        endpoints: Dict[ServiceEnum, List[_Endpoint]] = {}
+        for service, factory in _STUB_FACTORIES.items():
+            current = {endpoint.address: endpoint for endpoint in self._endpoints.get(service, [])}
+            selected = []
+            for address in registry.get(service.name) or self._default_addresses(service):
+                endpoint = current.pop(address, None)
+                if endpoint is None:
+                    endpoint = _Endpoint(address, factory, self.pool_size)
+                    added.append(endpoint)
+                selected.append(endpoint)
+            if selected:
+                endpoints[service] = selected
+            retired.extend(current.values())
+
+        await asyncio.gather(*[endpoint.warm_up(self.warmup_timeout) for endpoint in added])
+        self._endpoints = endpoints
+        if added or retired:
+            logger.info(f"gRPC endpoints updated, {len(added)} added, {len(retired)} retired")
+        await asyncio.gather(*[endpoint.close(self.close_grace) for endpoint in retired])
+
+    def _default_addresses(self, service: ServiceEnum) -> List[str]:
+        if self.default_address is None:
+            return []
+        try:
+            address = self.default_address(service)
+        except Exception as e:
+            # 同一服务只记录一次，避免每次刷新重复告警
+            if service not in self._unresolved:
+                self._unresolved.add(service)
+                logger.warning(f"No address found for {service.name}, falling back to gRPCManager: {e!r}")
+            return []
+        self._unresolved.discard(service)
+        return [address]
+
+    async def watch(self) -> None:
+        """
+        定期刷新注册表
+        """
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"Refresh gRPC endpoints failed: {e!r}")
+
+    def _choose(self, endpoints: List[_Endpoint]) -> _Endpoint:
+        now = time.monotonic()
+        candidates = [endpoint for endpoint in endpoints if not endpoint.is_ejected(now) and endpoint.is_healthy()]
+        if not candidates:
+            # 全部不可用时仍选择一个实例，由调用结果交给handle_grpc_error处理
+            candidates = endpoints
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return min(first, second, key=lambda endpoint: (endpoint.outstanding, endpoint.latency or 0.0))
+
+    def _record(self, endpoints: List[_Endpoint], endpoint: _Endpoint, latency: float, failed: bool) -> None:
+        endpoint.requests += 1
+        now = time.monotonic()
+        if failed:
+            endpoint.errors += 1
+            endpoint.failures += 1
+            if endpoint.failures >= self.failure_threshold:
+                self._eject(endpoints, endpoint, now, 'consecutive failures')
+            return
+
+        endpoint.failures = 0
+        endpoint.latency = latency if endpoint.latency is None else \
+            _LATENCY_ALPHA * latency + (1 - _LATENCY_ALPHA) * endpoint.latency
+        others = [other.latency for other in endpoints
+                  if other is not endpoint and other.latency is not None and not other.is_ejected(now)]
+        if others and endpoint.latency > max(self.latency_floor, self.latency_factor * min(others)):
+            self._eject(endpoints, endpoint, now, 'high latency')
+
+    def _eject(self, endpoints: List[_Endpoint], endpoint: _Endpoint, now: float, reason: str) -> None:
+        # 至少保留一个实例在轮换中
+        if endpoint.is_ejected(now) or all(other.is_ejected(now) for other in endpoints if other is not endpoint):
+            return
+        endpoint.ejected_until = now + self.ejection_time
+        endpoint.ejections += 1
+        endpoint.failures = 0
+        # 恢复后重新采样延迟
+        endpoint.latency = None
+        logger.warning(f"gRPC endpoint {endpoint.address} ejected for {self.ejection_time}s: {reason}")
+
+    @asynccontextmanager
+    async def acquire(self, service: ServiceEnum):
+        """
+        选择实例并获取stub，退出时记录本次调用的延迟与结果；查找不到服务地址时得到None
+        """
+        endpoints = self._endpoints.get(service)
+        if not endpoints:
+            yield None
+            return
+
+        endpoint = self._choose(endpoints)
+        endpoint.outstanding += 1
+        start = time.monotonic()
+        try:
+            yield endpoint.stub()
+        except AioRpcError as e:
+            failed = e.code() in _FAILURE_CODES or \
+                (e.code() == grpc.StatusCode.DEADLINE_EXCEEDED and count_timeouts.get())
+            self._record(endpoints, endpoint, time.monotonic() - start, failed)
+            raise
+        except Exception:
+            self._record(endpoints, endpoint, time.monotonic() - start, False)
+            raise
+        else:
+            self._record(endpoints, endpoint, time.monotonic() - start, False)
+        finally:
+            endpoint.outstanding -= 1
+
+    def health(self) -> Dict[str, List[Dict[str, Any]]]:
+        now = time.monotonic()
+        return {service.name: [endpoint.stats(now) for endpoint in endpoints]
+                for service, endpoints in self._endpoints.items()}
+
+    async def close(self) -> None:
+        endpoints = [endpoint for endpoints in self._endpoints.values() for endpoint in endpoints]
+        self._endpoints = {}
+        await asyncio.gather(*[endpoint.close(None) for endpoint in endpoints])
+
+
+class PooledgRPCManager(gRPCManager):
+    """
+    从ChannelPool获取stub的gRPCManager，查找不到地址的服务回退到gRPCManager原有逻辑
+    """
+
+    def __init__(self, pool: ChannelPool):
+        super().__init__()
+        self.pool = pool
+
+    @asynccontextmanager
+    async def get_stub(self, service: ServiceEnum):
+        async with self.pool.acquire(service) as stub:
+            if stub is None:
+                async with super().get_stub(service) as stub:
+                    yield stub
+            else:
+                yield stub
@@ -0,0 +1,279 @@
+import asyncio
+import re
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from _321CQU.tools import Singleton
+import ujson
+from pydantic_core import to_json
+from sanic.log import logger
+
+from utils.Exceptions import _321CQUException
+from utils.Metrics import MetricsRegistry
+from utils.Settings import ConfigManager
+from utils.SqlManager import SqliteManager
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:
+    lazy_pinyin = None
+
+__all__ = ['CourseCatalog']
+
+# 中日韩字符逐字切分，使unicode61分词器下的短语查询等价于子串匹配
+_CJK = re.compile(r'([⺀-鿿豈-﫿])')
+_TOKEN = re.compile(r'[^\W_]+')
+_NOT_ALNUM = re.compile(r'[^0-9a-zA-Z]')
+
+# bm25列权重，顺序与course_catalog_fts的列一致
+_BM25 = 'bm25(course_catalog_fts, 4.0, 10.0, 10.0, 2.0, 2.0)'
+
+CourseFetcher = Callable[[Optional[str], Optional[str]], Awaitable[List[Dict[str, Any]]]]
+
+
+def _spaced(text: str) -> str:
+    return _CJK.sub(r' \1 ', text)
+
+
+def _tokens(keyword: str) -> List[str]:
+    return _TOKEN.findall(_spaced(keyword))
+
+
+def _initials(text: str) -> str:
+    if lazy_pinyin is None or not text:
+        return ''
+    return _NOT_ALNUM.sub('', ''.join(lazy_pinyin(text, style=Style.FIRST_LETTER)))
+
+
+def _target(course_name: Optional[str], teacher_name: Optional[str]) -> Optional[Tuple[str, str]]:
+    """
+    :return: (搜索的列, 小写关键词)，同时指定课程与教师关键词时返回None，此类搜索不经过本地目录
+    """
+    if course_name is not None and teacher_name is not None:
+        return None
+    if course_name is not None:
+        return 'name', course_name.strip().lower()
+    return 'instructor', (teacher_name or '').strip().lower()
+
+
+def _is_alphabetic(tokens: List[str]) -> bool:
+    return len(tokens) == 1 and tokens[0].isascii()
+
+
+class CourseCatalog(metaclass=Singleton):
+    """
+    网关本地的课程目录镜像，以SQLite FTS5索引课程代码、课程名与教师名
+
+    后端没有列出全部课程的接口，目录由FindCourseByName的结果增量构建：
+    每个关键词的搜索结果即为包含该关键词的全部课程，此后包含该关键词的搜索均可在本地完成，
+    已记录的关键词按计划重新获取以更新目录，各worker通过租约认领待刷新的关键词，同一关键词只由一个worker刷新。
+    纯字母的搜索在本地完成时同时匹配课程代码前缀与拼音首字母前缀；需回退到后端时，
+    本地的拼音首字母匹配结果（需安装pypinyin）追加在后端结果之后。同时指定课程与教师关键词的搜索不经过本地目录。
+
+    配置位于`CourseCatalogSetting`节：`enabled`、`coverage_ttl`（关键词结果可用于本地搜索的秒数）、
+    `refresh_interval`（关键词重新获取的间隔）、`refresh_period`（刷新任务运行间隔）、
+    `refresh_batch`（每次刷新的关键词数量）、`refresh_lease`（认领关键词后的刷新时限）、`max_idle`（关键词未再使用多久后不再刷新）、`max_results`（本地搜索最多返回的课程数）
+    """
+
+    def __init__(self):
+        config = ConfigManager()
+        self.enabled = config.get_config_with_default('CourseCatalogSetting', 'enabled', 'true').lower() == 'true'
+        self.coverage_ttl = float(config.get_config_with_default('CourseCatalogSetting', 'coverage_ttl', 86400))
+        self.refresh_interval = float(config.get_config_with_default('CourseCatalogSetting', 'refresh_interval', 3600))
+        self.refresh_period = float(config.get_config_with_default('CourseCatalogSetting', 'refresh_period', 60))
+        self.refresh_batch = int(config.get_config_with_default('CourseCatalogSetting', 'refresh_batch', 20))
+        self.refresh_lease = float(config.get_config_with_default('CourseCatalogSetting', 'refresh_lease', 300))
+        self.max_idle = float(config.get_config_with_default('CourseCatalogSetting', 'max_idle', 7 * 86400))
+        self.max_results = int(config.get_config_with_default('CourseCatalogSetting', 'max_results', 1000))
+        self._counter = Counter()
+        MetricsRegistry().register('course_catalog', lambda: {'enabled': self.enabled, **self._counter})
+
+    async def init(self) -> None:
+        if not self.enabled:
+            return
+        try:
+            async with SqliteManager().connect(ignore_error=False) as db:
+                await db.execute(
+                    "CREATE TABLE IF NOT EXISTS course_catalog "
+                    "(id INTEGER PRIMARY KEY, payload TEXT NOT NULL UNIQUE, name TEXT NOT NULL, "
+                    "code TEXT NOT NULL, instructor TEXT NOT NULL)")
+                await db.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS course_catalog_fts USING "
+                    "fts5(code, name, instructor, name_initials, instructor_initials, tokenize='unicode61')")
+                await db.execute(
+                    "CREATE TABLE IF NOT EXISTS course_catalog_query "
+                    "(field TEXT NOT NULL, keyword TEXT NOT NULL, refreshed_at REAL NOT NULL, used_at REAL NOT NULL, "
+                    "claimed_until REAL NOT NULL DEFAULT 0, PRIMARY KEY (field, keyword))")
+        except _321CQUException as e:
+            # SQLite未编译FTS5等情况下停用本地目录，搜索全部交由后端
+            logger.warning(f"Course catalog disabled: {e.error_info}")
+            self.enabled = False
+
+    async def search(self, course_name: Optional[str], teacher_name: Optional[str]) -> Optional[bytes]:
+        """
+        在本地目录中搜索，按相关度排序
+
+        :return: 课程列表的json字节，关键词未被已记录的关键词覆盖或没有结果时返回None，调用方应回退到后端搜索
+        """
+        target = _target(course_name, teacher_name)
+        if not self.enabled or target is None:
+            return None
+        field, keyword = target
+        tokens = _tokens(keyword)
+        if not tokens:
+            return None
+        if not await self._covered(field, keyword):
+            self._counter['misses'] += 1
+            return None
+
+        phrase = '"' + ' '.join(tokens) + '"*'
+        match = f'{field} : {phrase}'
+        if _is_alphabetic(tokens):
+            match += f' OR {field}_initials : {phrase}'
+            if field == 'name':
+                match += f' OR code : {phrase}'
+
+        rows = await self._match(match)
+        if not rows and len(tokens) > 1:
+            # 模糊匹配：各字词均出现即可，不要求相邻
+            rows = await self._match(' AND '.join(f'{field} : "{token}"' for token in tokens))
+            self._counter['fuzzy'] += bool(rows)
+        if not rows:
+            self._counter['misses'] += 1
+            return None
+        self._counter['hits'] += 1
+        return b'[' + b','.join(row[0].encode() for row in rows) + b']'
+
+    async def merge_initials(self, course_name: Optional[str], teacher_name: Optional[str],
+                             courses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        在后端搜索结果之后追加本地拼音首字母前缀匹配的课程，仅对纯字母关键词生效
+
+        :param courses: 后端返回的转码后课程列表
+        """
+        target = _target(course_name, teacher_name)
+        if not self.enabled or target is None or lazy_pinyin is None:
+            return courses
+        field, keyword = target
+        tokens = _tokens(keyword)
+        if not _is_alphabetic(tokens):
+            return courses
+
+        rows = await self._match(f'{field}_initials : "{tokens[0]}"*')
+        known = {to_json(course).decode() for course in courses}
+        extra = [ujson.loads(row[0]) for row in rows if row[0] not in known]
+        self._counter['initials_merged'] += bool(extra)
+        return courses + extra if extra else courses
+
+    async def record(self, course_name: Optional[str], teacher_name: Optional[str],
+                     courses: List[Dict[str, Any]], used: bool = True) -> None:
+        """
+        写入一次后端搜索的完整结果，并移除目录中包含该关键词但已不在结果中的课程
+
+        :param courses: 转码后的课程列表
+        :param used: 是否由用户搜索触发，定时刷新时为False，不延长关键词的保留时间
+        """
+        target = _target(course_name, teacher_name)
+        if not self.enabled or target is None:
+            return
+        field, keyword = target
+        if not _tokens(keyword):
+            return
+        payloads = {to_json(course).decode(): course for course in courses}
+        now = time.time()
+        async with SqliteManager().connect() as db:
+            async with db.execute(f"SELECT id, payload FROM course_catalog WHERE instr(lower({field}), ?) > 0",
+                                  (keyword,)) as cursor:
+                stale = [(row[0],) for row in await cursor.fetchall() if row[1] not in payloads]
+            if stale:
+                await db.executemany("DELETE FROM course_catalog WHERE id = ?", stale)
+                await db.executemany("DELETE FROM course_catalog_fts WHERE rowid = ?", stale)
+
+            for payload, course in payloads.items():
+                name, code, instructor = course.get('name') or '', course.get('code') or '', \
+                    course.get('instructor') or ''
+                async with db.execute(
+                        "INSERT OR IGNORE INTO course_catalog (payload, name, code, instructor) VALUES (?, ?, ?, ?)",
+                        (payload, name, code, instructor)) as cursor:
+                    if cursor.rowcount != 1:
+                        continue
+                    row_id = cursor.lastrowid
+                await db.execute(
+                    "INSERT INTO course_catalog_fts "
+                    "(rowid, code, name, instructor, name_initials, instructor_initials) VALUES (?, ?, ?, ?, ?, ?)",
+                    (row_id, code, _spaced(name), _spaced(instructor), _initials(name), _initials(instructor)))
+
+            await db.execute(
+                "INSERT INTO course_catalog_query (field, keyword, refreshed_at, used_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (field, keyword) DO UPDATE SET refreshed_at = excluded.refreshed_at" +
+                (", used_at = excluded.used_at" if used else ""),
+                (field, keyword, now, now))
+        self._counter['recorded'] += 1
+
+    async def refresh(self, fetch: CourseFetcher) -> int:
+        """
+        认领并重新获取最久未更新的关键词，并清理长期未使用的关键词
+
+        认领时为关键词设置`refresh_lease`秒的租约，租约内其他worker不会重复刷新；刷新失败的关键词在租约到期后重新认领
+
+        :param fetch: 以(course_name, teacher_name)调用后端搜索并返回转码后课程列表的函数
+        :return: 本次刷新的关键词数量
+        """
+        if not self.enabled:
+            return 0
+        now = time.time()
+        async with SqliteManager().execute("DELETE FROM course_catalog_query WHERE used_at < ?",
+                                           (now - self.max_idle,)):
+            pass
+        rows = []
+        async with SqliteManager().execute(
+                "UPDATE course_catalog_query SET claimed_until = ? WHERE rowid IN "
+                "(SELECT rowid FROM course_catalog_query WHERE refreshed_at < ? AND claimed_until < ? "
+                "ORDER BY refreshed_at LIMIT ?) RETURNING field, keyword",
+                (now + self.refresh_lease, now - self.refresh_interval, now, self.refresh_batch)) as cursor:
+            rows = await cursor.fetchall()
+
+        for field, keyword in rows:
+            course_name, teacher_name = (keyword, None) if field == 'name' else (None, keyword)
+            try:
+                courses = await fetch(course_name, teacher_name)
+            except Exception as e:
+                logger.warning(f"Course catalog refresh of {field}={keyword!r} failed: {e!r}")
+                continue
+            await self.record(course_name, teacher_name, courses, used=False)
+        self._counter['refreshed'] += len(rows)
+        return len(rows)
+
+    async def run(self, fetch: CourseFetcher) -> None:
+        """
+        定时刷新目录，参数同refresh
+        """
+        while self.enabled:
+            await asyncio.sleep(self.refresh_period)
+            try:
+                await self.refresh(fetch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Course catalog refresh failed: {e!r}")
+
+    async def _covered(self, field: str, keyword: str) -> bool:
+        """
+        是否有仍在有效期内的已记录关键词是该关键词的子串，此时该关键词的全部结果均已在本地
+        """
+        rows = []
+        async with SqliteManager().execute(
+                "SELECT 1 FROM course_catalog_query WHERE field = ? AND refreshed_at > ? AND instr(?, keyword) > 0 "
+                "LIMIT 1", (field, time.time() - self.coverage_ttl, keyword)) as cursor:
+            rows = await cursor.fetchall()
+        return bool(rows)
+
+    async def _match(self, match: str) -> List[Tuple[str]]:
+        rows = []
+        async with SqliteManager().execute(
+                "SELECT course_catalog.payload FROM course_catalog_fts "
+                "JOIN course_catalog ON course_catalog.id = course_catalog_fts.rowid "
+                f"WHERE course_catalog_fts MATCH ? ORDER BY {_BM25} LIMIT ?", (match, self.max_results)) as cursor:
+            rows = await cursor.fetchall()
+        return rows
@@ -0,0 +1,108 @@
+import base64
+import hashlib
+import json
+import re
+import secrets
+import time
+from typing import Any, Dict, Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from _321CQU.tools import Singleton
+
+from utils.Cache import LRUCache
+from utils.Metrics import MetricsRegistry
+from utils.Settings import ConfigManager
+from utils.SqlManager import SqliteManager
+
+__all__ = ['CredentialVault']
+
+# 会话id为secrets.token_urlsafe(24)生成的32位urlsafe base64字符串
+_SESSION_ID_BYTES = 24
+_SESSION_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{32}')
+
+
+class CredentialVault(metaclass=Singleton):
+    """
+    服务端凭据保险库，以不透明的会话id换取登陆时存入的凭据
+
+    内存层为每个worker独立的LRU缓存，持久层通过SqliteManager在worker间共享。
+    持久层中会话id仅保存其sha256摘要，凭据使用`VaultSetting.secret`（缺省为`ApiKey.jwt_secret`）派生的密钥加密
+    """
+
+    def __init__(self):
+        config = ConfigManager()
+        secret = config.get_config_with_default('VaultSetting', 'secret',
+                                                config.get_config_with_default('ApiKey', 'jwt_secret'))
+        self._fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest()))
+        self._memory = LRUCache(int(config.get_config_with_default('VaultSetting', 'memory_size', 4096)))
+        MetricsRegistry().register('credential_vault', self._memory.stats)
+
+    async def init(self) -> None:
+        """
+        创建数据表并清理过期会话
+        """
+        async with SqliteManager().execute(
+                "CREATE TABLE IF NOT EXISTS credential_vault "
+                "(session_digest TEXT PRIMARY KEY, record BLOB NOT NULL, expire_time INTEGER NOT NULL)"
+        ):
+            pass
+        async with SqliteManager().execute("DELETE FROM credential_vault WHERE expire_time < ?",
+                                           (int(time.time()),)):
+            pass
+
+    async def store(self, record: Dict[str, Any], expire_time: int) -> str:
+        """
+        存入凭据并返回新的会话id
+
+        :param record: 需要保存的凭据，需可被json序列化
+        :param expire_time: 会话过期时间戳
+        """
+        session_id = secrets.token_urlsafe(_SESSION_ID_BYTES)
+        async with SqliteManager().execute(
+                "INSERT INTO credential_vault (session_digest, record, expire_time) VALUES (?, ?, ?)",
+                (self._digest(session_id), self._fernet.encrypt(json.dumps(record).encode()), expire_time)
+        ):
+            pass
+        self._memory.set(session_id, record, expire_time)
+        return session_id
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取会话对应凭据，会话不存在或已过期时返回None
+        """
+        record = self._memory.get(session_id)
+        if record is not None:
+            return record
+
+        async with SqliteManager().execute(
+                "SELECT record, expire_time FROM credential_vault WHERE session_digest = ? AND expire_time >= ?",
+                (self._digest(session_id), int(time.time()))
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+
+        try:
+            record = json.loads(self._fernet.decrypt(row[0]))
+        except InvalidToken:
+            return None
+        self._memory.set(session_id, record, row[1])
+        return record
+
+    async def remove(self, session_id: str) -> None:
+        self._memory.pop(session_id)
+        async with SqliteManager().execute("DELETE FROM credential_vault WHERE session_digest = ?",
+                                           (self._digest(session_id),)):
+            pass
+
+    @staticmethod
+    def is_session_id(token: str) -> bool:
+        """
+        是否符合会话id的格式，格式不符的token无需查询即可拒绝
+        """
+        return _SESSION_ID_PATTERN.fullmatch(token) is not None
+
+    @staticmethod
+    def _digest(session_id: str) -> str:
+        return hashlib.sha256(session_id.encode()).hexdigest()
@@ -18,8 +18,9 @@ class _321CQUException(SanicException):
             quite: Optional[bool] = None,
             context: Optional[Dict[str, Any]] = None,
             extra: Optional[Dict[str, Any]] = None,
+            headers: Optional[Dict[str, Any]] = None,
     ) -> None:
-        super().__init__(message, status_code, quiet=quite, context=context, extra=extra)
+        super().__init__(message, status_code, quiet=quite, context=context, extra=extra, headers=headers)
         self.error_info = error_info if error_info is not None else ""
 
 
@@ -30,7 +31,7 @@ class _321CQUErrorHandler(ErrorHandler):
             if not exception.quite:
                 error_logger.exception(f"request token is {request.token}, request param is {request.body.decode()}")
             return json({'status': 0, 'msg': exception.error_info, 'data': exception.context},
-                        status=exception.status_code)
+                        status=exception.status_code, headers=exception.headers)
         else:
             return super().default(request, exception)
 
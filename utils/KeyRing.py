@@ -0,0 +1,112 @@
+import os
+from typing import Callable, Dict, List, Optional
+
+from jose import jwt, JWTError
+
+from _321CQU.tools import Singleton
+
+from utils.Settings import ConfigManager, BASE_DIR
+
+__all__ = ['KeyRing']
+
+
+class KeyRing(metaclass=Singleton):
+    """
+    JWT签名密钥环，每个worker启动时构建一次
+
+    配置格式如下，未配置`JwtKeySetting`时仅使用`ApiKey.jwt_secret`::
+
+        [JwtKeySetting]
+        kids = 2023a,2023b
+        active_kid = 2023b
+        secret_2023a = xxx
+        secret_2023b = yyy
+
+    `ApiKey.jwt_secret`始终以`default`为kid保留，用于校验不携带kid的旧token
+    """
+    LEGACY_KID = 'default'
+
+    def __init__(self):
+        self._keys: Dict[str, str] = {}
+        self._active_kid: Optional[str] = None
+        self._config_mtime: Optional[float] = None
+        self._rotation_listeners: List[Callable[[], None]] = []
+        self.reload()
+
+    @property
+    def active_kid(self) -> str:
+        return self._active_kid
+
+    @property
+    def kids(self) -> List[str]:
+        return list(self._keys.keys())
+
+    def add_rotation_listener(self, listener: Callable[[], None]) -> None:
+        """
+        :param listener: 有校验密钥被移除或更改时调用的函数
+        """
+        self._rotation_listeners.append(listener)
+
+    def reload(self) -> None:
+        """
+        从配置文件重新读取全部密钥
+        """
+        config = ConfigManager()
+        keys: Dict[str, str] = {}
+        legacy_secret = config.get_config_with_default('ApiKey', 'jwt_secret')
+        if legacy_secret is not None:
+            keys[self.LEGACY_KID] = legacy_secret
+
+        kids = config.get_config_with_default('JwtKeySetting', 'kids')
+        if kids:
+            for kid in (kid.strip() for kid in kids.split(',')):
+                if kid:
+                    keys[kid] = config.get_config('JwtKeySetting', f'secret_{kid}')
+            active_kid = config.get_config('JwtKeySetting', 'active_kid')
+        else:
+            active_kid = self.LEGACY_KID
+
+        if active_kid not in keys:
+            raise KeyError(f"Active jwt key '{active_kid}' not found")
+
+        rotated = any(keys.get(kid) != secret for kid, secret in self._keys.items())
+        self._keys = keys
+        self._active_kid = active_kid
+        self._config_mtime = self._get_config_mtime()
+
+        if rotated:
+            for listener in self._rotation_listeners:
+                listener()
+
+    def reload_if_modified(self) -> None:
+        """
+        配置文件修改时间变化时重新读取密钥
+        """
+        if self._get_config_mtime() != self._config_mtime:
+            self.reload()
+
+    def sign(self, claims: dict) -> str:
+        """
+        使用当前活跃密钥签发token，并在header中写入kid
+        """
+        headers = None if self._active_kid == self.LEGACY_KID else {'kid': self._active_kid}
+        return jwt.encode(claims, self._keys[self._active_kid], headers=headers)
+
+    def decode(self, token: str) -> dict:
+        """
+        根据header中的kid选择密钥校验token
+
+        :raise JWTError: token格式错误、kid未知或签名校验失败
+        """
+        kid = jwt.get_unverified_header(token).get('kid', self.LEGACY_KID)
+        key = self._keys.get(kid)
+        if key is None:
+            raise JWTError(f"Unknown key id '{kid}'")
+        return jwt.decode(token, key)
+
+    @staticmethod
+    def _get_config_mtime() -> Optional[float]:
+        try:
+            return os.path.getmtime(str(BASE_DIR) + "/utils/config.cfg")
+        except OSError:
+            return None
@@ -0,0 +1,24 @@
+from typing import Any, Callable, Dict
+
+from _321CQU.tools import Singleton
+
+__all__ = ['MetricsRegistry']
+
+
+class MetricsRegistry(metaclass=Singleton):
+    """
+    各组件运行指标的登记处，每个worker独立统计
+    """
+
+    def __init__(self):
+        self._providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def register(self, name: str, provider: Callable[[], Dict[str, Any]]) -> None:
+        """
+        :param name: 指标分组名称
+        :param provider: 调用后返回当前指标字典的函数
+        """
+        self._providers[name] = provider
+
+    def collect(self) -> Dict[str, Dict[str, Any]]:
+        return {name: provider() for name, provider in self._providers.items()}
@@ -0,0 +1,125 @@
+import hashlib
+import math
+import time
+
+from _321CQU.tools import Singleton
+
+from utils.Metrics import MetricsRegistry
+from utils.Settings import ConfigManager
+from utils.SqlManager import SqliteManager
+
+__all__ = ['BloomFilter', 'RevocationStore']
+
+
+class BloomFilter:
+    """
+    布隆过滤器，判定不存在时一定不存在，判定存在时可能误判
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        """
+        :param capacity: 预期元素数量
+        :param error_rate: 元素数量不超过capacity时的误判率
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class RevocationStore(metaclass=Singleton):
+    """
+    刷新token吊销列表
+
+    吊销记录持久化在SQLite中，内存中的布隆过滤器用于预检，未被吊销的token（绝大多数情况）无需查询数据库。
+    写入使用`INSERT OR IGNORE`，多个worker并发使用同一刷新token时只有一个能成功
+    """
+
+    def __init__(self):
+        config = ConfigManager()
+        self._capacity = int(config.get_config_with_default('RevocationSetting', 'bloom_capacity', 100000))
+        self._error_rate = float(config.get_config_with_default('RevocationSetting', 'bloom_error_rate', 0.001))
+        self._bloom = BloomFilter(self._capacity, self._error_rate)
+        self._last_seq = 0
+        self.bloom_negatives = 0
+        self.database_checks = 0
+        MetricsRegistry().register('refresh_token_revocation', self.stats)
+
+    async def init(self) -> None:
+        """
+        创建数据表，清理过期记录并根据数据库重建布隆过滤器
+        """
+        async with SqliteManager().execute(
+                "CREATE TABLE IF NOT EXISTS revoked_token "
+                "(seq INTEGER PRIMARY KEY AUTOINCREMENT, jti TEXT NOT NULL UNIQUE, expire_time INTEGER NOT NULL)"
+        ):
+            pass
+        async with SqliteManager().execute("DELETE FROM revoked_token WHERE expire_time < ?", (int(time.time()),)):
+            pass
+        self._bloom = BloomFilter(self._capacity, self._error_rate)
+        self._last_seq = 0
+        await self.sync()
+
+    async def sync(self) -> None:
+        """
+        将其他worker新写入的吊销记录加入布隆过滤器
+        """
+        rows = []
+        async with SqliteManager().execute(
+                "SELECT seq, jti FROM revoked_token WHERE seq > ? ORDER BY seq", (self._last_seq,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+
+        if self._bloom.count + len(rows) > self._bloom.capacity:
+            self._capacity = max(self._capacity * 2, self._bloom.count + len(rows))
+            await self.init()
+            return
+
+        for seq, jti in rows:
+            self._bloom.add(jti)
+            self._last_seq = seq
+
+    async def is_revoked(self, jti: str) -> bool:
+        if jti not in self._bloom:
+            self.bloom_negatives += 1
+            return False
+
+        self.database_checks += 1
+        async with SqliteManager().execute("SELECT 1 FROM revoked_token WHERE jti = ?", (jti,)) as cursor:
+            return await cursor.fetchone() is not None
+
+    async def revoke(self, jti: str, expire_time: int) -> bool:
+        """
+        吊销token
+
+        :param jti: token唯一标识
+        :param expire_time: token过期时间戳，过期后记录可被清理
+        :return: 本次调用是否为首次吊销，为False说明该token已被使用或吊销
+        """
+        inserted = False
+        async with SqliteManager().execute(
+                "INSERT OR IGNORE INTO revoked_token (jti, expire_time) VALUES (?, ?)", (jti, expire_time)
+        ) as cursor:
+            inserted = cursor.rowcount == 1
+        self._bloom.add(jti)
+        return inserted
+
+    def stats(self):
+        return {'bloom_size': self._bloom.count, 'bloom_capacity': self._bloom.capacity,
+                'bloom_negatives': self.bloom_negatives, 'database_checks': self.database_checks}
@@ -0,0 +1,60 @@
+from collections import defaultdict
+from typing import Dict, List
+
+from _321CQU.tools import Singleton
+
+from utils.Settings import ConfigManager
+from utils.SqlManager import SqliteManager
+
+__all__ = ['ServiceRegistry']
+
+
+class ServiceRegistry(metaclass=Singleton):
+    """
+    微服务注册表
+
+    服务地址来自配置文件`gRPCChannelSetting`节中的`{ServiceEnum名称} = host:port[,host:port...]`（静态地址）
+    以及SQLite中的`service_registry`表（可在运行时增删，网关定期刷新）。
+    两处均未登记地址的服务由ChannelPool使用gRPCManager中配置的地址
+    """
+
+    async def init(self) -> None:
+        async with SqliteManager().execute(
+                "CREATE TABLE IF NOT EXISTS service_registry "
+                "(service TEXT NOT NULL, address TEXT NOT NULL, PRIMARY KEY (service, address))"
+        ):
+            pass
+
+    async def load(self, services: List[str]) -> Dict[str, List[str]]:
+        """
+        读取各服务当前的地址列表，静态地址在前，地址去重并保持顺序
+
+        :param services: 需要读取的服务名称（ServiceEnum名称）
+        """
+        config = ConfigManager()
+        addresses: Dict[str, List[str]] = defaultdict(list)
+        for service in services:
+            value = config.get_config_with_default('gRPCChannelSetting', service)
+            if value:
+                addresses[service].extend(address.strip() for address in value.split(',') if address.strip())
+
+        rows = []
+        async with SqliteManager().execute("SELECT service, address FROM service_registry ORDER BY rowid") as cursor:
+            rows = await cursor.fetchall()
+        for service, address in rows:
+            if service in services:
+                addresses[service].append(address)
+
+        return {service: list(dict.fromkeys(value)) for service, value in addresses.items()}
+
+    async def register(self, service: str, address: str) -> None:
+        async with SqliteManager().execute(
+                "INSERT OR IGNORE INTO service_registry (service, address) VALUES (?, ?)", (service, address)
+        ):
+            pass
+
+    async def deregister(self, service: str, address: str) -> None:
+        async with SqliteManager().execute(
+                "DELETE FROM service_registry WHERE service = ? AND address = ?", (service, address)
+        ):
+            pass
@@ -1,4 +1,7 @@
 import os
+from configparser import Error as ConfigParserError
+from typing import Any
+
 from _321CQU.tools import ConfigHandler
 
 __all__ = ['BASE_DIR', 'ConfigManager']
@@ -10,6 +13,16 @@ class ConfigManager(ConfigHandler):
     def __init__(self):
         super().__init__(str(BASE_DIR) + "/utils/config.cfg")
 
+    def get_config_with_default(self, section: str, key: str, default: Any = None) -> Any:
+        """
+        读取配置项，配置文件中不存在该项时返回default
+        """
+        try:
+            value = self.get_config(section, key)
+        except (ConfigParserError, KeyError):
+            return default
+        return default if value is None else value
+
 
 if __name__ == '__main__':
     print(BASE_DIR)
@@ -0,0 +1,48 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, TypeVar
+
+__all__ = ['SingleFlight']
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """
+    合并相同键的并发调用，仅首个调用者真正执行，其余调用者等待同一结果（或同一异常）
+
+    实际执行在独立的Task中进行，某个调用者被取消不会影响其他调用者；所有调用者都被取消后才取消该Task
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, List[Any]] = {}
+        self.executed = 0
+        self.merged = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        :param key: 调用的唯一标识，相同key的并发调用会被合并
+        :param func: 实际执行的异步函数
+        """
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(func())
+            call = [task, 0]
+            self._calls[key] = call
+            task.add_done_callback(lambda _: self._calls.pop(key) if self._calls.get(key) is call else None)
+            self.executed += 1
+        else:
+            self.merged += 1
+
+        call[1] += 1
+        try:
+            return await asyncio.shield(call[0])
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not call[0].done():
+                call[0].cancel()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def stats(self) -> Dict[str, int]:
+        return {'executed': self.executed, 'merged': self.merged, 'in_flight': len(self._calls)}